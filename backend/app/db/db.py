@@ -1,22 +1,34 @@
 """Async connection to the database."""
 
 import os
+import asyncio
+from typing import Optional
+
 import asyncpg
 from pgvector.asyncpg import register_vector
 
 DB_URI = os.environ["DATABASE_URL"]
 
+_pool: Optional[asyncpg.Pool] = None
+_pool_lock = asyncio.Lock()
+
 
 async def get_pool():
     """Async connection to the database. We're keeping a minimum
     number of connections open and alive to we don't
     have to establish a new TCP connection.
+
+    The pool is created once per process and shared by every caller.
     """
+    global _pool
 
-    pool = await asyncpg.create_pool(
-        dsn=DB_URI,
-        min_size=1,
-        max_size=10,
-        init=register_vector,
-    )
-    return pool
+    if _pool is None:
+        async with _pool_lock:
+            if _pool is None:
+                _pool = await asyncpg.create_pool(
+                    dsn=DB_URI,
+                    min_size=1,
+                    max_size=10,
+                    init=register_vector,
+                )
+    return _pool
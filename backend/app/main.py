@@ -1,12 +1,27 @@
 """
-Handle CORS, and initialize all API routes.
+Handle CORS, initialize all API routes, and start background tasks.
 """
 
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.routers import generate, chat, task_analysis, user_insights, status, readme
+from app.rag.embed_jobs import start_embed_workers
+from app.rag.retention import retention_loop
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start background maintenance tasks and cancel them on shutdown."""
+    tasks = [asyncio.create_task(retention_loop()), *start_embed_workers()]
+    yield
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(generate.router)
 app.include_router(chat.router)
 app.include_router(task_analysis.router)
@@ -31,6 +46,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Run-Id"],
 )
 
 
@@ -0,0 +1,237 @@
+"""
+Module for splitting repository files into chunks aligned to code structure.
+
+Character-based splitting cuts functions and classes at arbitrary points and, with
+overlap, produces many near-duplicate chunks. This module instead:
+- Splits Python files at top-level statements using the stdlib `ast` module.
+- Splits JavaScript/TypeScript, Go and Rust files at top-level declarations found
+  with line-based heuristics (declarations starting at column 0).
+- Merges small neighbouring definitions and sub-splits oversized ones so chunk
+  sizes stay bounded.
+- Falls back to LangChain's character splitter for every other file type.
+
+Each chunk is a dict with 'source', 'symbol', 'start_line' and 'chunk' keys.
+"""
+
+import ast
+import os
+import re
+from typing import Dict, List, Optional
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+# Upper bound for a code chunk; definitions larger than this are sub-split.
+MAX_CODE_CHARS = 1500
+# Neighbouring definitions are merged until a chunk reaches at least this size.
+MIN_CODE_CHARS = 300
+
+# Settings for files without a structural splitter.
+TEXT_CHUNK_SIZE = 500
+TEXT_CHUNK_OVERLAP = 50
+
+_JS_DECLARATION = re.compile(
+    r"^(?:export\s+)?(?:default\s+)?(?:declare\s+)?(?:abstract\s+)?(?:async\s+)?"
+    r"(?:function\*?|class|interface|type|enum|const|let|var|namespace)\s+"
+    r"([A-Za-z_$][\w$]*)"
+)
+_GO_DECLARATION = re.compile(
+    r"^(?:func\s+(?:\([^)]*\)\s*)?([A-Za-z_]\w*)|(?:type|var|const)\s+\(?\s*([A-Za-z_]\w*)?)"
+)
+_RUST_DECLARATION = re.compile(
+    r"^(?:pub(?:\([^)]*\))?\s+)?(?:async\s+)?(?:unsafe\s+)?(?:extern\s+\"[^\"]*\"\s+)?"
+    r"(?:fn|struct|enum|trait|impl|mod|type|const|static|union|macro_rules!)\s*"
+    r"(?:<[^>]*>\s*)?([A-Za-z_][\w:]*)?"
+)
+
+_LANGUAGES = {
+    ".js": _JS_DECLARATION,
+    ".jsx": _JS_DECLARATION,
+    ".mjs": _JS_DECLARATION,
+    ".cjs": _JS_DECLARATION,
+    ".ts": _JS_DECLARATION,
+    ".tsx": _JS_DECLARATION,
+    ".go": _GO_DECLARATION,
+    ".rs": _RUST_DECLARATION,
+}
+
+# Lines that belong to the declaration that follows them (comments, attributes,
+# decorators).
+_LEADING_LINE = re.compile(r"^\s*(?://|/\*|\*|#\[|#!\[|@)")
+_PYTHON_LEADING_LINE = re.compile(r"^\s*#")
+
+_text_splitter = RecursiveCharacterTextSplitter(
+    chunk_size=TEXT_CHUNK_SIZE,
+    chunk_overlap=TEXT_CHUNK_OVERLAP,
+    add_start_index=True,
+)
+_code_splitter = RecursiveCharacterTextSplitter(
+    chunk_size=MAX_CODE_CHARS,
+    chunk_overlap=TEXT_CHUNK_OVERLAP,
+    add_start_index=True,
+)
+
+
+def _python_segments(lines: List[str]) -> Optional[List[tuple]]:
+    """
+    Returns (start_line, symbol) boundaries for each top-level Python statement
+    group, or None if the file does not parse.
+    """
+    try:
+        tree = ast.parse("".join(lines))
+    except (SyntaxError, ValueError):
+        return None
+
+    boundaries = []
+    previous_was_definition = True
+    for node in tree.body:
+        is_definition = isinstance(
+            node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+        )
+        if is_definition:
+            start = min([node.lineno] + [d.lineno for d in node.decorator_list])
+            boundaries.append((start, node.name))
+        elif previous_was_definition:
+            # Consecutive module-level statements (imports, constants) are grouped
+            boundaries.append((node.lineno, None))
+        previous_was_definition = is_definition
+    return _attach_leading_lines(lines, boundaries, _PYTHON_LEADING_LINE)
+
+
+def _heuristic_segments(lines: List[str], pattern: re.Pattern) -> List[tuple]:
+    """
+    Returns (start_line, symbol) boundaries for declarations starting at column 0.
+    """
+    boundaries = []
+    for index, line in enumerate(lines):
+        if not line or line[0].isspace():
+            continue
+        match = pattern.match(line)
+        if match:
+            symbol = next((group for group in match.groups() if group), None)
+            boundaries.append((index + 1, symbol))
+    return _attach_leading_lines(lines, boundaries, _LEADING_LINE)
+
+
+def _attach_leading_lines(
+    lines: List[str], boundaries: List[tuple], leading: re.Pattern
+) -> List[tuple]:
+    """
+    Moves each boundary up over the comment, attribute and decorator lines directly
+    above it, without crossing the previous boundary.
+    """
+    adjusted = []
+    for start, symbol in boundaries:
+        floor = adjusted[-1][0] + 1 if adjusted else 1
+        while start > floor and leading.match(lines[start - 2]):
+            start -= 1
+        adjusted.append((start, symbol))
+    return adjusted
+
+
+def _segments_from_boundaries(lines: List[str], boundaries: List[tuple]) -> List[Dict]:
+    """Cuts the file into segments at the given 1-based start lines."""
+    if not boundaries or boundaries[0][0] != 1:
+        boundaries = [(1, None)] + list(boundaries)
+
+    segments = []
+    for i, (start, symbol) in enumerate(boundaries):
+        end = boundaries[i + 1][0] - 1 if i + 1 < len(boundaries) else len(lines)
+        text = "".join(lines[start - 1 : end])
+        if text.strip():
+            segments.append({"symbol": symbol, "start_line": start, "chunk": text})
+    return segments
+
+
+def _merge_and_split(segments: List[Dict]) -> List[Dict]:
+    """
+    Merges small neighbouring segments up to MAX_CODE_CHARS and sub-splits segments
+    that are larger than MAX_CODE_CHARS.
+    """
+    merged = []
+    for segment in segments:
+        if (
+            merged
+            and len(merged[-1]["chunk"]) < MIN_CODE_CHARS
+            and len(merged[-1]["chunk"]) + len(segment["chunk"]) <= MAX_CODE_CHARS
+        ):
+            previous = merged[-1]
+            symbols = [
+                s for s in (previous["symbol"], segment["symbol"]) if s
+            ]
+            previous["symbol"] = ", ".join(dict.fromkeys(symbols)) or None
+            previous["chunk"] += segment["chunk"]
+        else:
+            merged.append(dict(segment))
+
+    result = []
+    for segment in merged:
+        if len(segment["chunk"]) <= MAX_CODE_CHARS:
+            result.append(segment)
+            continue
+        for doc in _code_splitter.create_documents([segment["chunk"]]):
+            offset = doc.metadata["start_index"]
+            result.append(
+                {
+                    "symbol": segment["symbol"],
+                    "start_line": segment["start_line"]
+                    + segment["chunk"].count("\n", 0, max(offset, 0)),
+                    "chunk": doc.page_content,
+                }
+            )
+    return result
+
+
+def chunk_file(path: str, content: str) -> List[Dict]:
+    """
+    Splits a single file into chunks.
+
+    Args:
+        path (str): The file path, used to pick the splitting strategy.
+        content (str): The file content.
+
+    Returns:
+        List[Dict]: Chunks with 'source', 'symbol', 'start_line' and 'chunk' keys.
+            `symbol` is the top-level definition(s) the chunk covers, or None.
+    """
+    if not content.strip():
+        return []
+
+    extension = os.path.splitext(path)[1].lower()
+    lines = content.splitlines(keepends=True)
+
+    boundaries = None
+    if extension == ".py":
+        boundaries = _python_segments(lines)
+    elif extension in _LANGUAGES:
+        boundaries = _heuristic_segments(lines, _LANGUAGES[extension])
+
+    if boundaries:
+        segments = _merge_and_split(_segments_from_boundaries(lines, boundaries))
+    else:
+        segments = [
+            {
+                "symbol": None,
+                "start_line": content.count("\n", 0, max(doc.metadata["start_index"], 0))
+                + 1,
+                "chunk": doc.page_content,
+            }
+            for doc in _text_splitter.create_documents([content])
+        ]
+
+    return [{"source": path, **segment} for segment in segments]
+
+
+def chunk_files(file_contents: List[Dict]) -> List[Dict]:
+    """
+    Splits every file of a repository into chunks.
+
+    Args:
+        file_contents (List[Dict]): A list of files with 'path' and 'content' fields.
+
+    Returns:
+        List[Dict]: Chunks with 'source', 'symbol', 'start_line' and 'chunk' keys.
+    """
+    chunks = []
+    for f in file_contents:
+        chunks.extend(chunk_file(f["path"], f["content"]))
+    return chunks
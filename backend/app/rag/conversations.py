@@ -0,0 +1,269 @@
+"""
+Module for server-side conversation memory in RAG chat.
+
+A conversation (session) is a sequence of turns about one repository. Each turn
+stores the question, the answer and the hashes of the chunks that were put into its
+context. Sessions let follow-up questions:
+- See earlier turns without the client resending them, as a history section whose
+  size is bounded by `HISTORY_MAX_TOKENS`.
+- Reuse chunks retrieved for the previous `CARRY_OVER_TURNS` turns that are still
+  relevant to the new question, so fewer chunks need to be retrieved again.
+
+The newest turn is always kept verbatim, so that a follow-up can refer to it; its
+answer is truncated if the turn alone exceeds the budget. Older turns that no
+longer fit the history budget are compacted: each is folded into a running summary
+as one line (question and the start of the answer), and the summary itself is
+capped at `SUMMARY_MAX_TOKENS` by dropping its oldest lines.
+Compaction is deterministic and costs no LLM calls.
+
+Tables:
+- `chat_sessions`: one row per session with the current snapshot and the summary.
+- `chat_turns`: one row per turn; compacted turns are kept but no longer shown.
+"""
+
+import os
+import re
+import uuid
+from typing import Dict, List, Optional
+
+from app.db.db import get_pool
+from app.utils.tokenizer import count_tokens, truncate_to_tokens
+
+HISTORY_MAX_TOKENS = int(os.getenv("RAG_HISTORY_MAX_TOKENS", "1500"))
+SUMMARY_MAX_TOKENS = int(os.getenv("RAG_SUMMARY_MAX_TOKENS", "400"))
+
+# Per-turn limits for the one-line summary of a compacted turn.
+SUMMARY_QUESTION_TOKENS = 40
+SUMMARY_ANSWER_TOKENS = 60
+
+CARRY_OVER_TURNS = 2
+
+HISTORY_HEADER = "CONVERSATION SO FAR:"
+SUMMARY_HEADER = "Summary of earlier turns:"
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def format_turn(question: str, answer: str) -> str:
+    """Formats a turn the way it appears in the history section."""
+    return f"User: {question}\nAssistant: {answer}"
+
+
+def summarize_turn(question: str, answer: str) -> str:
+    """
+    Condenses a turn into a single summary line: the question and the beginning
+    of the answer, whitespace-collapsed and truncated.
+    """
+    question = truncate_to_tokens(
+        _WHITESPACE.sub(" ", question).strip(), SUMMARY_QUESTION_TOKENS
+    )
+    answer = truncate_to_tokens(
+        _WHITESPACE.sub(" ", answer).strip(), SUMMARY_ANSWER_TOKENS
+    )
+    return f"- Q: {question} A: {answer}"
+
+
+def _cap_summary(lines: List[str]) -> tuple[List[str], int]:
+    """Drops the oldest summary lines until the summary fits SUMMARY_MAX_TOKENS."""
+    counts = [count_tokens(line) + 1 for line in lines]
+    total = sum(counts)
+    start = 0
+    while total > SUMMARY_MAX_TOKENS and start < len(lines):
+        total -= counts[start]
+        start += 1
+    return lines[start:], total
+
+
+async def open_session(session_id: Optional[str], snapshot_id: str) -> Dict:
+    """
+    Loads a session, or starts a new one if `session_id` is missing or unknown.
+
+    A session follows the client across snapshots (e.g. a new commit of the same
+    repository); its snapshot id is updated to the current one.
+
+    Args:
+        session_id (str, optional): The session id sent by the client.
+        snapshot_id (str): The snapshot the current turn is about.
+
+    Returns:
+        Dict: The session with 'id', 'summary', 'summary_tokens' and 'turns' keys.
+        'turns' holds the turns not yet compacted, oldest first, each with
+        'question', 'answer', 'chunk_hashes' and 'tokens' keys.
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        session = None
+        if session_id:
+            session = await conn.fetchrow(
+                """
+                UPDATE chat_sessions
+                SET snapshot_id = $2, updated_at = CURRENT_TIMESTAMP
+                WHERE id = $1
+                RETURNING id, summary, summary_tokens
+                """,
+                session_id,
+                snapshot_id,
+            )
+        if session is None:
+            session = await conn.fetchrow(
+                """
+                INSERT INTO chat_sessions (id, snapshot_id) VALUES ($1, $2)
+                RETURNING id, summary, summary_tokens
+                """,
+                uuid.uuid4().hex,
+                snapshot_id,
+            )
+            turns = []
+        else:
+            turns = await conn.fetch(
+                """
+                SELECT question, answer, chunk_hashes, tokens FROM chat_turns
+                WHERE session_id = $1 AND NOT compacted
+                ORDER BY turn_index
+                """,
+                session["id"],
+            )
+
+    return {
+        "id": session["id"],
+        "summary": session["summary"],
+        "summary_tokens": session["summary_tokens"],
+        "turns": [dict(turn) for turn in turns],
+    }
+
+
+def build_history_section(session: Dict) -> Optional[tuple[str, int]]:
+    """
+    Renders a session's summary and recent turns as a context section.
+
+    Args:
+        session (Dict): A session returned by `open_session`.
+
+    Returns:
+        Optional[tuple[str, int]]: The section text and its token count, or None
+        for a session without history.
+    """
+    if not session["summary"] and not session["turns"]:
+        return None
+
+    parts = []
+    tokens = count_tokens(HISTORY_HEADER + "\n")
+    if session["summary"]:
+        summary = f"{SUMMARY_HEADER}\n{session['summary']}"
+        parts.append(summary)
+        tokens += count_tokens(SUMMARY_HEADER + "\n") + session["summary_tokens"]
+    for turn in session["turns"]:
+        parts.append(format_turn(turn["question"], turn["answer"]))
+        tokens += turn["tokens"]
+    tokens += count_tokens("\n\n") * max(len(parts) - 1, 0)
+    return HISTORY_HEADER + "\n" + "\n\n".join(parts), tokens
+
+
+def carried_chunk_hashes(session: Dict) -> List[str]:
+    """
+    Returns the chunk hashes used by the last `CARRY_OVER_TURNS` turns, most
+    recent turn first, without duplicates.
+    """
+    hashes = []
+    for turn in reversed(session["turns"][-CARRY_OVER_TURNS:]):
+        hashes.extend(turn["chunk_hashes"] or [])
+    return list(dict.fromkeys(hashes))
+
+
+def _fit_turn(question: str, answer: str, budget: int) -> tuple[str, str, int]:
+    """
+    Truncates a turn's question and answer until the formatted turn fits `budget`
+    tokens, the question to at most half of it.
+
+    Returns:
+        tuple[str, str, int]: The question, the answer and the formatted turn's
+        token count.
+    """
+    tokens = count_tokens(format_turn(question, answer))
+    if tokens <= budget:
+        return question, answer, tokens
+    question = truncate_to_tokens(question, budget // 2)
+    answer = truncate_to_tokens(
+        answer, max(budget - count_tokens(format_turn(question, "")), 0)
+    )
+    return question, answer, count_tokens(format_turn(question, answer))
+
+
+async def record_turn(
+    session_id: str, question: str, answer: str, chunk_hashes: List[str]
+):
+    """
+    Appends a turn to a session and compacts older turns that no longer fit the
+    history budget into the session summary. The new turn is kept verbatim,
+    truncated to the budget if needed.
+
+    Args:
+        session_id (str): The session id.
+        question (str): The user's question.
+        answer (str): The full answer.
+        chunk_hashes (List[str]): Hashes of the chunks used as context.
+    """
+    # Turns are kept verbatim while they fit next to a full summary
+    budget = HISTORY_MAX_TOKENS - SUMMARY_MAX_TOKENS
+    question, answer, tokens = _fit_turn(question, answer, budget)
+
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            session = await conn.fetchrow(
+                "SELECT summary FROM chat_sessions WHERE id = $1 FOR UPDATE",
+                session_id,
+            )
+            if session is None:
+                return
+            await conn.execute(
+                """
+                INSERT INTO chat_turns
+                    (session_id, turn_index, question, answer, chunk_hashes, tokens)
+                SELECT $1, COALESCE(MAX(turn_index), 0) + 1, $2, $3, $4, $5
+                FROM chat_turns WHERE session_id = $1
+                """,
+                session_id,
+                question,
+                answer,
+                chunk_hashes,
+                tokens,
+            )
+
+            turns = await conn.fetch(
+                """
+                SELECT id, question, answer, tokens FROM chat_turns
+                WHERE session_id = $1 AND NOT compacted
+                ORDER BY turn_index DESC
+                """,
+                session_id,
+            )
+            # The new turn, then older turns while they fit
+            kept_tokens = turns[0]["tokens"]
+            kept = 1
+            while kept < len(turns) and kept_tokens + turns[kept]["tokens"] <= budget:
+                kept_tokens += turns[kept]["tokens"]
+                kept += 1
+            older = turns[kept:]
+            if not older:
+                return
+
+            lines = session["summary"].splitlines() if session["summary"] else []
+            lines.extend(
+                summarize_turn(t["question"], t["answer"]) for t in reversed(older)
+            )
+            lines, summary_tokens = _cap_summary(lines)
+            await conn.execute(
+                """
+                UPDATE chat_sessions
+                SET summary = $2, summary_tokens = $3, updated_at = CURRENT_TIMESTAMP
+                WHERE id = $1
+                """,
+                session_id,
+                "\n".join(lines),
+                summary_tokens,
+            )
+            await conn.execute(
+                "UPDATE chat_turns SET compacted = TRUE WHERE id = ANY($1::int[])",
+                [t["id"] for t in older],
+            )
@@ -0,0 +1,263 @@
+"""
+Module for embedding repository snapshots in the background.
+
+Embedding a new repository can take a long time, so it runs outside of request
+handlers. Jobs live in the `embed_jobs` table, one row per snapshot, which both
+deduplicates concurrent requests for the same snapshot and persists progress:
+- `enqueue_embed_job` inserts a job, or re-queues a finished one whose
+  embeddings are incomplete again, or a failed one after
+  `EMBED_FAILED_COOLDOWN_SECONDS`.
+- Workers started with `start_embed_workers` claim queued jobs with
+  `FOR UPDATE SKIP LOCKED`, so any number of workers in any number of processes
+  can share the table without claiming the same job twice.
+- Jobs whose worker died (no progress for `EMBED_JOB_STALE_SECONDS`) are claimed
+  again; a failing job is retried up to `EMBED_MAX_ATTEMPTS` times, with
+  exponential backoff from `EMBED_RETRY_SECONDS` (`next_attempt_at`) so that a
+  burst of rate limits or an outage does not use up every attempt, then fails.
+- `wait_for_embed_job` lets request handlers follow a job's progress.
+
+Because the embedder stores chunks before embedding them, full-text search over a
+snapshot works while its job is still running.
+"""
+
+import asyncio
+import os
+from typing import AsyncIterator, Dict, List, Optional
+
+from app.db.db import get_pool
+from app.rag.embedder_pgvector import embed_repo_pgvector
+from app.rag.snapshots import get_snapshot_files
+
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "2"))
+EMBED_POLL_SECONDS = float(os.getenv("EMBED_POLL_SECONDS", "2"))
+EMBED_JOB_STALE_SECONDS = int(os.getenv("EMBED_JOB_STALE_SECONDS", "300"))
+EMBED_MAX_ATTEMPTS = int(os.getenv("EMBED_MAX_ATTEMPTS", "3"))
+EMBED_RETRY_SECONDS = float(os.getenv("EMBED_RETRY_SECONDS", "30"))
+EMBED_FAILED_COOLDOWN_SECONDS = int(os.getenv("EMBED_FAILED_COOLDOWN_SECONDS", "3600"))
+
+JOB_COLUMNS = "snapshot_id, status, chunks_done, chunks_total, attempts, error"
+
+# Set when a job is enqueued in this process so idle workers don't wait for the
+# next poll; jobs enqueued by other processes are picked up by polling.
+_wakeup = asyncio.Event()
+
+
+def _job_dict(row) -> Optional[Dict]:
+    return dict(row) if row else None
+
+
+async def enqueue_embed_job(snapshot_id: str) -> Dict:
+    """
+    Queues a snapshot for embedding unless a job for it is already queued or running,
+    or failed less than `EMBED_FAILED_COOLDOWN_SECONDS` ago.
+
+    A finished job is re-queued when the snapshot had chunks to embed, as callers
+    only enqueue when the snapshot's embeddings are incomplete. A finished job
+    with no chunks (e.g. a snapshot of binary files only) is returned as is,
+    since its embeddings can never be complete.
+
+    Args:
+        snapshot_id (str): The snapshot id.
+
+    Returns:
+        Dict: The job with 'snapshot_id', 'status', 'chunks_done', 'chunks_total',
+        'attempts' and 'error' keys.
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        job = await conn.fetchrow(
+            f"""
+            INSERT INTO embed_jobs (snapshot_id) VALUES ($1)
+            ON CONFLICT (snapshot_id) DO UPDATE
+            SET status = 'queued',
+                chunks_done = 0,
+                chunks_total = NULL,
+                attempts = 0,
+                error = NULL,
+                next_attempt_at = NULL,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE (embed_jobs.status = 'done'
+                   AND embed_jobs.chunks_total IS DISTINCT FROM 0)
+               OR (embed_jobs.status = 'failed'
+                   AND embed_jobs.updated_at
+                       < CURRENT_TIMESTAMP - make_interval(secs => $2))
+            RETURNING {JOB_COLUMNS}
+            """,
+            snapshot_id,
+            EMBED_FAILED_COOLDOWN_SECONDS,
+        )
+        if job is None:
+            job = await conn.fetchrow(
+                f"SELECT {JOB_COLUMNS} FROM embed_jobs WHERE snapshot_id = $1",
+                snapshot_id,
+            )
+    _wakeup.set()
+    return _job_dict(job)
+
+
+async def get_embed_job(snapshot_id: str) -> Optional[Dict]:
+    """
+    Loads the embedding job of a snapshot.
+
+    Args:
+        snapshot_id (str): The snapshot id.
+
+    Returns:
+        Optional[Dict]: The job, or None if the snapshot was never queued.
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        job = await conn.fetchrow(
+            f"SELECT {JOB_COLUMNS} FROM embed_jobs WHERE snapshot_id = $1",
+            snapshot_id,
+        )
+    return _job_dict(job)
+
+
+async def wait_for_embed_job(
+    snapshot_id: str, timeout: float, interval: float = 0.5
+) -> AsyncIterator[Dict]:
+    """
+    Follows a job until it finishes or the timeout expires.
+
+    Args:
+        snapshot_id (str): The snapshot id.
+        timeout (float): Maximum number of seconds to wait.
+        interval (float, optional): Seconds between polls. Defaults to 0.5.
+
+    Yields:
+        Dict: The job, whenever its status or progress changed. The last job
+        yielded is finished ('done' or 'failed') unless the timeout expired.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    last = None
+    while True:
+        job = await get_embed_job(snapshot_id)
+        if job is None:
+            return
+        if job != last:
+            yield job
+            last = job
+        if job["status"] in ("done", "failed") or loop.time() >= deadline:
+            return
+        await asyncio.sleep(min(interval, max(deadline - loop.time(), 0)))
+
+
+async def _claim_job() -> Optional[Dict]:
+    """
+    Claims the oldest queued job whose retry delay has passed (or a stale running
+    job), or returns None.
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        job = await conn.fetchrow(
+            f"""
+            UPDATE embed_jobs
+            SET status = 'running',
+                attempts = attempts + 1,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE snapshot_id = (
+                SELECT snapshot_id FROM embed_jobs
+                WHERE (status = 'queued'
+                       AND (next_attempt_at IS NULL
+                            OR next_attempt_at <= CURRENT_TIMESTAMP))
+                   OR (status = 'running'
+                       AND updated_at < CURRENT_TIMESTAMP - make_interval(secs => $1))
+                ORDER BY created_at
+                FOR UPDATE SKIP LOCKED
+                LIMIT 1
+            )
+            RETURNING {JOB_COLUMNS}
+            """,
+            EMBED_JOB_STALE_SECONDS,
+        )
+    return _job_dict(job)
+
+
+async def _run_job(job: Dict):
+    """Embeds a claimed job's snapshot, recording progress and the outcome."""
+    snapshot_id = job["snapshot_id"]
+    pool = await get_pool()
+
+    async def record_progress(done: int, total: int):
+        async with pool.acquire() as conn:
+            await conn.execute(
+                """
+                UPDATE embed_jobs
+                SET chunks_done = $2, chunks_total = $3, updated_at = CURRENT_TIMESTAMP
+                WHERE snapshot_id = $1
+                """,
+                snapshot_id,
+                done,
+                total,
+            )
+
+    try:
+        if job["attempts"] > EMBED_MAX_ATTEMPTS:
+            raise RuntimeError(f"Gave up after {EMBED_MAX_ATTEMPTS} attempts")
+        files = await get_snapshot_files(snapshot_id)
+        if not files:
+            raise ValueError("Snapshot has no files")
+        await embed_repo_pgvector(
+            files, r_hash=snapshot_id, on_progress=record_progress
+        )
+        status, error, delay = "done", None, None
+    except Exception as e:
+        retry = job["attempts"] < EMBED_MAX_ATTEMPTS and not isinstance(e, ValueError)
+        status, error = ("queued" if retry else "failed"), str(e)
+        # Exponential backoff before the next attempt
+        delay = EMBED_RETRY_SECONDS * 2 ** (job["attempts"] - 1) if retry else None
+        print(f"Embed job {snapshot_id} failed (attempt {job['attempts']}): {e}")
+
+    async with pool.acquire() as conn:
+        await conn.execute(
+            """
+            UPDATE embed_jobs
+            SET status = $2,
+                error = $3,
+                next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => $4),
+                updated_at = CURRENT_TIMESTAMP
+            WHERE snapshot_id = $1
+            """,
+            snapshot_id,
+            status,
+            error,
+            delay,
+        )
+
+
+async def embed_worker():
+    """
+    Claims and runs embedding jobs until cancelled.
+    """
+    while True:
+        _wakeup.clear()
+        try:
+            job = await _claim_job()
+        except Exception as e:
+            print(f"Embed worker could not claim a job: {e}")
+            job = None
+
+        if job is None:
+            try:
+                await asyncio.wait_for(_wakeup.wait(), timeout=EMBED_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        try:
+            await _run_job(job)
+        except Exception as e:
+            # The job is claimed again once stale
+            print(f"Embed worker could not run job {job['snapshot_id']}: {e}")
+
+
+def start_embed_workers() -> List[asyncio.Task]:
+    """
+    Starts `EMBED_WORKERS` embedding workers on the running event loop.
+
+    Returns:
+        List[asyncio.Task]: The worker tasks; cancel them on shutdown.
+    """
+    return [asyncio.create_task(embed_worker()) for _ in range(EMBED_WORKERS)]
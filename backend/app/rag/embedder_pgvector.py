@@ -1,24 +1,41 @@
 """
 Module for embedding GitHub repository contents into a Postgres database using pgvector.
 
+Chunk storage is content-addressed:
+- `chunk_embeddings` holds each distinct chunk text once, keyed by its SHA-256 hash,
+  with its embedding, token count and full-text search vector.
+- `repo_chunks` is a lightweight membership table mapping a repository hash to the
+  chunk hashes it contains, along with per-occurrence source/symbol/line metadata.
+
+Vendored code, licenses and forks therefore share embeddings across repositories,
+and chunks whose hash is already stored are never sent to the embedding API again.
+
+Embedding happens in two phases: chunks are first stored with a NULL embedding (so
+full-text search works right away), then embeddings are filled in batches. The
+background job queue in `app.rag.embed_jobs` runs both phases outside of requests.
+
 Intended for use in a RAG pipeline with semantic search over GitHub repository content.
 Dependencies:
 - OpenAI (async API client)
-- LangChain text splitter
+- app.rag.chunker (code-aware splitting, LangChain text splitter fallback)
 - PostgreSQL (with pgvector and pgcrypto)
 """
 
 import hashlib
 import json
-from typing import List, Dict
+from typing import Awaitable, Callable, Dict, List, Optional
 
 import openai
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from app.db.db import get_pool
+from app.rag.chunker import chunk_files
+from app.utils.tokenizer import count_tokens
 
 EMBED_MODEL = "text-embedding-3-small"
 EMBED_DIM = 1536
 
+# Conservative batch size for the embeddings API (max 300k tokens per request)
+EMBED_BATCH_SIZE = 100
+
 
 def repo_hash(files: List[Dict]) -> str:
     """
@@ -42,73 +59,220 @@ def repo_hash(files: List[Dict]) -> str:
     ).hexdigest()
 
 
-async def embed_repo_pgvector(file_contents: List[Dict]):
+def chunk_hash(text: str) -> str:
     """
-    Embeds the content of a repository and stores it in a pgvector-enabled Postgres table.
+    Computes the content address of a chunk.
+
+    Args:
+        text (str): The chunk text.
+
+    Returns:
+        str: The SHA-256 hex digest of the text.
+    """
+    return hashlib.sha256(text.encode()).hexdigest()
 
-    If the repository hash already exists in the database, the function returns early,
-    skipping redundant computation. Otherwise, it splits the files into chunks,
-    embeds them using OpenAI's embedding API, and bulk-inserts the results into Postgres.
+
+async def has_chunks(r_hash: str) -> bool:
+    """
+    Checks whether a repository hash has been chunked, i.e. whether full-text search
+    over its chunks is possible. Some chunks may still be waiting for embeddings.
 
     Args:
-        file_contents (List[Dict]): A list of files with 'path' and 'content' fields.
+        r_hash (str): The repository hash (or snapshot id).
 
     Returns:
-        str: A message summarizing the result of the embedding operation.
+        bool: True if at least one membership row exists for the hash.
     """
     pool = await get_pool()
-
-    # ========== 1. Idempotency check ==========
-    r_hash = repo_hash(file_contents)
     async with pool.acquire() as conn:
         exists = await conn.fetchval(
-            "SELECT 1 FROM repo_chunks WHERE repo_hash=$1 LIMIT 1", r_hash
+            "SELECT 1 FROM repo_chunks WHERE repo_hash = $1 LIMIT 1", r_hash
         )
-    if exists:
-        return f"Using cached pgvector embeddings for {len(file_contents)} files."
+    return bool(exists)
+
+
+async def has_embeddings(r_hash: str) -> bool:
+    """
+    Checks whether every chunk of a repository hash has been embedded.
 
-    # ========== 2. Split & embed ==========
-    splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-    docs, sources = [], []
-    for f in file_contents:
-        chunks = splitter.create_documents(
-            [f["content"]], metadatas=[{"source": f["path"]}]
+    Args:
+        r_hash (str): The repository hash (or snapshot id).
+
+    Returns:
+        bool: True if the hash has chunks and none of them is missing an embedding.
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        complete = await conn.fetchval(
+            """
+            SELECT EXISTS (SELECT 1 FROM repo_chunks WHERE repo_hash = $1)
+               AND NOT EXISTS (
+                   SELECT 1 FROM repo_chunks m
+                   JOIN chunk_embeddings e ON e.chunk_hash = m.chunk_hash
+                   WHERE m.repo_hash = $1 AND e.embedding IS NULL
+               )
+            """,
+            r_hash,
         )
-        docs.extend(chunks)
-        sources.extend([d.metadata["source"] for d in chunks])
+    return bool(complete)
 
-    # Batch embed with the async OpenAI client
-    client = openai.AsyncOpenAI()  # picks up OPENAI_API_KEY from env
 
-    # Process in batches to avoid token limits (max 300k tokens per request)
-    batch_size = 100  # Conservative batch size
-    all_vectors = []
+async def store_chunks(file_contents: List[Dict], r_hash: str) -> int:
+    """
+    Splits a repository into chunks and stores them without embeddings.
 
-    for i in range(0, len(docs), batch_size):
-        batch_docs = docs[i : i + batch_size]
-        batch_texts = [d.page_content for d in batch_docs]
+    New chunk texts are inserted into `chunk_embeddings` with a NULL embedding, so
+    their full-text search vector is available immediately, and the repository's
+    membership rows are written in the same transaction. A transaction-scoped
+    advisory lock on the hash makes concurrent calls for the same repository safe.
 
-        resp = await client.embeddings.create(
-            model=EMBED_MODEL,
-            input=batch_texts,
-        )
-        batch_vectors = [record.embedding for record in resp.data]
-        all_vectors.extend(batch_vectors)
+    Args:
+        file_contents (List[Dict]): A list of files with 'path' and 'content' fields.
+        r_hash (str): The repository hash (or snapshot id).
 
-    vectors = all_vectors
+    Returns:
+        int: The number of new chunk texts stored, or 0 if the repository was
+        already chunked.
+    """
+    # Code files are split along top-level definitions, everything else by characters
+    chunks = chunk_files(file_contents)
+    for c in chunks:
+        c["hash"] = chunk_hash(c["chunk"])
+    unique_texts = {c["hash"]: c["chunk"] for c in chunks}
 
-    # ========== 3. Bulk-insert ==========
-    rows = [
-        (r_hash, src, doc.page_content, vec)
-        for src, doc, vec in zip(sources, docs, vectors)
-    ]
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute("SELECT pg_advisory_xact_lock(hashtext($1))", r_hash)
+            if await conn.fetchval(
+                "SELECT 1 FROM repo_chunks WHERE repo_hash = $1 LIMIT 1", r_hash
+            ):
+                return 0
+
+            known = await conn.fetch(
+                "SELECT chunk_hash FROM chunk_embeddings WHERE chunk_hash = ANY($1::text[])",
+                list(unique_texts),
+            )
+            known_hashes = {r["chunk_hash"] for r in known}
+            # Token counts are stored alongside each chunk so context assembly at
+            # query time never has to re-encode retrieved chunks
+            new_rows = [
+                (h, text, count_tokens(text))
+                for h, text in unique_texts.items()
+                if h not in known_hashes
+            ]
+            await conn.executemany(
+                """
+                INSERT INTO chunk_embeddings (chunk_hash, chunk, token_count)
+                VALUES ($1, $2, $3)
+                ON CONFLICT (chunk_hash) DO NOTHING
+                """,
+                new_rows,
+            )
+            await conn.executemany(
+                """
+                INSERT INTO repo_chunks (repo_hash, source, symbol, start_line, chunk_hash)
+                VALUES ($1, $2, $3, $4, $5)
+                """,
+                [
+                    (r_hash, c["source"], c["symbol"], c["start_line"], c["hash"])
+                    for c in chunks
+                ],
+            )
+    return len(new_rows)
+
+
+async def fill_embeddings(
+    r_hash: str,
+    on_progress: Optional[Callable[[int, int], Awaitable[None]]] = None,
+) -> int:
+    """
+    Embeds every chunk of a repository that does not have an embedding yet.
+
+    Chunks are embedded in batches and written back as each batch completes, so an
+    interrupted run resumes where it stopped. Chunks shared with another repository
+    that is embedding concurrently may be embedded twice; only the first write wins.
+
+    Args:
+        r_hash (str): The repository hash (or snapshot id).
+        on_progress (Callable, optional): Awaited with (chunks done, chunks total)
+            before the first batch and after every batch.
+
+    Returns:
+        int: The number of chunks embedded.
+    """
+    pool = await get_pool()
     async with pool.acquire() as conn:
-        await conn.executemany(
+        pending = await conn.fetch(
             """
-            INSERT INTO repo_chunks (repo_hash, source, chunk, embedding)
-            VALUES ($1, $2, $3, $4)
+            SELECT DISTINCT e.chunk_hash, e.chunk
+            FROM repo_chunks m
+            JOIN chunk_embeddings e ON e.chunk_hash = m.chunk_hash
+            WHERE m.repo_hash = $1 AND e.embedding IS NULL
             """,
-            rows,
+            r_hash,
+        )
+
+    total = len(pending)
+    if on_progress:
+        await on_progress(0, total)
+
+    # Batch embed with the async OpenAI client
+    client = openai.AsyncOpenAI()  # picks up OPENAI_API_KEY from env
+
+    for i in range(0, total, EMBED_BATCH_SIZE):
+        batch = pending[i : i + EMBED_BATCH_SIZE]
+        resp = await client.embeddings.create(
+            model=EMBED_MODEL,
+            input=[row["chunk"] for row in batch],
         )
+        async with pool.acquire() as conn:
+            await conn.executemany(
+                """
+                UPDATE chunk_embeddings SET embedding = $2
+                WHERE chunk_hash = $1 AND embedding IS NULL
+                """,
+                [
+                    (row["chunk_hash"], record.embedding)
+                    for row, record in zip(batch, resp.data)
+                ],
+            )
+        if on_progress:
+            await on_progress(min(i + EMBED_BATCH_SIZE, total), total)
+
+    return total
+
+
+async def embed_repo_pgvector(
+    file_contents: List[Dict],
+    r_hash: str = None,
+    on_progress: Optional[Callable[[int, int], Awaitable[None]]] = None,
+):
+    """
+    Embeds the content of a repository and stores it in a pgvector-enabled Postgres table.
+
+    If every chunk of the repository hash is already embedded, the function returns
+    early, skipping redundant computation. Otherwise it stores the repository's chunks
+    (see `store_chunks`), then embeds only the chunks that have no embedding yet using
+    OpenAI's embedding API (see `fill_embeddings`).
+
+    Args:
+        file_contents (List[Dict]): A list of files with 'path' and 'content' fields.
+        r_hash (str, optional): Precomputed repository hash, e.g. a snapshot id.
+            Computed from `file_contents` when omitted.
+        on_progress (Callable, optional): Passed through to `fill_embeddings`.
+
+    Returns:
+        str: A message summarizing the result of the embedding operation.
+    """
+    r_hash = r_hash or repo_hash(file_contents)
+    if await has_embeddings(r_hash):
+        return f"Using cached pgvector embeddings for {len(file_contents)} files."
+
+    stored = await store_chunks(file_contents, r_hash)
+    embedded = await fill_embeddings(r_hash, on_progress=on_progress)
 
-    return f"Embedded {len(rows)} chunks from {len(file_contents)} files into Postgres."
+    return (
+        f"Embedded {embedded} new chunks ({stored} new texts stored) "
+        f"from {len(file_contents)} files into Postgres."
+    )
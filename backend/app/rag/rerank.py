@@ -0,0 +1,93 @@
+"""
+Module for diversity-aware re-ranking of retrieved chunks.
+
+Nearest-neighbour search over overlapping code chunks tends to return several
+windows of the same file. Maximal marginal relevance (MMR) trades relevance to the
+query against similarity to the chunks already selected, and a per-source cap
+limits how many chunks any single file can contribute.
+
+All similarity math is vectorized with NumPy over the candidate embeddings, so
+re-ranking a few dozen candidates costs well under a millisecond.
+"""
+
+from typing import Optional, Sequence
+
+import numpy as np
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def mmr_select(
+    query_embedding: Sequence[float],
+    candidate_embeddings: Sequence[Sequence[float]],
+    k: int,
+    relevance: Optional[Sequence[float]] = None,
+    sources: Optional[Sequence[str]] = None,
+    lambda_mult: float = 0.5,
+    max_per_source: Optional[int] = None,
+) -> list[int]:
+    """
+    Selects up to k diverse candidates with maximal marginal relevance.
+
+    At each step the candidate maximizing
+    ``lambda_mult * relevance - (1 - lambda_mult) * max_sim_to_selected`` is picked.
+
+    Args:
+        query_embedding (Sequence[float]): The query vector.
+        candidate_embeddings (Sequence[Sequence[float]]): One vector per candidate.
+        k (int): The number of candidates to select.
+        relevance (Sequence[float], optional): Precomputed relevance per candidate
+            (e.g. fused hybrid scores). Rescaled to [0, 1]. Defaults to cosine
+            similarity with the query.
+        sources (Sequence[str], optional): Source file per candidate, required for
+            `max_per_source`.
+        lambda_mult (float, optional): 1.0 ranks purely by relevance, 0.0 purely by
+            diversity. Defaults to 0.5.
+        max_per_source (int, optional): Maximum number of candidates selected from
+            the same source. Defaults to no cap.
+
+    Returns:
+        list[int]: Indices into the candidate list, in selection order.
+    """
+    n = len(candidate_embeddings)
+    if n == 0 or k <= 0:
+        return []
+
+    embeddings = _normalize(np.asarray(candidate_embeddings, dtype=np.float32))
+
+    if relevance is None:
+        query = _normalize(np.asarray(query_embedding, dtype=np.float32))
+        rel = embeddings @ query
+    else:
+        rel = np.asarray(relevance, dtype=np.float32)
+        spread = rel.max() - rel.min()
+        rel = (rel - rel.min()) / spread if spread > 0 else np.ones(n, np.float32)
+
+    pairwise = embeddings @ embeddings.T
+    max_sim = np.full(n, -1.0, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    source_array = np.asarray(sources) if sources is not None else None
+    per_source: dict[str, int] = {}
+    selected: list[int] = []
+
+    while len(selected) < k and available.any():
+        diversity = max_sim if selected else 0.0
+        scores = lambda_mult * rel - (1 - lambda_mult) * diversity
+        scores = np.where(available, scores, -np.inf)
+        best = int(np.argmax(scores))
+
+        selected.append(best)
+        available[best] = False
+        max_sim = np.maximum(max_sim, pairwise[best])
+
+        if max_per_source is not None and source_array is not None:
+            source = source_array[best]
+            per_source[source] = per_source.get(source, 0) + 1
+            if per_source[source] >= max_per_source:
+                available &= source_array != source
+
+    return selected
@@ -0,0 +1,306 @@
+"""
+Module for garbage-collecting stale repository snapshots and their chunks.
+
+Every distinct repository hash gets its own snapshot, membership rows in `repo_chunks`
+and (for new content) rows in `chunk_embeddings`. Without cleanup these tables grow
+without bound and slow down every scan. The retention policy:
+- Keeps the `RETENTION_KEEP_PER_REPO` most recently accessed snapshots per owner/repo.
+- Deletes snapshots without owner/repo metadata (direct uploads) once they have not
+  been accessed for `RETENTION_MAX_IDLE_DAYS`.
+- Deletes membership rows whose repository hash has no snapshot.
+- Deletes `chunk_embeddings` rows no longer referenced by any repository.
+- Deletes chat conversations (and their turns) idle for `RETENTION_MAX_IDLE_DAYS`.
+- Deletes persisted SSE runs older than `STREAM_RUN_RETENTION`.
+- Deletes LLM usage rows older than `USAGE_RETENTION`.
+- Deletes cached repository data last written over `GITHUB_DATA_RETENTION` ago.
+
+Deletes run in batches of `RETENTION_BATCH_SIZE` rows, one short transaction each, so
+the sweep never holds long locks. A background loop runs the sweep periodically,
+guarded by a Postgres advisory lock so only one worker process sweeps at a time.
+"""
+
+import asyncio
+import os
+
+from app.db.db import get_pool
+
+RETENTION_KEEP_PER_REPO = int(os.getenv("RETENTION_KEEP_PER_REPO", "3"))
+RETENTION_MAX_IDLE_DAYS = int(os.getenv("RETENTION_MAX_IDLE_DAYS", "30"))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "1000"))
+RETENTION_INTERVAL_SECONDS = int(os.getenv("RETENTION_INTERVAL_SECONDS", "21600"))
+
+# Orphaned embeddings younger than this are kept, so a chunk inserted by an embed
+# that has not yet written its membership rows is never collected.
+ORPHAN_GRACE = "1 hour"
+
+# Persisted SSE runs only serve reconnects, which happen within minutes.
+STREAM_RUN_RETENTION = "1 day"
+# Usage rows feed cost calibration and reports, which only look at recent weeks.
+USAGE_RETENTION = "90 days"
+# Cached repository data is keyed by commit; old commits are rarely generated again.
+GITHUB_DATA_RETENTION = "7 days"
+
+# Arbitrary constant identifying the retention sweep's advisory lock.
+RETENTION_LOCK_ID = 4_270_032
+
+STALE_SNAPSHOTS_SQL = """
+    SELECT id, owner, repo, last_accessed_at
+    FROM (
+        SELECT id, owner, repo, last_accessed_at,
+               row_number() OVER (
+                   PARTITION BY owner, repo ORDER BY last_accessed_at DESC
+               ) AS recency
+        FROM repo_snapshots
+    ) ranked
+    WHERE (owner IS NOT NULL AND repo IS NOT NULL AND recency > $1)
+       OR ((owner IS NULL OR repo IS NULL)
+           AND last_accessed_at < CURRENT_TIMESTAMP - make_interval(days => $2))
+    ORDER BY last_accessed_at
+"""
+
+
+async def _delete_in_batches(conn, sql: str, *args) -> int:
+    """
+    Repeats a `DELETE ... WHERE id IN (SELECT ... LIMIT n)` statement until it
+    deletes nothing. The batch size is always the last positional argument.
+    """
+    total = 0
+    while True:
+        async with conn.transaction():
+            result = await conn.execute(sql, *args, RETENTION_BATCH_SIZE)
+        deleted = int(result.split()[-1])
+        total += deleted
+        if deleted < RETENTION_BATCH_SIZE:
+            return total
+        # Yield between batches so the sweep doesn't starve request handlers
+        await asyncio.sleep(0)
+
+
+async def retention_report() -> dict:
+    """
+    Computes what a retention sweep would delete, without deleting anything.
+
+    Returns:
+        dict: The policy settings, the stale snapshots and the number of membership,
+        snapshot file, embedding, chat session, SSE run, LLM usage and cached
+        repository data rows that would be removed.
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        stale = await conn.fetch(
+            STALE_SNAPSHOTS_SQL, RETENTION_KEEP_PER_REPO, RETENTION_MAX_IDLE_DAYS
+        )
+        stale_ids = [row["id"] for row in stale]
+        stale_chunk_rows = await conn.fetchval(
+            "SELECT count(*) FROM repo_chunks WHERE repo_hash = ANY($1::text[])",
+            stale_ids,
+        )
+        stale_file_rows = await conn.fetchval(
+            "SELECT count(*) FROM repo_snapshot_files WHERE snapshot_id = ANY($1::text[])",
+            stale_ids,
+        )
+        unowned_chunk_rows = await conn.fetchval(
+            """
+            SELECT count(*) FROM repo_chunks m
+            WHERE NOT EXISTS (SELECT 1 FROM repo_snapshots s WHERE s.id = m.repo_hash)
+            """
+        )
+        orphaned_embeddings = await conn.fetchval(
+            f"""
+            SELECT count(*) FROM chunk_embeddings e
+            WHERE e.created_at < CURRENT_TIMESTAMP - interval '{ORPHAN_GRACE}'
+              AND NOT EXISTS (
+                  SELECT 1 FROM repo_chunks m
+                  WHERE m.chunk_hash = e.chunk_hash
+                    AND NOT (m.repo_hash = ANY($1::text[]))
+              )
+            """,
+            stale_ids,
+        )
+        idle_sessions = await conn.fetchval(
+            """
+            SELECT count(*) FROM chat_sessions
+            WHERE updated_at < CURRENT_TIMESTAMP - make_interval(days => $1)
+            """,
+            RETENTION_MAX_IDLE_DAYS,
+        )
+        stream_runs = await conn.fetchval(
+            f"""
+            SELECT count(*) FROM stream_runs
+            WHERE created_at < CURRENT_TIMESTAMP - interval '{STREAM_RUN_RETENTION}'
+            """
+        )
+        usage_rows = await conn.fetchval(
+            f"""
+            SELECT count(*) FROM llm_usage
+            WHERE created_at < CURRENT_TIMESTAMP - interval '{USAGE_RETENTION}'
+            """
+        )
+        github_data_rows = await conn.fetchval(
+            f"""
+            SELECT count(*) FROM github_data_cache
+            WHERE updated_at < CURRENT_TIMESTAMP - interval '{GITHUB_DATA_RETENTION}'
+            """
+        )
+
+    return {
+        "dry_run": True,
+        "policy": {
+            "keep_per_repo": RETENTION_KEEP_PER_REPO,
+            "max_idle_days": RETENTION_MAX_IDLE_DAYS,
+            "batch_size": RETENTION_BATCH_SIZE,
+        },
+        "stale_snapshots": [
+            {
+                "id": row["id"],
+                "owner": row["owner"],
+                "repo": row["repo"],
+                "last_accessed_at": row["last_accessed_at"].isoformat(),
+            }
+            for row in stale
+        ],
+        "repo_chunk_rows": stale_chunk_rows + unowned_chunk_rows,
+        "snapshot_file_rows": stale_file_rows,
+        "orphaned_embeddings": orphaned_embeddings,
+        "chat_sessions": idle_sessions,
+        "stream_runs": stream_runs,
+        "llm_usage_rows": usage_rows,
+        "github_data_rows": github_data_rows,
+    }
+
+
+async def run_retention() -> dict:
+    """
+    Deletes stale snapshots, their chunk memberships and orphaned embeddings.
+
+    Returns:
+        dict: The number of snapshots, membership rows, snapshot file rows,
+        embeddings, chat sessions, persisted SSE runs, LLM usage rows and cached
+        repository data rows deleted, or `{"skipped": True}` if another process
+        holds the retention lock.
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        if not await conn.fetchval("SELECT pg_try_advisory_lock($1)", RETENTION_LOCK_ID):
+            return {"skipped": True}
+        try:
+            stale = await conn.fetch(
+                STALE_SNAPSHOTS_SQL, RETENTION_KEEP_PER_REPO, RETENTION_MAX_IDLE_DAYS
+            )
+            chunk_rows = 0
+            file_rows = 0
+            for row in stale:
+                chunk_rows += await _delete_in_batches(
+                    conn,
+                    """
+                    DELETE FROM repo_chunks WHERE id IN (
+                        SELECT id FROM repo_chunks WHERE repo_hash = $1 LIMIT $2
+                    )
+                    """,
+                    row["id"],
+                )
+                file_rows += await _delete_in_batches(
+                    conn,
+                    """
+                    DELETE FROM repo_snapshot_files WHERE (snapshot_id, path) IN (
+                        SELECT snapshot_id, path FROM repo_snapshot_files
+                        WHERE snapshot_id = $1 LIMIT $2
+                    )
+                    """,
+                    row["id"],
+                )
+                await conn.execute("DELETE FROM repo_snapshots WHERE id = $1", row["id"])
+
+            chunk_rows += await _delete_in_batches(
+                conn,
+                """
+                DELETE FROM repo_chunks WHERE id IN (
+                    SELECT m.id FROM repo_chunks m
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM repo_snapshots s WHERE s.id = m.repo_hash
+                    )
+                    LIMIT $1
+                )
+                """,
+            )
+            embeddings = await _delete_in_batches(
+                conn,
+                f"""
+                DELETE FROM chunk_embeddings WHERE chunk_hash IN (
+                    SELECT e.chunk_hash FROM chunk_embeddings e
+                    WHERE e.created_at < CURRENT_TIMESTAMP - interval '{ORPHAN_GRACE}'
+                      AND NOT EXISTS (
+                          SELECT 1 FROM repo_chunks m WHERE m.chunk_hash = e.chunk_hash
+                      )
+                    LIMIT $1
+                )
+                """,
+            )
+            # Turns are removed by the cascading foreign key
+            sessions = await _delete_in_batches(
+                conn,
+                """
+                DELETE FROM chat_sessions WHERE id IN (
+                    SELECT id FROM chat_sessions
+                    WHERE updated_at < CURRENT_TIMESTAMP - make_interval(days => $1)
+                    LIMIT $2
+                )
+                """,
+                RETENTION_MAX_IDLE_DAYS,
+            )
+            stream_runs = await _delete_in_batches(
+                conn,
+                f"""
+                DELETE FROM stream_runs WHERE id IN (
+                    SELECT id FROM stream_runs
+                    WHERE created_at < CURRENT_TIMESTAMP - interval '{STREAM_RUN_RETENTION}'
+                    LIMIT $1
+                )
+                """,
+            )
+            usage_rows = await _delete_in_batches(
+                conn,
+                f"""
+                DELETE FROM llm_usage WHERE id IN (
+                    SELECT id FROM llm_usage
+                    WHERE created_at < CURRENT_TIMESTAMP - interval '{USAGE_RETENTION}'
+                    LIMIT $1
+                )
+                """,
+            )
+            github_data_rows = await _delete_in_batches(
+                conn,
+                f"""
+                DELETE FROM github_data_cache WHERE (owner, repo, commit_sha) IN (
+                    SELECT owner, repo, commit_sha FROM github_data_cache
+                    WHERE updated_at < CURRENT_TIMESTAMP - interval '{GITHUB_DATA_RETENTION}'
+                    LIMIT $1
+                )
+                """,
+            )
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", RETENTION_LOCK_ID)
+
+    return {
+        "snapshots": len(stale),
+        "repo_chunk_rows": chunk_rows,
+        "snapshot_file_rows": file_rows,
+        "embeddings": embeddings,
+        "chat_sessions": sessions,
+        "stream_runs": stream_runs,
+        "llm_usage_rows": usage_rows,
+        "github_data_rows": github_data_rows,
+    }
+
+
+async def retention_loop():
+    """
+    Runs the retention sweep every `RETENTION_INTERVAL_SECONDS` until cancelled.
+    """
+    while True:
+        await asyncio.sleep(RETENTION_INTERVAL_SECONDS)
+        try:
+            result = await run_retention()
+            print(f"Retention sweep: {result}")
+        except Exception as e:
+            print(f"Retention sweep failed: {e}")
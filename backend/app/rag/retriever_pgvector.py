@@ -1,63 +1,371 @@
 """
 Module for retrieving semantically similar text chunks from a PostgreSQL database using pgvector.
 
-This script defines a function that:
-- Embeds a given query using OpenAI's embedding model.
-- Performs a similarity search against pre-embedded chunks stored in the `repo_chunks` table.
-- Returns the top-k most relevant chunks based on cosine distance (via `<->` operator).
+This script defines functions that:
+- Embed a given query using OpenAI's embedding model.
+- Perform a similarity search against pre-embedded chunks. Chunk text and embeddings live
+  in the content-addressed `chunk_embeddings` table; `repo_chunks` maps a repository hash
+  to the chunks it contains.
+- Perform a hybrid search that combines the vector search with Postgres full-text search
+  over the `chunk_embeddings.chunk_tsv` column and fuses both rankings with reciprocal rank fusion (RRF).
+- Perform a lexical-only search for repositories whose embeddings are still being
+  computed; chunks without an embedding are excluded from the vector and hybrid searches.
+- Re-check chunks used by earlier turns of a conversation against a new question.
+- Re-rank an over-fetched candidate set with maximal marginal relevance (MMR) and a
+  per-source cap so overlapping windows of the same file don't crowd out the context.
 
 Intended for use in RAG pipelines where relevant context is retrieved from a vector database.
 """
 
+import re
+
 import openai
 from app.db.db import get_pool
+from app.rag.rerank import mmr_select
+
+EMBED_MODEL = "text-embedding-3-small"
+
+# Text search configuration used for the generated `chunk_tsv` column. Must match
+# the expression in the `chunk_embeddings` schema or the GIN index will not be used.
+TS_CONFIG = "english"
+
+# Constant from the original RRF paper; dampens the influence of top ranks.
+RRF_K = 60
+
+# Candidates fetched per requested result before MMR re-ranking, and the maximum
+# number of chunks any single file may contribute.
+FETCH_MULTIPLIER = 4
+MAX_CHUNKS_PER_SOURCE = 2
+
+# Minimum cosine similarity for a chunk from an earlier turn to be reused.
+CARRY_OVER_MIN_SIMILARITY = 0.3
 
+MAX_QUERY_TERMS = 32
+_TERM_PATTERN = re.compile(r"[A-Za-z0-9_]+")
 
-async def similar_chunks(query: str, repo_hash: str, k: int = 5):
+
+async def embed_query(query: str) -> list[float]:
+    """
+    Embeds a single query string with OpenAI's embedding API.
+
+    Args:
+        query (str): The text to embed.
+
+    Returns:
+        list[float]: The query embedding.
+    """
+    client = openai.AsyncOpenAI()
+    resp = await client.embeddings.create(
+        model=EMBED_MODEL,
+        input=[query],
+        encoding_format="float",
+    )
+    return resp.data[0].embedding
+
+
+def build_tsquery(query: str) -> str:
+    """
+    Converts a free-form question into an OR'ed `to_tsquery` expression.
+
+    `plainto_tsquery` ANDs every word, so natural-language questions rarely match
+    anything. Instead every identifier-like term is OR'ed together and ranking is
+    left to `ts_rank_cd`. Only `[A-Za-z0-9_]` characters survive, so the result is
+    always a syntactically valid tsquery.
+
+    Args:
+        query (str): The user question.
+
+    Returns:
+        str: A tsquery expression such as ``"get_pool | connection"``, or an empty
+        string when the question contains no searchable terms.
     """
-    Retrieves the top-k most semantically similar chunks from the `repo_chunks` table.
+    terms = []
+    seen = set()
+    for term in _TERM_PATTERN.findall(query.lower()):
+        term = term.strip("_")
+        if len(term) < 2 or term in seen:
+            continue
+        seen.add(term)
+        terms.append(term)
+        if len(terms) >= MAX_QUERY_TERMS:
+            break
+    return " | ".join(terms)
+
+
+async def similar_chunks(query: str, repo_hash: str, k: int = 5, q_emb=None):
+    """
+    Retrieves the top-k most semantically similar chunks of a repository.
 
     Uses OpenAI's embedding API to convert the query into a vector, then performs a similarity
     search using pgvector's `<->` operator (approximate cosine distance) against stored embeddings.
-    Results are filtered to only include chunks from the specified repository.
+    Results are filtered to only include chunks from the specified repository. A larger
+    candidate set is fetched and re-ranked with MMR so the k results are diverse.
 
     Args:
         query (str): The user query or prompt for which similar chunks are retrieved.
         repo_hash (str): The repository hash to filter results to (prevents cross-project contamination).
         k (int, optional): The number of top results to return. Defaults to 5.
+        q_emb (list[float], optional): A precomputed query embedding, e.g. started
+            concurrently with other work. Computed from `query` when omitted.
 
     Returns:
-        List[Record]: A list of rows, each containing `source`, `chunk`, and `distance` fields.
+        List[Record]: A list of rows, each containing `source`, `symbol`, `start_line`,
+        `chunk_hash`, `chunk`, `token_count`, `embedding` and `distance` fields.
     """
-    embed_model = "text-embedding-3-small"
+    if q_emb is None:
+        q_emb = await embed_query(query)
 
-    client = openai.AsyncOpenAI()
-    q_emb = (
-        (
-            await client.embeddings.create(
-                model=embed_model,
-                input=[query],
-                encoding_format="float",
-            )
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(
+            """
+            SELECT m.source,
+                   m.symbol,
+                   m.start_line,
+                   m.chunk_hash,
+                   e.chunk,
+                   e.token_count,
+                   e.embedding,
+                   e.embedding <-> $1 AS distance
+            FROM repo_chunks m
+            JOIN chunk_embeddings e ON e.chunk_hash = m.chunk_hash
+            WHERE m.repo_hash = $3 AND e.embedding IS NOT NULL
+            ORDER BY e.embedding <-> $1
+            LIMIT $2;
+            """,
+            q_emb,
+            k * FETCH_MULTIPLIER,
+            repo_hash,
         )
-        .data[0]
-        .embedding
+    return diversify(q_emb, rows, k)
+
+
+def diversify(q_emb, rows, k: int, relevance=None):
+    """
+    Re-ranks candidate rows with MMR and the per-source cap.
+
+    Args:
+        q_emb: The query embedding.
+        rows: Candidate rows with `embedding` and `source` fields.
+        k (int): The number of rows to keep.
+        relevance (optional): Relevance per row; defaults to cosine similarity.
+
+    Returns:
+        List[Record]: The selected rows, in selection order.
+    """
+    if len(rows) <= 1:
+        return list(rows)
+    selected = mmr_select(
+        q_emb,
+        [row["embedding"] for row in rows],
+        k,
+        relevance=relevance,
+        sources=[row["source"] for row in rows],
+        max_per_source=MAX_CHUNKS_PER_SOURCE,
     )
+    return [rows[i] for i in selected]
+
+
+async def hybrid_chunks(
+    query: str, repo_hash: str, k: int = 8, candidates: int = 40, q_emb=None
+):
+    """
+    Retrieves the top-k chunks by fusing vector similarity and full-text search.
+
+    Both searches run as CTEs in a single SQL round trip: the vector search orders by
+    `<->` distance and the lexical search matches `chunk_tsv` against an OR'ed tsquery
+    built from the question (served by the GIN index). Each chunk's fused score is
+    ``sum(1 / (RRF_K + rank))`` over the lists it appears in, so chunks found by both
+    searches rise to the top while identifier-only matches still surface. The top
+    fused candidates are then re-ranked with MMR, using the fused score as relevance.
+
+    Args:
+        query (str): The user question.
+        repo_hash (str): The repository hash to filter results to.
+        k (int, optional): The number of fused results to return. Defaults to 8.
+        candidates (int, optional): How many hits each search contributes before fusion.
+            Defaults to 40.
+        q_emb (list[float], optional): A precomputed query embedding. Computed from
+            `query` when omitted.
+
+    Returns:
+        List[Record]: Rows with `source`, `symbol`, `start_line`, `chunk_hash`, `chunk`,
+        `token_count`, `embedding`, `distance`, `vector_rank`, `lexical_rank` and `score`
+        fields, in MMR selection order.
+    """
+    if q_emb is None:
+        q_emb = await embed_query(query)
+    ts_query = build_tsquery(query)
+
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(
+            f"""
+            WITH vector_hits AS (
+                SELECT m.id,
+                       row_number() OVER (ORDER BY e.embedding <-> $1) AS rank
+                FROM repo_chunks m
+                JOIN chunk_embeddings e ON e.chunk_hash = m.chunk_hash
+                WHERE m.repo_hash = $2 AND e.embedding IS NOT NULL
+                ORDER BY e.embedding <-> $1
+                LIMIT $4
+            ),
+            lexical_hits AS (
+                SELECT m.id,
+                       row_number() OVER (
+                           ORDER BY ts_rank_cd(e.chunk_tsv, q) DESC
+                       ) AS rank
+                FROM repo_chunks m
+                JOIN chunk_embeddings e ON e.chunk_hash = m.chunk_hash,
+                     to_tsquery('{TS_CONFIG}', $3) AS q
+                WHERE m.repo_hash = $2
+                  AND e.embedding IS NOT NULL
+                  AND e.chunk_tsv @@ q
+                ORDER BY ts_rank_cd(e.chunk_tsv, q) DESC
+                LIMIT $4
+            ),
+            fused AS (
+                SELECT COALESCE(v.id, l.id) AS id,
+                       v.rank AS vector_rank,
+                       l.rank AS lexical_rank,
+                       COALESCE(1.0 / ($5 + v.rank), 0)::float8
+                         + COALESCE(1.0 / ($5 + l.rank), 0)::float8 AS score
+                FROM vector_hits v
+                FULL OUTER JOIN lexical_hits l ON v.id = l.id
+            )
+            SELECT m.source,
+                   m.symbol,
+                   m.start_line,
+                   m.chunk_hash,
+                   e.chunk,
+                   e.token_count,
+                   e.embedding,
+                   e.embedding <-> $1 AS distance,
+                   f.vector_rank,
+                   f.lexical_rank,
+                   f.score
+            FROM fused f
+            JOIN repo_chunks m ON m.id = f.id
+            JOIN chunk_embeddings e ON e.chunk_hash = m.chunk_hash
+            ORDER BY f.score DESC
+            LIMIT $6;
+            """,
+            q_emb,
+            repo_hash,
+            ts_query,
+            candidates,
+            RRF_K,
+            k * FETCH_MULTIPLIER,
+        )
+    return diversify(q_emb, rows, k, relevance=[row["score"] for row in rows])
+
+
+async def lexical_chunks(query: str, repo_hash: str, k: int = 8):
+    """
+    Retrieves the top-k chunks by full-text search alone.
+
+    Used while a repository's embeddings are still being computed: chunks are
+    searchable through `chunk_tsv` as soon as they are stored. Without embeddings
+    MMR is not possible, so only the per-source cap is applied.
+
+    Args:
+        query (str): The user question.
+        repo_hash (str): The repository hash to filter results to.
+        k (int, optional): The number of results to return. Defaults to 8.
+
+    Returns:
+        List[Record]: Rows with `source`, `symbol`, `start_line`, `chunk_hash`, `chunk`,
+        `token_count` and `score` fields, best match first.
+    """
+    ts_query = build_tsquery(query)
+    if not ts_query:
+        return []
 
     pool = await get_pool()
     async with pool.acquire() as conn:
         rows = await conn.fetch(
+            f"""
+            SELECT m.source,
+                   m.symbol,
+                   m.start_line,
+                   m.chunk_hash,
+                   e.chunk,
+                   e.token_count,
+                   ts_rank_cd(e.chunk_tsv, q)::float8 AS score
+            FROM repo_chunks m
+            JOIN chunk_embeddings e ON e.chunk_hash = m.chunk_hash,
+                 to_tsquery('{TS_CONFIG}', $2) AS q
+            WHERE m.repo_hash = $1
+              AND e.chunk_tsv @@ q
+            ORDER BY score DESC
+            LIMIT $3;
+            """,
+            repo_hash,
+            ts_query,
+            k * FETCH_MULTIPLIER,
+        )
+
+    selected = []
+    per_source = {}
+    for row in rows:
+        if per_source.get(row["source"], 0) >= MAX_CHUNKS_PER_SOURCE:
+            continue
+        per_source[row["source"]] = per_source.get(row["source"], 0) + 1
+        selected.append(row)
+        if len(selected) >= k:
+            break
+    return selected
+
+
+async def still_relevant_chunks(
+    q_emb, repo_hash: str, chunk_hashes: list[str], k: int = 8
+):
+    """
+    Re-scores chunks used in earlier conversation turns against a new question.
+
+    Args:
+        q_emb (list[float]): The new question's embedding.
+        repo_hash (str): The repository hash to filter results to; chunks of
+            another snapshot are dropped.
+        chunk_hashes (list[str]): Hashes of previously used chunks.
+        k (int, optional): Maximum number of chunks to return. Defaults to 8.
+
+    Returns:
+        List[Record]: Rows with `source`, `symbol`, `start_line`, `chunk_hash`,
+        `chunk`, `token_count`, `embedding` and `similarity` fields for chunks with
+        a cosine similarity of at least `CARRY_OVER_MIN_SIMILARITY`, most similar first.
+    """
+    if not chunk_hashes:
+        return []
+
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        return await conn.fetch(
             """
-            SELECT source,
-                   chunk,
-                   embedding <-> $1 AS distance
-            FROM repo_chunks
-            WHERE repo_hash = $3
-            ORDER BY embedding <-> $1
-            LIMIT $2;
+            SELECT * FROM (
+                SELECT DISTINCT ON (m.chunk_hash)
+                       m.source,
+                       m.symbol,
+                       m.start_line,
+                       m.chunk_hash,
+                       e.chunk,
+                       e.token_count,
+                       e.embedding,
+                       1 - (e.embedding <=> $1) AS similarity
+                FROM repo_chunks m
+                JOIN chunk_embeddings e ON e.chunk_hash = m.chunk_hash
+                WHERE m.repo_hash = $2
+                  AND m.chunk_hash = ANY($3::text[])
+                  AND e.embedding IS NOT NULL
+                ORDER BY m.chunk_hash, m.start_line
+            ) carried
+            WHERE similarity >= $4
+            ORDER BY similarity DESC
+            LIMIT $5;
             """,
             q_emb,
-            k,
             repo_hash,
+            chunk_hashes,
+            CARRY_OVER_MIN_SIMILARITY,
+            k,
         )
-    return rows
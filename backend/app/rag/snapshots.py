@@ -0,0 +1,173 @@
+"""
+Module for storing repository snapshots server-side so chat requests can reference
+them by id instead of re-uploading every file on every question.
+
+A snapshot is content-addressed: its id is the same `repo_hash` used to key
+`repo_chunks`, so registering the same set of files twice is a no-op and the
+snapshot id doubles as the embedding cache key.
+
+Tables:
+- `repo_snapshots`: one row per snapshot with optional owner/repo/commit metadata.
+- `repo_snapshot_files`: the path and content of every file in a snapshot.
+"""
+
+from typing import Dict, List, Optional
+
+from app.db.db import get_pool
+from app.rag.embedder_pgvector import repo_hash
+
+
+async def register_snapshot(
+    files: List[Dict],
+    owner: Optional[str] = None,
+    repo: Optional[str] = None,
+    commit_sha: Optional[str] = None,
+) -> str:
+    """
+    Stores a set of files as a snapshot and returns its id.
+
+    If a snapshot with the same content hash already exists only its access time
+    (and any missing owner/repo/commit metadata) is updated.
+
+    Args:
+        files (List[Dict]): A list of files with 'path' and 'content' fields.
+        owner (str, optional): GitHub owner the files were fetched from.
+        repo (str, optional): GitHub repository the files were fetched from.
+        commit_sha (str, optional): Commit the files were fetched at.
+
+    Returns:
+        str: The snapshot id.
+    """
+    snapshot_id = repo_hash(files)
+
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            inserted = await conn.fetchval(
+                """
+                INSERT INTO repo_snapshots (id, owner, repo, commit_sha, file_count)
+                VALUES ($1, $2, $3, $4, $5)
+                ON CONFLICT (id) DO UPDATE
+                SET owner = COALESCE(repo_snapshots.owner, EXCLUDED.owner),
+                    repo = COALESCE(repo_snapshots.repo, EXCLUDED.repo),
+                    commit_sha = COALESCE(repo_snapshots.commit_sha, EXCLUDED.commit_sha),
+                    last_accessed_at = CURRENT_TIMESTAMP
+                RETURNING (xmax = 0)
+                """,
+                snapshot_id,
+                owner,
+                repo,
+                commit_sha,
+                len(files),
+            )
+            if inserted:
+                await conn.executemany(
+                    """
+                    INSERT INTO repo_snapshot_files (snapshot_id, path, content)
+                    VALUES ($1, $2, $3)
+                    ON CONFLICT DO NOTHING
+                    """,
+                    [(snapshot_id, f["path"], f["content"]) for f in files],
+                )
+
+    return snapshot_id
+
+
+async def find_snapshot(owner: str, repo: str, commit_sha: str) -> Optional[str]:
+    """
+    Looks up a snapshot previously registered for a repository at a given commit.
+
+    Args:
+        owner (str): GitHub owner.
+        repo (str): GitHub repository.
+        commit_sha (str): Commit SHA.
+
+    Returns:
+        Optional[str]: The snapshot id, or None if none was registered.
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        return await conn.fetchval(
+            """
+            SELECT id FROM repo_snapshots
+            WHERE owner = $1 AND repo = $2 AND commit_sha = $3
+            ORDER BY last_accessed_at DESC
+            LIMIT 1
+            """,
+            owner,
+            repo,
+            commit_sha,
+        )
+
+
+async def touch_snapshot(snapshot_id: str) -> bool:
+    """
+    Marks a snapshot as accessed.
+
+    Args:
+        snapshot_id (str): The snapshot id.
+
+    Returns:
+        bool: True if the snapshot exists.
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        found = await conn.fetchval(
+            """
+            UPDATE repo_snapshots SET last_accessed_at = CURRENT_TIMESTAMP
+            WHERE id = $1
+            RETURNING 1
+            """,
+            snapshot_id,
+        )
+    return bool(found)
+
+
+async def get_snapshot_files(
+    snapshot_id: str, paths: Optional[List[str]] = None
+) -> List[Dict]:
+    """
+    Loads every file of a snapshot.
+
+    Args:
+        snapshot_id (str): The snapshot id.
+        paths (List[str], optional): Only load these paths (those in the snapshot).
+
+    Returns:
+        List[Dict]: A list of files with 'path' and 'content' fields.
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(
+            """
+            SELECT path, content FROM repo_snapshot_files
+            WHERE snapshot_id = $1 AND ($2::text[] IS NULL OR path = ANY($2))
+            ORDER BY path
+            """,
+            snapshot_id,
+            paths,
+        )
+    return [{"path": row["path"], "content": row["content"]} for row in rows]
+
+
+async def get_snapshot_file(snapshot_id: str, path: str) -> Optional[str]:
+    """
+    Loads the content of a single file from a snapshot.
+
+    Args:
+        snapshot_id (str): The snapshot id.
+        path (str): The file path.
+
+    Returns:
+        Optional[str]: The file content, or None if the file is not in the snapshot.
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        return await conn.fetchval(
+            """
+            SELECT content FROM repo_snapshot_files
+            WHERE snapshot_id = $1 AND path = $2
+            """,
+            snapshot_id,
+            path,
+        )
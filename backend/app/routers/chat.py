@@ -7,22 +7,47 @@ retrieving relevant chunks, and generating responses using OpenAI's o4 model.
 
 The module supports streaming responses and context-aware chat by combining:
 - Selected file content (highest priority)
-- Vector similarity search results
-- Direct text matches with context extraction
+- Hybrid search results (vector similarity fused with Postgres full-text search)
+
+Repository files can be registered once as a server-side snapshot (POST /chat/snapshots)
+so that subsequent chat turns only send the question and the snapshot id. Follow-up
+questions pass the `session_id` returned by the previous turn to continue a
+conversation with server-side history.
 """
 
-import json
+import os
 import asyncio
-import re
 from typing import Optional
-import tiktoken
 from pydantic import BaseModel
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import StreamingResponse
-from app.rag.embedder_pgvector import embed_repo_pgvector, repo_hash
-from app.rag.retriever_pgvector import similar_chunks
+from app.rag.conversations import (
+    build_history_section,
+    carried_chunk_hashes,
+    open_session,
+    record_turn,
+)
+from app.rag.embed_jobs import enqueue_embed_job, get_embed_job, wait_for_embed_job
+from app.rag.embedder_pgvector import has_embeddings
+from app.rag.retriever_pgvector import (
+    embed_query,
+    hybrid_chunks,
+    lexical_chunks,
+    still_relevant_chunks,
+)
+from app.rag.snapshots import (
+    find_snapshot,
+    get_snapshot_file,
+    register_snapshot,
+    touch_snapshot,
+)
+from app.services.github import GitHubService
+from app.services.llm_scheduler import Priority
+from app.services.llm_usage import usage_tags
 from app.services.o4_mini_service import OpenAIo4Service
 from app.prompts import CHAT_PROMPT
+from app.utils.tokenizer import count_tokens, truncate_to_tokens
+from app.utils.sse import SSE_HEADERS, SSEEmitter, cancel_on_disconnect
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 
@@ -57,140 +82,295 @@ class RAGChatRequest(BaseModel):
     """
     Model for RAG-based chat requests.
 
+    Either `snapshot_id` (from POST /chat/snapshots) or the full `files` list must
+    be provided. Sending only the snapshot id keeps each chat turn small.
+
     Attributes:
         question: The user's question or query
         files: List of file dictionaries, each containing 'path' and 'content'
+        snapshot_id: Id of a repository snapshot registered earlier
         selected_file_path: Path of the file that should be prioritized in context
+        wait_for_embeddings: Wait for a new repository's embeddings instead of
+            answering from full-text search right away
+        context_deadline: Seconds to wait for embeddings before answering with
+            the context available so far (defaults to CONTEXT_DEADLINE_SECONDS)
+        session_id: Id of the conversation this question continues; a new
+            conversation is started when omitted or unknown
+        finish_in_background: Keep generating (and record the turn) after the
+            client disconnects
     """
 
     question: str
-    files: list[dict]  # Each dict should have 'path' and 'content'
+    files: Optional[list[dict]] = None  # Each dict should have 'path' and 'content'
+    snapshot_id: Optional[str] = None
     selected_file_path: str
+    wait_for_embeddings: bool = True
+    context_deadline: Optional[float] = None
+    session_id: Optional[str] = None
+    finish_in_background: bool = False
 
 
-o4_service = OpenAIo4Service()
-
-
-def estimate_tokens(text: str) -> int:
+class SnapshotRequest(BaseModel):
     """
-    Count the number of tokens in a given text string.
+    Model for registering a repository snapshot.
 
-    Uses the cl100k_base encoding which is commonly used by OpenAI models
-    to provide accurate token counting for API usage estimation.
+    Either upload `files` directly, or pass `username` and `repo` (and optionally
+    `commit`) to have the server fetch the files from GitHub.
 
-    Args:
-        text: The text string to count tokens for
-
-    Returns:
-        The number of tokens in the text
+    Attributes:
+        files: List of file dictionaries, each containing 'path' and 'content'
+        username: The GitHub username or organization name
+        repo: The repository name
+        githubAccessToken: GitHub access token for authentication
+        commit: Branch, tag or commit SHA to fetch (defaults to the default branch)
     """
-    encoding = tiktoken.get_encoding("cl100k_base")
-    return len(encoding.encode(text))
 
+    files: Optional[list[dict]] = None
+    username: Optional[str] = None
+    repo: Optional[str] = None
+    githubAccessToken: str = ""
+    commit: Optional[str] = None
 
-def extract_context_around_match(
-    content: str, query: str, context_chars: int = 500
-) -> list[str]:
-    """
-    Extract context snippets around text matches instead of entire file content.
 
-    This function searches for the query string in the content and extracts
-    surrounding context for each match, making the response more focused and
-    relevant while staying within token limits.
-
-    Args:
-        content: The full file content to search within
-        query: The search query to find matches for
-        context_chars: Number of characters to include around each match (default: 500)
+o4_service = OpenAIo4Service()
+github_service = GitHubService()
 
-    Returns:
-        List of context snippets, each containing the match with surrounding text
-    """
-    chunks = []
-    pattern = re.compile(re.escape(query), re.IGNORECASE)
+# How long a chat turn on a repository without embeddings waits for its embed
+# job before answering from full-text search alone. Requests may override it.
+CONTEXT_DEADLINE_SECONDS = float(os.getenv("RAG_CONTEXT_DEADLINE_SECONDS", "8"))
 
-    for match in pattern.finditer(content):
-        start = max(0, match.start() - context_chars)
-        end = min(len(content), match.end() + context_chars)
+MAX_CONTEXT_TOKENS = 8000
+# Chunks per answer; chunks still relevant from earlier turns count towards it,
+# but at least MIN_FRESH_CHUNKS are always retrieved for the new question.
+RETRIEVAL_K = 8
+MIN_FRESH_CHUNKS = 3
+# A context section is only worth including (or truncating) with this much room.
+MIN_SECTION_TOKENS = 100
 
-        # Get the context snippet
-        snippet = content[start:end]
 
-        # Add some indication if we truncated at the beginning or end
-        if start > 0:
-            snippet = "..." + snippet
-        if end < len(content):
-            snippet = snippet + "..."
+TRUNCATION_MARKER = "\n\n[Content truncated...]"
+PART_SEPARATOR = "\n\n"
+CHUNK_SEPARATOR = "\n---\n"
+SEPARATOR_TOKENS = {
+    "part": count_tokens(PART_SEPARATOR),
+    "chunk": count_tokens(CHUNK_SEPARATOR),
+    "marker": count_tokens(TRUNCATION_MARKER),
+}
 
-        chunks.append(snippet)
 
-        # Limit to avoid too many matches from same file
-        if len(chunks) >= 3:
-            break
+def build_chunk_section(header: str, rows) -> tuple[str, int]:
+    """
+    Join retrieved chunks into a single context section and count its tokens.
 
-    return chunks
+    Token counts stored with each chunk at embed time are summed instead of
+    re-encoding the chunk text; only the short per-chunk source labels are encoded.
+    Rows embedded before counts were stored fall back to counting the chunk.
 
+    Args:
+        header: Section heading, e.g. "RELEVANT CODE CHUNKS:"
+        rows: Retrieved rows with `source`, `symbol`, `start_line`, `chunk` and
+            `token_count` fields
 
-def truncate_context(context_parts: list[str], max_tokens: int = 8000) -> str:
+    Returns:
+        The section text and its token count
+    """
+    texts = []
+    tokens = count_tokens(header + "\n")
+    for row in rows:
+        label = f"From {row['source']}"
+        if row["start_line"]:
+            label += f" (line {row['start_line']})"
+        if row["symbol"]:
+            label += f" [{row['symbol']}]"
+        label += ":\n"
+        chunk_tokens = row["token_count"]
+        if chunk_tokens is None:
+            chunk_tokens = count_tokens(row["chunk"])
+        texts.append(label + row["chunk"])
+        tokens += count_tokens(label) + chunk_tokens
+    tokens += SEPARATOR_TOKENS["chunk"] * max(len(texts) - 1, 0)
+    return header + "\n" + CHUNK_SEPARATOR.join(texts), tokens
+
+
+def truncate_context(
+    context_parts: list[tuple[str, int]], max_tokens: int = MAX_CONTEXT_TOKENS
+) -> tuple[str, int]:
     """
     Truncate context to stay within token limits while preserving priority order.
 
     This function processes context parts in order and includes as many as possible
     within the token limit. If a part would exceed the limit, it truncates that part
-    to fit the remaining space.
+    at a token boundary to fit the remaining space. Parts carry precomputed token
+    counts, so only the part being truncated is ever encoded.
 
     Args:
-        context_parts: List of context sections to include, in priority order
-        max_tokens: Maximum number of tokens allowed (default: 8000)
+        context_parts: List of (text, token count) sections to include, in priority order
+        max_tokens: Maximum number of tokens allowed (default: MAX_CONTEXT_TOKENS)
 
     Returns:
-        Concatenated context string that fits within the token limit
+        Concatenated context string that fits within the token limit, and its token count
     """
     total_tokens = 0
     selected_parts = []
 
-    for part in context_parts:
-        part_tokens = estimate_tokens(part)
+    for part, part_tokens in context_parts:
+        if selected_parts:
+            part_tokens += SEPARATOR_TOKENS["part"]
         if total_tokens + part_tokens <= max_tokens:
             selected_parts.append(part)
             total_tokens += part_tokens
         else:
             # If this part would exceed the limit, truncate it
-            remaining_tokens = max_tokens - total_tokens
-            if remaining_tokens > 100:  # Only add if we have meaningful space
-                truncated_part = part[
-                    : remaining_tokens * 4
-                ]  # Rough conversion back to chars
-                selected_parts.append(truncated_part + "\n\n[Content truncated...]")
+            remaining_tokens = (
+                max_tokens
+                - total_tokens
+                - SEPARATOR_TOKENS["marker"]
+                - (SEPARATOR_TOKENS["part"] if selected_parts else 0)
+            )
+            # Only add if we have meaningful space
+            if remaining_tokens > MIN_SECTION_TOKENS:
+                truncated_part = truncate_to_tokens(part, remaining_tokens)
+                selected_parts.append(truncated_part + TRUNCATION_MARKER)
+                total_tokens = max_tokens
             break
 
-    return "\n\n".join(selected_parts)
+    return PART_SEPARATOR.join(selected_parts), total_tokens
+
+
+@router.post("/snapshots")
+async def create_snapshot(snapshot_request: SnapshotRequest):
+    """
+    Register a repository snapshot for subsequent chat requests.
+
+    The snapshot is content-addressed, so registering the same files again returns
+    the same id. When fetching from GitHub, a snapshot already registered for the
+    resolved commit is reused without refetching any files.
+
+    Args:
+        snapshot_request: Either the uploaded files or the repository to fetch
+
+    Returns:
+        dict: The `snapshot_id` and the number of files in the snapshot
+
+    Raises:
+        HTTPException: If neither files nor a repository are provided, or the
+            repository files cannot be fetched
+    """
+    if snapshot_request.files:
+        snapshot_id = await register_snapshot(snapshot_request.files)
+        return {
+            "snapshot_id": snapshot_id,
+            "file_count": len(snapshot_request.files),
+        }
+
+    if not (snapshot_request.username and snapshot_request.repo):
+        raise HTTPException(
+            status_code=400, detail="Provide either files or username and repo"
+        )
+
+    username = snapshot_request.username
+    repo = snapshot_request.repo
+    token = snapshot_request.githubAccessToken
+    try:
+        ref = snapshot_request.commit or await asyncio.to_thread(
+            github_service.get_default_branch, username, repo, token
+        )
+        commit_sha = await asyncio.to_thread(
+            github_service.get_head_commit_sha, username, repo, ref or "main", token
+        )
+        if not commit_sha:
+            raise ValueError(f"Could not resolve {ref} in {username}/{repo}")
+
+        snapshot_id = await find_snapshot(username, repo, commit_sha)
+        if snapshot_id:
+            await touch_snapshot(snapshot_id)
+            return {"snapshot_id": snapshot_id, "commit": commit_sha}
+
+        files = await asyncio.to_thread(
+            github_service.get_repository_files_with_contents,
+            username,
+            repo,
+            token,
+            ref=commit_sha,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=str(e)) from e
+
+    if not files:
+        raise HTTPException(status_code=400, detail="No files found in repository")
+
+    snapshot_id = await register_snapshot(
+        files, owner=username, repo=repo, commit_sha=commit_sha
+    )
+    return {"snapshot_id": snapshot_id, "file_count": len(files), "commit": commit_sha}
+
+
+@router.get("/snapshots/{snapshot_id}/embedding")
+async def snapshot_embedding_status(snapshot_id: str):
+    """
+    Report the progress of a snapshot's background embedding job.
+
+    Args:
+        snapshot_id: The snapshot id
+
+    Returns:
+        dict: The job's status, chunks done and total, attempts and last error
+
+    Raises:
+        HTTPException: If the snapshot was never queued for embedding
+    """
+    job = await get_embed_job(snapshot_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="No embedding job for snapshot")
+    return job
 
 
 @router.post("/rag")
-async def rag_chat(rag_request: RAGChatRequest):
+async def rag_chat(request: Request, rag_request: RAGChatRequest):
     """
     Handle RAG-based chat requests with streaming responses.
 
     This endpoint processes chat requests using Retrieval-Augmented Generation:
-    1. Embeds the provided files into vector storage
-    2. Retrieves relevant chunks based on the question
-    3. Extracts context from selected file and direct matches
-    4. Generates a response using the o4 model with streaming output
+    1. Loads the selected file and checks whether the repository is embedded
+    2. Queues the repository for background embedding if needed and follows the
+       job's progress until the context deadline, running full-text search as
+       soon as the job has stored the repository's chunks; the question is
+       embedded meanwhile if vector search may run
+    3. Retrieves relevant chunks with hybrid vector + full-text search, or uses
+       the full-text results if embeddings are still incomplete at the deadline
+    4. Adds the conversation history and reuses chunks from earlier turns that
+       are still relevant to the question
+    5. Generates a response using the o4 model with streaming output and records
+       the turn in the conversation
+
+    Processing stops when the client disconnects, unless `finish_in_background`
+    is set.
 
     The response is streamed as Server-Sent Events (SSE) with status updates
     for each step of the process.
 
     Args:
         request: FastAPI request object
-        rag_request: The RAG chat request containing question, files, and selected file
+        rag_request: The RAG chat request containing question, files or snapshot id,
+            and selected file
 
     Returns:
         StreamingResponse with SSE events containing status updates and response chunks
 
     Raises:
-        HTTPException: If an error occurs during processing
+        HTTPException: If neither files nor a known snapshot id is provided, or
+            an error occurs during processing
     """
+    if rag_request.snapshot_id:
+        if not await touch_snapshot(rag_request.snapshot_id):
+            raise HTTPException(status_code=404, detail="Snapshot not found")
+    elif not rag_request.files:
+        raise HTTPException(
+            status_code=400, detail="Provide either files or snapshot_id"
+        )
+
     try:
 
         async def event_generator():
@@ -198,81 +378,188 @@ async def rag_chat(rag_request: RAGChatRequest):
             Generate streaming events for the RAG chat process.
 
             Yields SSE events for each step of the process:
-            - embedding: When files are being embedded
-            - embedded: When embedding is complete
+            - embedding: When files are being embedded, with job progress
+            - embedded: When embedding is complete, or partial if retrieval
+              falls back to full-text search
             - retrieving: When retrieving relevant chunks
             - retrieved: When retrieval is complete with context summary
             - llm_chunk: Individual response chunks from the LLM
             - complete: Final complete response
             - error: If an error occurs during processing
             """
+            sse = SSEEmitter()
+            query_embedding = None
+            lexical_search = None
             try:
-                yield f"data: {json.dumps({'status': 'embedding', 'message': 'Embedding files...'})}\n\n"
-                await asyncio.sleep(0.1)
-                embed_result = await embed_repo_pgvector(rag_request.files)
-                yield f"data: {json.dumps({'status': 'embedded', 'message': embed_result})}\n\n"
-                await asyncio.sleep(0.1)
-                yield f"data: {json.dumps({'status': 'retrieving', 'message': 'Retrieving relevant chunks...'})}\n\n"
-                # Calculate repository hash to filter results to current project only
-                current_repo_hash = repo_hash(rag_request.files)
-                relevant_rows = await similar_chunks(
-                    rag_request.question, current_repo_hash
+                yield sse.event(
+                    {"status": "embedding", "message": "Embedding files..."}
                 )
-                # 1. Selected file content (highest priority)
-                selected_file_content = next(
+                if rag_request.snapshot_id:
+                    # The snapshot id is the repository hash, so the embed job
+                    # loads files from the snapshot store itself
+                    current_repo_hash = rag_request.snapshot_id
                     (
-                        f["content"]
-                        for f in rag_request.files
-                        if f["path"] == rag_request.selected_file_path
-                    ),
-                    None,
-                )
-                vector_chunks = [row["chunk"] for row in relevant_rows]
-
-                # 3. Direct text matches (lowest priority, extract snippets around matches)
-                usage_chunks = []
-                files_checked = 0
-                for f in rag_request.files:
-                    # Skip the selected file to avoid duplication
-                    if f["path"] == rag_request.selected_file_path:
-                        continue
-
-                    if re.search(
-                        re.escape(rag_request.question), f["content"], re.IGNORECASE
-                    ):
-                        # Extract context snippets around matches instead of entire file
-                        snippets = extract_context_around_match(
-                            f["content"], rag_request.question
-                        )
-                        for snippet in snippets:
-                            usage_chunks.append(f"From {f['path']}:\n{snippet}")
-
-                        files_checked += 1
-                        if files_checked >= 2:  # Limit to 2 files with direct matches
-                            break
+                        selected_file_content,
+                        embeddings_ready,
+                        session,
+                    ) = await asyncio.gather(
+                        get_snapshot_file(
+                            current_repo_hash, rag_request.selected_file_path
+                        ),
+                        has_embeddings(current_repo_hash),
+                        open_session(rag_request.session_id, current_repo_hash),
+                    )
+                else:
+                    # Register the uploaded files so the client can switch to
+                    # sending the snapshot id on later turns
+                    current_repo_hash = await register_snapshot(rag_request.files)
+                    selected_file_content = next(
+                        (
+                            f["content"]
+                            for f in rag_request.files
+                            if f["path"] == rag_request.selected_file_path
+                        ),
+                        None,
+                    )
+                    embeddings_ready, session = await asyncio.gather(
+                        has_embeddings(current_repo_hash),
+                        open_session(rag_request.session_id, current_repo_hash),
+                    )
 
-                # Build context with priority order
-                context_parts = []
+                history_section = build_history_section(session)
+                history_tokens = history_section[1] if history_section else 0
+                selected_part = None
+                selected_tokens = 0
                 if selected_file_content:
-                    context_parts.append(
-                        f"SELECTED FILE ({rag_request.selected_file_path}):\n{selected_file_content}"
-                    )
+                    selected_part = f"SELECTED FILE ({rag_request.selected_file_path}):\n{selected_file_content}"
+                    selected_tokens = count_tokens(selected_part)
+                # A selected file that fills the budget leaves no room for
+                # retrieved chunks, so there is nothing to wait for
+                needs_retrieval = (
+                    history_tokens + selected_tokens
+                    < MAX_CONTEXT_TOKENS - MIN_SECTION_TOKENS
+                )
 
-                if vector_chunks:
-                    context_parts.append(
-                        "RELEVANT CODE CHUNKS:\n" + "\n---\n".join(vector_chunks)
+                # The query embedding only serves vector search, so it is started
+                # once the repository is embedded or may be within the deadline
+                if embeddings_ready:
+                    if needs_retrieval:
+                        query_embedding = asyncio.create_task(
+                            embed_query(rag_request.question)
+                        )
+                    embed_result = "Using cached pgvector embeddings."
+                else:
+                    # Embedding runs in a background worker, so a disconnect
+                    # here does not waste the work
+                    job = await enqueue_embed_job(current_repo_hash)
+                    deadline = rag_request.context_deadline
+                    if deadline is None:
+                        deadline = CONTEXT_DEADLINE_SECONDS
+                    if not (rag_request.wait_for_embeddings and needs_retrieval):
+                        deadline = 0
+                    if deadline > 0 and job["status"] in ("queued", "running"):
+                        query_embedding = asyncio.create_task(
+                            embed_query(rag_request.question)
+                        )
+                    async for job in wait_for_embed_job(
+                        current_repo_hash, timeout=deadline, interval=0.25
+                    ):
+                        # Chunks are searchable as soon as the job has stored
+                        # them, so full-text search overlaps the embedding
+                        if (
+                            lexical_search is None
+                            and needs_retrieval
+                            and job["chunks_total"] is not None
+                        ):
+                            lexical_search = asyncio.create_task(
+                                lexical_chunks(rag_request.question, current_repo_hash)
+                            )
+                        if job["chunks_total"]:
+                            progress = f"Embedding chunks ({job['chunks_done']}/{job['chunks_total']})..."
+                            yield sse.event(
+                                {"status": "embedding", "message": progress}
+                            )
+                    embeddings_ready = job["status"] == "done"
+                    if embeddings_ready:
+                        embed_result = "Embedded repository chunks."
+                    elif job["status"] == "failed":
+                        embed_result = f"Embedding failed ({job['error']}); using full-text search only."
+                    else:
+                        embed_result = "Embedding continues in the background; using full-text search for now."
+                yield sse.event(
+                    {
+                        "status": "embedded",
+                        "message": embed_result,
+                        "snapshot_id": current_repo_hash,
+                        "session_id": session["id"],
+                        "partial": not embeddings_ready,
+                    }
+                )
+                yield sse.event(
+                    {"status": "retrieving", "message": "Retrieving relevant chunks..."}
+                )
+                if not needs_retrieval:
+                    relevant_rows = []
+                elif embeddings_ready:
+                    q_emb = await (query_embedding or embed_query(rag_request.question))
+                    # Chunks from the previous turns that still match the new
+                    # question are reused and fewer fresh chunks are retrieved
+                    carried_rows = await still_relevant_chunks(
+                        q_emb,
+                        current_repo_hash,
+                        carried_chunk_hashes(session),
+                        k=RETRIEVAL_K - MIN_FRESH_CHUNKS,
                     )
+                    fresh_rows = await hybrid_chunks(
+                        rag_request.question,
+                        current_repo_hash,
+                        k=RETRIEVAL_K - len(carried_rows),
+                        q_emb=q_emb,
+                    )
+                    fresh_hashes = {row["chunk_hash"] for row in fresh_rows}
+                    relevant_rows = list(fresh_rows) + [
+                        row
+                        for row in carried_rows
+                        if row["chunk_hash"] not in fresh_hashes
+                    ]
+                else:
+                    relevant_rows = await (
+                        lexical_search
+                        or lexical_chunks(rag_request.question, current_repo_hash)
+                    )
+                # Fused vector + full-text matches, skipping chunks of the
+                # selected file when it is already included in full
+                retrieved_rows = [
+                    row
+                    for row in relevant_rows
+                    if not (
+                        selected_file_content
+                        and row["source"] == rag_request.selected_file_path
+                    )
+                ]
+
+                # Build context with priority order; the history is bounded, so
+                # it always goes first
+                context_parts = []
+                if history_section:
+                    context_parts.append(history_section)
+                if selected_part:
+                    context_parts.append((selected_part, selected_tokens))
 
-                if usage_chunks:
+                if retrieved_rows:
                     context_parts.append(
-                        "DIRECT MATCHES:\n" + "\n---\n".join(usage_chunks)
+                        build_chunk_section("RELEVANT CODE CHUNKS:", retrieved_rows)
                     )
 
                 # Truncate context to stay within token limits
-                context = truncate_context(context_parts)
+                context, context_tokens = truncate_context(context_parts)
 
-                yield f"data: {json.dumps({'status': 'retrieved', 'message': f'Retrieved {len(context_parts)} context sections ({estimate_tokens(context)} tokens)'})}\n\n"
-                await asyncio.sleep(0.1)
+                yield sse.event(
+                    {
+                        "status": "retrieved",
+                        "message": f"Retrieved {len(context_parts)} context sections ({context_tokens} tokens)",
+                    }
+                )
 
                 # call the llm
                 system_prompt = CHAT_PROMPT
@@ -280,22 +567,52 @@ async def rag_chat(rag_request: RAGChatRequest):
                     "context": context,
                     "question": rag_request.question,
                 }
-                full_answer = ""
-                async for chunk in o4_service.call_o4_api_stream(system_prompt, data):
-                    full_answer += chunk
-                    yield f"data: {json.dumps({'status': 'llm_chunk', 'chunk': chunk})}\n\n"
-                yield f"data: {json.dumps({'status': 'complete', 'response': full_answer})}\n\n"
+                answer_stream = sse.chunks(
+                    o4_service.call_o4_api_stream(
+                        system_prompt,
+                        data,
+                        priority=Priority.CHAT,
+                        usage={**usage_tags("chat"), "phase": "answer"},
+                    ),
+                    {"status": "llm_chunk"},
+                )
+                async for frame in answer_stream:
+                    yield frame
+                full_answer = answer_stream.text
+                await record_turn(
+                    session["id"],
+                    rag_request.question,
+                    full_answer,
+                    [row["chunk_hash"] for row in retrieved_rows],
+                )
+                yield sse.event(
+                    {
+                        "status": "complete",
+                        "response": full_answer,
+                        "session_id": session["id"],
+                    }
+                )
             except (ValueError, RuntimeError, OSError) as e:
-                yield f"data: {json.dumps({'error': str(e)})}\n\n"
+                yield sse.event({"error": str(e)})
+            finally:
+                pending = [
+                    task
+                    for task in (query_embedding, lexical_search)
+                    if task is not None
+                ]
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
 
         return StreamingResponse(
-            event_generator(),
+            cancel_on_disconnect(
+                request,
+                event_generator(),
+                kind="chat",
+                finish_in_background=rag_request.finish_in_background,
+            ),
             media_type="text/event-stream",
-            headers={
-                "X-Accel-Buffering": "no",
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-            },
+            headers=SSE_HEADERS,
         )
 
     except Exception as e:
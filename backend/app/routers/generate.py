@@ -6,14 +6,20 @@ Mermaid syntax.
 
 Endpoints:
 - GET /generate: A basic test endpoint for validating OpenAI interaction.
-- POST /generate/cost: Estimates token usage and cost for analyzing a given GitHub repository.
+- POST /generate/cost: Estimates token usage and cost for analyzing a given GitHub repository
+  from its tree metadata, without downloading files or generating a README.
 - POST /generate/stream: Streams multi-phase AI-generated output including:
     1. Repository explanation
     2. Component mapping
     3. Mermaid diagram with interactive GitHub links
+  The run id is returned in the `X-Run-Id` header. A run without any connected
+  client is cancelled after a grace period unless `finish_in_background` is set.
+- GET /generate/stream/{run_id}: Resumes a generation after `Last-Event-ID`, replaying
+  missed events without restarting the pipeline.
 
 Utilities:
 - get_github_data: Retrieves default branch, file tree, and README content via GitHub API.
+- fit_repository_context: Compacts the file tree of repositories too large to send whole.
 - process_click_events: Enhances Mermaid diagrams by embedding GitHub URLs into diagram nodes.
 
 Dependencies:
@@ -25,15 +31,25 @@ Dependencies:
 All streamed endpoints follow Server-Sent Events (SSE) protocol.
 """
 
-import re
 import asyncio
-import json
+import re
 from dotenv import load_dotenv
-from fastapi import APIRouter, Request
+from typing import Optional, Tuple
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from app.services.llm_scheduler import Priority
+from app.services.llm_usage import calibrate, estimate_cost, usage_tags
 from app.services.o4_mini_service import OpenAIo4Service
-from app.services.github import GitHubService
+from app.services.cost_preview import count_file_tokens, fetch_tree
+from app.services.github_data_cache import cache_github_data, get_github_data_cached
+from app.services.readme_cache import cache_readme, get_cached_readme
+from app.services.github import (
+    GitHubService,
+    find_readme,
+    format_file_tree,
+    select_important_files,
+)
 from app.prompts import (
     SYSTEM_FIRST_PROMPT,
     SYSTEM_SECOND_PROMPT,
@@ -45,6 +61,11 @@ from app.utils.mermaid_validator import (
     validate_mermaid_syntax,
     quick_fix_mermaid_syntax,
 )
+from app.utils.sse import SSE_HEADERS, SSEEmitter
+from app.utils.repo_tree import RepoTree
+from app.utils.tokenizer import count_tokens_async
+from app.utils.tree_compaction import compact_repository_context
+from app.utils.stream_runs import resume_run, start_run
 
 load_dotenv()
 
@@ -52,6 +73,13 @@ router = APIRouter(prefix="/generate", tags=["OpenAI"])
 
 o4_service = OpenAIo4Service()
 
+# File tree and README tokens sent to the pipeline; larger repositories are
+# analyzed from a compacted file tree
+MAX_INPUT_TOKENS = 50000
+
+# README used when a repository has none and generating one fails; never cached
+FALLBACK_README = "# Project Documentation\n\nThis repository contains code for a software project. Please refer to the source code for more details."
+
 
 @router.get("")
 async def test():
@@ -63,13 +91,16 @@ async def test():
 
     data: dict = {"file_tree": "Hello World"}
 
-    return o4_service.call_o4_api(system_prompt, data)
+    return await o4_service.call_o4_api(system_prompt, data, priority=Priority.DIAGRAM)
 
 
-def get_github_data(username: str, repo: str, githubAccessToken: str):
+async def get_github_data(username: str, repo: str, githubAccessToken: str):
     """
     Fetches key metadata from a GitHub repository including the default branch, file tree, and README contents.
     If no README exists, generates one using AI. Prioritizes cached README from database.
+    The result is cached by head commit (`app.services.github_data_cache`), so
+    repeated calls for an unchanged repository only resolve its head commit and
+    look up the cached README, which wins over the one cached with the commit.
 
     Args:
         username (str): The GitHub username or organization name.
@@ -80,42 +111,80 @@ def get_github_data(username: str, repo: str, githubAccessToken: str):
         dict: A dictionary containing:
             - "default_branch" (str): The repository's default branch (e.g., "main" or "master").
             - "file_tree" (str): A serialized representation of the repository's file structure.
+            - "tree" (RepoTree): The same file structure, with the type of each path.
             - "readme" (str): The contents of the repository's README file as a string.
     """
     github_service = GitHubService()
-    default_branch = github_service.get_default_branch(
-        username, repo, githubAccessToken
+    # A README regenerated or written since the commit was cached is used too
+    commit_sha, cached_readme = await asyncio.gather(
+        asyncio.to_thread(
+            github_service.get_head_commit_sha,
+            username,
+            repo,
+            "HEAD",
+            githubAccessToken,
+        ),
+        get_cached_readme(username, repo),
     )
-    if not default_branch:
-        default_branch = "main"
-    file_tree = github_service.get_github_file_paths_as_list(
-        username, repo, githubAccessToken
+    cached = (
+        await get_github_data_cached(username, repo, commit_sha) if commit_sha else None
     )
+    if cached and cached["default_branch"] and cached["readme"] is not None:
+        print(f"Using cached repository data for {username}/{repo}@{commit_sha[:7]}")
+        if cached_readme:
+            cached["readme"] = cached_readme
+        return cached
 
-    # First, try to get cached README from database
-    readme = None
-    try:
-        from app.cache_utils import get_cached_readme
+    default_branch = (cached or {}).get("default_branch")
+    if not default_branch:
+        default_branch = await asyncio.to_thread(
+            github_service.get_default_branch, username, repo, githubAccessToken
+        )
+    if not default_branch:
+        default_branch = "main"
+    # The tree of a cost preview of the same commit, or the tree at the commit.
+    # GitHub is called from threads: a truncated tree alone takes many requests
+    if cached:
+        tree = cached["tree"]
+        file_tree = cached["file_tree"]
+    else:
+        if commit_sha:
+            tree = await asyncio.to_thread(
+                github_service.get_repository_tree,
+                username,
+                repo,
+                githubAccessToken,
+                ref=commit_sha,
+            )
+        else:
+            tree = await asyncio.to_thread(
+                github_service.get_file_tree, username, repo, githubAccessToken
+            )
+        file_tree = await asyncio.to_thread(format_file_tree, tree)
 
-        cached_readme = get_cached_readme(username, repo)
-        if cached_readme:
-            readme = cached_readme
-            print(f"Using cached README for {username}/{repo}")
-    except Exception as cache_error:
-        print(f"Could not fetch cached README: {cache_error}")
+    # First, try the cached README from the database
+    readme = cached_readme
+    if readme:
+        print(f"Using cached README for {username}/{repo}")
 
     # If no cached README, try to get existing README from GitHub
     if not readme:
         try:
-            readme = github_service.get_github_readme(username, repo, githubAccessToken)
+            readme = await asyncio.to_thread(
+                github_service.get_github_readme, username, repo, githubAccessToken
+            )
             print(f"Using GitHub README for {username}/{repo}")
         except ValueError as e:
             if "No README found" in str(e):
                 print(f"No README found for {username}/{repo}, generating one...")
                 # Generate README using AI
                 try:
-                    files = github_service.get_repository_files_with_contents(
-                        username, repo, githubAccessToken, max_files=20
+                    files = await asyncio.to_thread(
+                        github_service.get_repository_files_with_contents,
+                        username,
+                        repo,
+                        githubAccessToken,
+                        max_files=20,
                     )
 
                     if files:
@@ -130,28 +199,71 @@ def get_github_data(username: str, repo: str, githubAccessToken: str):
                         # Generate README using AI
                         from app.prompts import SYSTEM_README_GENERATION_PROMPT
 
-                        readme = o4_service.call_o4_api(
+                        readme = await o4_service.call_o4_api(
                             system_prompt=SYSTEM_README_GENERATION_PROMPT,
                             data={"files": files_text},
+                            priority=Priority.DIAGRAM,
+                            usage={
+                                **usage_tags("generate", username),
+                                "phase": "readme",
+                            },
                         )
 
                         # Cache the generated README
-                        try:
-                            from app.cache_utils import cache_readme
-
-                            cache_readme(username, repo, readme)
-                            print(f"Cached generated README for {username}/{repo}")
-                        except Exception as cache_error:
-                            print(f"Failed to cache generated README: {cache_error}")
+                        cache_readme(username, repo, readme)
                     else:
-                        readme = "# Project Documentation\n\nThis repository contains code for a software project. Please refer to the source code for more details."
+                        readme = FALLBACK_README
                 except Exception as gen_error:
                     # Fallback to a basic README
-                    readme = "# Project Documentation\n\nThis repository contains code for a software project. Please refer to the source code for more details."
+                    readme = FALLBACK_README
             else:
                 raise e
 
-    return {"default_branch": default_branch, "file_tree": file_tree, "readme": readme}
+    if commit_sha:
+        cache_github_data(
+            username,
+            repo,
+            commit_sha,
+            tree,
+            default_branch=default_branch,
+            readme=readme if readme != FALLBACK_README else None,
+            file_tree=file_tree,
+        )
+    return {
+        "default_branch": default_branch,
+        "file_tree": file_tree,
+        "tree": tree,
+        "readme": readme,
+    }
+
+
+async def fit_repository_context(
+    file_tree: str, readme: str
+) -> Tuple[str, str, int, bool]:
+    """
+    Fits the file tree and README into `MAX_INPUT_TOKENS`, compacting the tree
+    (and truncating a very long README) of repositories that exceed it.
+
+    Args:
+        file_tree (str): The repository's file tree.
+        readme (str): The repository's README.
+
+    Returns:
+        Tuple[str, str, int, bool]: The file tree and README to analyze, their
+        combined token count, and whether they were compacted.
+    """
+    # Counting stops once the repository is known to need compaction
+    token_count = await count_tokens_async(
+        f"{file_tree}\n{readme}", limit=MAX_INPUT_TOKENS
+    )
+    if token_count <= MAX_INPUT_TOKENS:
+        return file_tree, readme, token_count, False
+
+    file_tree, readme = await asyncio.to_thread(
+        compact_repository_context, file_tree, readme, MAX_INPUT_TOKENS
+    )
+    token_count = await count_tokens_async(f"{file_tree}\n{readme}")
+    return file_tree, readme, token_count, True
 
 
 class ApiRequest(BaseModel):
@@ -159,26 +271,67 @@ class ApiRequest(BaseModel):
     repo: str
     githubAccessToken: str
     instructions: str = ""
+    # Keep generating after the client disconnects instead of cancelling the run
+    finish_in_background: bool = False
 
 
 @router.post("/cost")
 async def get_generation_cost(request: Request, body: ApiRequest):
     try:
-        # Get file tree and README content
-        github_data = get_github_data(body.username, body.repo, body.githubAccessToken)
-        file_tree = github_data["file_tree"]
-        readme = github_data["readme"]
+        # Tree metadata only; the file tree itself is counted exactly
+        tree, commit_sha = await fetch_tree(
+            body.username, body.repo, body.githubAccessToken
+        )
+        file_tree_tokens = await count_tokens_async(format_file_tree(tree))
 
-        file_tree_tokens = o4_service.count_tokens(file_tree)
-        readme_tokens = o4_service.count_tokens(readme)
+        # README: cached copy, else the repository's own, else one generated from
+        # the repository files (as in get_github_data)
+        readme_generation_cost = 0.0
+        cached_readme = await get_cached_readme(body.username, body.repo)
+
+        readme_item = find_readme(tree)
+        if cached_readme:
+            readme_tokens = await count_tokens_async(cached_readme)
+        elif readme_item:
+            readme_tokens = (
+                await count_file_tokens(
+                    body.username,
+                    body.repo,
+                    commit_sha,
+                    [(readme_item.path, readme_item.size)],
+                )
+            )[readme_item.path]
+        else:
+            files = [
+                (path, size)
+                for path, _, size in select_important_files(tree, max_files=20)
+            ]
+            files_tokens = sum(
+                (
+                    await count_file_tokens(body.username, body.repo, commit_sha, files)
+                ).values()
+            )
+            readme_calibration = await calibrate("readme")
+            readme_tokens = readme_calibration["output_tokens"] or 2000
+            readme_generation_cost = estimate_cost(
+                input_tokens=files_tokens,
+                default_prompt_tokens=files_tokens,
+                default_output_tokens=readme_tokens,
+                calibration=readme_calibration,
+            )
 
-        # Input cost: $1.1 per 1M tokens ($0.0000011 per token)
-        # Output cost: $4.4 per 1M tokens ($0.0000044 per token)
-        input_cost = ((file_tree_tokens * 2 + readme_tokens) + 3000) * 0.0000011
-        output_cost = (
-            8000 * 0.0000044
-        )  # 8k just based on what I've seen (reasoning is expensive)
-        estimated_cost = input_cost + output_cost
+        # Calibrated from recorded usage once enough generations have run.
+        # Until then: the file tree is sent twice plus ~3k tokens of prompts, and
+        # 8k output tokens just based on what I've seen (reasoning is expensive)
+        # Larger repositories are analyzed from a compacted tree
+        input_tokens = min(file_tree_tokens + readme_tokens, MAX_INPUT_TOKENS)
+        tree_tokens = input_tokens - min(readme_tokens, input_tokens)
+        estimated_cost = readme_generation_cost + estimate_cost(
+            input_tokens=input_tokens,
+            default_prompt_tokens=input_tokens + tree_tokens + 3000,
+            default_output_tokens=8000,
+            calibration=await calibrate("generate"),
+        )
 
         # Format as currency string
         cost_string = f"${estimated_cost:.2f} USD"
@@ -187,18 +340,29 @@ async def get_generation_cost(request: Request, body: ApiRequest):
         return {"error": str(e)}
 
 
-def process_click_events(diagram: str, username: str, repo: str, branch: str) -> str:
+def process_click_events(
+    diagram: str,
+    username: str,
+    repo: str,
+    branch: str,
+    tree: Optional[RepoTree] = None,
+) -> str:
     """
     Process click events in Mermaid diagram to include full GitHub URLs.
-    Detects if path is file or directory and uses appropriate URL format.
+    Uses the type of the path in the repository tree if it is there, and otherwise
+    guesses whether the path is a file or directory.
     """
 
     def replace_path(match):
         # Extract the path from the click event
         path = match.group(2).strip("\"'")
 
-        # Determine if path is likely a file (has extension) or directory
-        is_file = "." in path.split("/")[-1]
+        kind = tree.kind(path) if tree is not None else None
+        if kind is not None:
+            is_file = kind == "blob"
+        else:
+            # Determine if path is likely a file (has extension) or directory
+            is_file = "." in path.split("/")[-1]
 
         # Construct GitHub URL
         base_url = f"https://github.com/{username}/{repo}"
@@ -220,50 +384,45 @@ async def generate_non_stream(request: Request, body: ApiRequest):
             return {"error": "Instructions exceed maximum length of 1000 characters"}
 
         # get github data
-        github_data = get_github_data(body.username, body.repo, body.githubAccessToken)
+        github_data = await get_github_data(
+            body.username, body.repo, body.githubAccessToken
+        )
         default_branch = github_data["default_branch"]
         file_tree = github_data["file_tree"]
         readme = github_data["readme"]
 
-        combined_content = f"{file_tree}\n{readme}"
-        token_count = o4_service.count_tokens(combined_content)
-
-        if 50000 < token_count < 195000:
-            return {
-                "error": f"File tree and README combined exceeds the token limit of (50,000). Current size: {token_count}"
-            }
-        elif token_count > 195000:
-            return {
-                "error": f"Repository is too large (>195k tokens) for analysis. Current size: {token_count}."
-            }
-
-        first_system_prompt = SYSTEM_FIRST_PROMPT
-        third_system_prompt = SYSTEM_THIRD_PROMPT
-        if body.instructions:
-            first_system_prompt = (
-                first_system_prompt + "\n" + ADDITIONAL_SYSTEM_INSTRUCTIONS_PROMPT
-            )
-            third_system_prompt = (
-                third_system_prompt + "\n" + ADDITIONAL_SYSTEM_INSTRUCTIONS_PROMPT
-            )
+        file_tree, readme, token_count, _ = await fit_repository_context(
+            file_tree, readme
+        )
+        tags = usage_tags("generate", body.username, input_tokens=token_count)
+
+        # Sent after the data so the system prompts stay a shared cache prefix
+        instructions_prompt = (
+            ADDITIONAL_SYSTEM_INSTRUCTIONS_PROMPT if body.instructions else None
+        )
 
         # Phase 1: Get explanation
-        explanation = o4_service.call_o4_api(
-            system_prompt=first_system_prompt,
+        explanation = await o4_service.call_o4_api(
+            system_prompt=SYSTEM_FIRST_PROMPT,
             data={
                 "file_tree": file_tree,
                 "readme": readme,
                 "instructions": body.instructions,
             },
+            priority=Priority.DIAGRAM,
+            usage={**tags, "phase": "explanation"},
+            instructions_prompt=instructions_prompt,
         )
 
         if "BAD_INSTRUCTIONS" in explanation:
             return {"error": "Invalid or unclear instructions provided"}
 
         # Phase 2: Get component mapping
-        full_second_response = o4_service.call_o4_api(
+        full_second_response = await o4_service.call_o4_api(
             system_prompt=SYSTEM_SECOND_PROMPT,
             data={"explanation": explanation, "file_tree": file_tree},
+            priority=Priority.DIAGRAM,
+            usage={**tags, "phase": "mapping"},
         )
 
         # Extract component mapping
@@ -274,13 +433,16 @@ async def generate_non_stream(request: Request, body: ApiRequest):
         ]
 
         # Phase 3: Generate Mermaid diagram
-        mermaid_code = o4_service.call_o4_api(
-            system_prompt=third_system_prompt,
+        mermaid_code = await o4_service.call_o4_api(
+            system_prompt=SYSTEM_THIRD_PROMPT,
             data={
                 "explanation": explanation,
                 "component_mapping": component_mapping_text,
                 "instructions": body.instructions,
             },
+            priority=Priority.DIAGRAM,
+            usage={**tags, "phase": "diagram"},
+            instructions_prompt=instructions_prompt,
         )
 
         # Process final diagram
@@ -303,9 +465,11 @@ async def generate_non_stream(request: Request, body: ApiRequest):
 
         for attempt in range(max_validation_attempts):
             try:
-                validation_response = o4_service.call_o4_api(
+                validation_response = await o4_service.call_o4_api(
                     system_prompt=SYSTEM_VALIDATION_PROMPT,
                     data={"diagram": validated_diagram},
+                    priority=Priority.DIAGRAM,
+                    usage={**tags, "phase": "validation"},
                 )
 
                 # Update the validated diagram for next attempt
@@ -327,7 +491,11 @@ async def generate_non_stream(request: Request, body: ApiRequest):
         # Process click events on the validated diagram
         try:
             processed_diagram = process_click_events(
-                validated_diagram, body.username, body.repo, default_branch
+                validated_diagram,
+                body.username,
+                body.repo,
+                default_branch,
+                github_data["tree"],
             )
         except Exception as click_error:
             print(f"Click event processing failed: {click_error}")
@@ -353,9 +521,10 @@ async def generate_stream(request: Request, body: ApiRequest):
             return {"error": "Instructions exceed maximum length of 1000 characters"}
 
         async def event_generator():
+            sse = SSEEmitter()
             try:
                 # get github data
-                github_data = get_github_data(
+                github_data = await get_github_data(
                     body.username, body.repo, body.githubAccessToken
                 )
                 default_branch = github_data["default_branch"]
@@ -363,64 +532,86 @@ async def generate_stream(request: Request, body: ApiRequest):
                 readme = github_data["readme"]
 
                 # start
-                yield f"data: {json.dumps({'status': 'started', 'message': 'Starting generation process...'})}\n\n"
-                await asyncio.sleep(0.1)
-
-                combined_content = f"{file_tree}\n{readme}"
-                token_count = o4_service.count_tokens(combined_content)
-
-                if 50000 < token_count < 195000:
-                    yield f"data: {json.dumps({'error': f'File tree and README combined exceeds the token limit of (50,000). Current size: {token_count}'})}"
-                    return
-                elif token_count > 195000:
-                    yield f"data: {json.dumps({'error': f'Repoisitory is too large (>195k tokens) for analysis. Current size: {token_count}.'})}\n\n"
-                    return
+                yield sse.event(
+                    {"status": "started", "message": "Starting generation process..."}
+                )
 
-                first_system_prompt = SYSTEM_FIRST_PROMPT
-                third_system_prompt = SYSTEM_THIRD_PROMPT
-                if body.instructions:
-                    first_system_prompt = (
-                        first_system_prompt
-                        + "\n"
-                        + ADDITIONAL_SYSTEM_INSTRUCTIONS_PROMPT
-                    )
-                    third_system_prompt = (
-                        third_system_prompt
-                        + "\n"
-                        + ADDITIONAL_SYSTEM_INSTRUCTIONS_PROMPT
+                file_tree, readme, token_count, compacted = (
+                    await fit_repository_context(file_tree, readme)
+                )
+                tags = usage_tags("generate", body.username, input_tokens=token_count)
+                if compacted:
+                    yield sse.event(
+                        {
+                            "status": "started",
+                            "message": f"Large repository: summarized the file tree to {token_count:,} tokens...",
+                        }
                     )
 
+                # Sent after the data so the system prompts stay a shared cache prefix
+                instructions_prompt = (
+                    ADDITIONAL_SYSTEM_INSTRUCTIONS_PROMPT if body.instructions else None
+                )
+
                 # Phase 1: Get explanation
-                yield f"data: {json.dumps({'status': 'explanation_sent', 'message': 'Starting phase 1... Sending explanation request to o4-mini...'})}\n\n"
-                await asyncio.sleep(0.1)
-                yield f"data: {json.dumps({'status': 'explanation', 'message': 'Analyzing repository structure...'})}\n\n"
-                explanation = ""
-                async for chunk in o4_service.call_o4_api_stream(
-                    system_prompt=first_system_prompt,
-                    data={
-                        "file_tree": file_tree,
-                        "readme": readme,
-                        "instructions": body.instructions,
-                    },
-                ):
-                    explanation += chunk
-                    yield f"data: {json.dumps({'status': 'explanation_chunk', 'chunk': chunk})}\n\n"
+                yield sse.event(
+                    {
+                        "status": "explanation_sent",
+                        "message": "Starting phase 1... Sending explanation request to o4-mini...",
+                    }
+                )
+                yield sse.event(
+                    {
+                        "status": "explanation",
+                        "message": "Analyzing repository structure...",
+                    }
+                )
+                explanation_stream = sse.chunks(
+                    o4_service.call_o4_api_stream(
+                        system_prompt=SYSTEM_FIRST_PROMPT,
+                        data={
+                            "file_tree": file_tree,
+                            "readme": readme,
+                            "instructions": body.instructions,
+                        },
+                        priority=Priority.DIAGRAM,
+                        usage={**tags, "phase": "explanation"},
+                        instructions_prompt=instructions_prompt,
+                    ),
+                    {"status": "explanation_chunk"},
+                )
+                async for frame in explanation_stream:
+                    yield frame
+                explanation = explanation_stream.text
 
                 if "BAD_INSTRUCTIONS" in explanation:
-                    yield f"data: {json.dumps({'error': 'Invalid or unclear instructions provided'})}\n\n"
+                    yield sse.event(
+                        {"error": "Invalid or unclear instructions provided"}
+                    )
                     return
 
                 # Phase 2: Get component mapping
-                yield f"data: {json.dumps({'status': 'mapping_sent', 'message': 'Starting phase 2... Sending component mapping request to o4-mini...'})}\n\n"
-                await asyncio.sleep(0.1)
-                yield f"data: {json.dumps({'status': 'mapping', 'message': 'Creating component mapping...'})}\n\n"
-                full_second_response = ""
-                async for chunk in o4_service.call_o4_api_stream(
-                    system_prompt=SYSTEM_SECOND_PROMPT,
-                    data={"explanation": explanation, "file_tree": file_tree},
-                ):
-                    full_second_response += chunk
-                    yield f"data: {json.dumps({'status': 'mapping_chunk', 'chunk': chunk})}\n\n"
+                yield sse.event(
+                    {
+                        "status": "mapping_sent",
+                        "message": "Starting phase 2... Sending component mapping request to o4-mini...",
+                    }
+                )
+                yield sse.event(
+                    {"status": "mapping", "message": "Creating component mapping..."}
+                )
+                mapping_stream = sse.chunks(
+                    o4_service.call_o4_api_stream(
+                        system_prompt=SYSTEM_SECOND_PROMPT,
+                        data={"explanation": explanation, "file_tree": file_tree},
+                        priority=Priority.DIAGRAM,
+                        usage={**tags, "phase": "mapping"},
+                    ),
+                    {"status": "mapping_chunk"},
+                )
+                async for frame in mapping_stream:
+                    yield frame
+                full_second_response = mapping_stream.text
 
                 # i dont think i need this anymore? but keep it here for now
                 # Extract component mapping
@@ -433,25 +624,39 @@ async def generate_stream(request: Request, body: ApiRequest):
                 ]
 
                 # Phase 3: Generate Mermaid diagram
-                yield f"data: {json.dumps({'status': 'diagram_sent', 'message': 'Starting phase 3... Sending diagram generation request to o4-mini...'})}\n\n"
-                await asyncio.sleep(0.1)
-                yield f"data: {json.dumps({'status': 'diagram', 'message': 'Generating diagram...'})}\n\n"
-                mermaid_code = ""
-                async for chunk in o4_service.call_o4_api_stream(
-                    system_prompt=third_system_prompt,
-                    data={
-                        "explanation": explanation,
-                        "component_mapping": component_mapping_text,
-                        "instructions": body.instructions,
-                    },
-                ):
-                    mermaid_code += chunk
-                    yield f"data: {json.dumps({'status': 'diagram_chunk', 'chunk': chunk})}\n\n"
+                yield sse.event(
+                    {
+                        "status": "diagram_sent",
+                        "message": "Starting phase 3... Sending diagram generation request to o4-mini...",
+                    }
+                )
+                yield sse.event(
+                    {"status": "diagram", "message": "Generating diagram..."}
+                )
+                diagram_stream = sse.chunks(
+                    o4_service.call_o4_api_stream(
+                        system_prompt=SYSTEM_THIRD_PROMPT,
+                        data={
+                            "explanation": explanation,
+                            "component_mapping": component_mapping_text,
+                            "instructions": body.instructions,
+                        },
+                        priority=Priority.DIAGRAM,
+                        usage={**tags, "phase": "diagram"},
+                        instructions_prompt=instructions_prompt,
+                    ),
+                    {"status": "diagram_chunk"},
+                )
+                async for frame in diagram_stream:
+                    yield frame
+                mermaid_code = diagram_stream.text
 
                 # Process final diagram
                 mermaid_code = mermaid_code.replace("```mermaid", "").replace("```", "")
                 if "BAD_INSTRUCTIONS" in mermaid_code:
-                    yield f"data: {json.dumps({'error': 'Invalid or unclear instructions provided'})}\n\n"
+                    yield sse.event(
+                        {"error": "Invalid or unclear instructions provided"}
+                    )
                     return
 
                 # Quick fix common syntax issues before AI validation
@@ -464,9 +669,15 @@ async def generate_stream(request: Request, body: ApiRequest):
                     # Continue with AI validation to fix these issues
 
                 # Phase 4: Validate and fix syntax errors (with multiple attempts)
-                yield f"data: {json.dumps({'status': 'validation_sent', 'message': 'Validating diagram syntax...'})}\n\n"
-                await asyncio.sleep(0.1)
-                yield f"data: {json.dumps({'status': 'validation', 'message': 'Checking for syntax errors...'})}\n\n"
+                yield sse.event(
+                    {
+                        "status": "validation_sent",
+                        "message": "Validating diagram syntax...",
+                    }
+                )
+                yield sse.event(
+                    {"status": "validation", "message": "Checking for syntax errors..."}
+                )
 
                 # Multiple validation attempts to ensure syntax is correct
                 validated_diagram = mermaid_code
@@ -474,13 +685,18 @@ async def generate_stream(request: Request, body: ApiRequest):
 
                 for attempt in range(max_validation_attempts):
                     try:
-                        validation_response = ""
-                        async for chunk in o4_service.call_o4_api_stream(
-                            system_prompt=SYSTEM_VALIDATION_PROMPT,
-                            data={"diagram": validated_diagram},
-                        ):
-                            validation_response += chunk
-                            yield f"data: {json.dumps({'status': 'validation_chunk', 'chunk': chunk})}\n\n"
+                        validation_stream = sse.chunks(
+                            o4_service.call_o4_api_stream(
+                                system_prompt=SYSTEM_VALIDATION_PROMPT,
+                                data={"diagram": validated_diagram},
+                                priority=Priority.DIAGRAM,
+                                usage={**tags, "phase": "validation"},
+                            ),
+                            {"status": "validation_chunk"},
+                        )
+                        async for frame in validation_stream:
+                            yield frame
+                        validation_response = validation_stream.text
 
                         # Update the validated diagram for next attempt
                         validated_diagram = validation_response.strip()
@@ -503,7 +719,11 @@ async def generate_stream(request: Request, body: ApiRequest):
                 # Process click events on the validated diagram
                 try:
                     processed_diagram = process_click_events(
-                        validated_diagram, body.username, body.repo, default_branch
+                        validated_diagram,
+                        body.username,
+                        body.repo,
+                        default_branch,
+                        github_data["tree"],
                     )
                 except Exception as click_error:
                     print(f"Click event processing failed: {click_error}")
@@ -518,21 +738,52 @@ async def generate_stream(request: Request, body: ApiRequest):
                     "mapping": component_mapping_text,
                 }
 
-                safe_json = json.dumps(final_data, ensure_ascii=False)
-                yield f"data: {safe_json}\n\n"
+                yield sse.event(final_data)
 
             except Exception as e:
-                yield f"data: {json.dumps({'error': str(e)})}\n\n"
+                yield sse.event({"error": str(e)})
 
-        return StreamingResponse(
+        # The run continues in the background if the client disconnects, so it
+        # can reconnect to GET /generate/stream/{run_id} without restarting it.
+        # It is cancelled if nobody reconnects within SSE_RUN_ABANDON_SECONDS.
+        run = start_run(
             event_generator(),
+            kind="generate",
+            finish_in_background=body.finish_in_background,
+        )
+        return StreamingResponse(
+            run.subscribe(request=request),
             media_type="text/event-stream",
-            headers={
-                "X-Accel-Buffering": "no",
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-            },
+            headers={**SSE_HEADERS, "X-Run-Id": run.id},
         )
 
     except Exception as e:
         return {"error": str(e)}
+
+
+@router.get("/stream/{run_id}")
+async def resume_generate_stream(
+    run_id: str, request: Request, last_event_id: Optional[int] = None
+):
+    """
+    Reconnect to a running or recently finished generation.
+
+    Events after the client's `Last-Event-ID` header (or `last_event_id` query
+    parameter, for clients that cannot set headers) are replayed, then the stream
+    continues live until the run finishes.
+
+    Raises:
+        HTTPException: If the run is unknown or has expired.
+    """
+    header = request.headers.get("last-event-id", "")
+    if header.isdigit():
+        last_event_id = int(header)
+
+    events = await resume_run(run_id, last_event_id or 0, request)
+    if events is None:
+        raise HTTPException(status_code=404, detail="Run not found or expired")
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={**SSE_HEADERS, "X-Run-Id": run_id},
+    )
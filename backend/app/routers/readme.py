@@ -9,17 +9,21 @@ The module supports both streaming and non-streaming responses and uses the o4 m
 to generate high-quality documentation.
 """
 
-import json
-import asyncio
 import re
 from typing import Optional
 from pydantic import BaseModel
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import StreamingResponse
-from app.services.github import GitHubService
+from app.services.cost_preview import count_file_tokens, fetch_tree
+from app.services.github import GitHubService, select_important_files
+from app.services.llm_scheduler import Priority
+from app.services.llm_usage import calibrate, estimate_cost, usage_tags
 from app.services.o4_mini_service import OpenAIo4Service
+from app.services.readme_cache import cache_readme
 from app.prompts import SYSTEM_README_GENERATION_PROMPT
-from app.cache import cache_readme
+from app.utils.sse import SSE_HEADERS, SSEEmitter, cancel_on_disconnect
+from app.utils.token_estimate import observe
+from app.utils.tokenizer import count_tokens_batch_async
 
 router = APIRouter(prefix="/readme", tags=["readme"])
 
@@ -85,12 +89,15 @@ class ReadmeRequest(BaseModel):
         repo: The repository name
         githubAccessToken: GitHub access token for authentication
         instructions: Optional custom instructions for README generation
+        finish_in_background: Keep generating (and cache the README) after a
+            streaming client disconnects
     """
 
     username: str
     repo: str
     githubAccessToken: str
     instructions: str = ""
+    finish_in_background: bool = False
 
 
 class ReadmeResponse(BaseModel):
@@ -125,6 +132,21 @@ def format_files_for_prompt(files):
     return "\n\n".join(formatted_files)
 
 
+async def count_input_tokens(files, instructions: str) -> int:
+    """
+    Count the tokens of the repository files and instructions a README is
+    generated from; the size the cost estimate is based on.
+    """
+    counts = await count_tokens_batch_async([file["content"] for file in files])
+    for file, tokens in zip(files, counts):
+        # Calibrates the size-based estimates of the cost endpoints
+        observe(file["path"], len(file["content"].encode()), tokens)
+    total_tokens = sum(counts)
+    if instructions:
+        total_tokens += o4_service.count_tokens(instructions)
+    return total_tokens
+
+
 @router.post("/generate")
 async def generate_readme(request: ReadmeRequest):
     """
@@ -157,24 +179,33 @@ async def generate_readme(request: ReadmeRequest):
         # Format files for the AI prompt
         formatted_files = format_files_for_prompt(files)
 
-        # Prepare the prompt with custom instructions if provided
-        system_prompt = SYSTEM_README_GENERATION_PROMPT
+        # Custom instructions are sent after the files, keeping the prompt cacheable
+        instructions_prompt = None
         if request.instructions:
-            system_prompt += f"\n\nAdditional Instructions: {request.instructions}"
+            instructions_prompt = f"Additional Instructions: {request.instructions}"
 
         # Generate README using AI
-        readme_content = o4_service.call_o4_api(
-            system_prompt=system_prompt, data={"files": formatted_files}
+        readme_content = await o4_service.call_o4_api(
+            system_prompt=SYSTEM_README_GENERATION_PROMPT,
+            data={"files": formatted_files},
+            priority=Priority.README,
+            usage={
+                **usage_tags(
+                    "readme",
+                    request.username,
+                    await count_input_tokens(files, request.instructions),
+                ),
+                "phase": "readme",
+            },
+            instructions_prompt=instructions_prompt,
         )
 
         # Clean up the generated content
         readme_content = clean_readme_content(readme_content)
 
-        # Save README to database (async, don't wait for it)
-        asyncio.create_task(
-            cache_readme(
-                request.username, request.repo, readme_content, request.instructions
-            )
+        # Save README to database (in the background)
+        cache_readme(
+            request.username, request.repo, readme_content, request.instructions
         )
 
         return ReadmeResponse(readme=readme_content)
@@ -186,15 +217,17 @@ async def generate_readme(request: ReadmeRequest):
 
 
 @router.post("/generate/stream")
-async def generate_readme_stream(request: ReadmeRequest):
+async def generate_readme_stream(request: ReadmeRequest, http_request: Request):
     """
     Generate a comprehensive README for a GitHub repository with streaming response.
 
     This endpoint provides real-time updates during the README generation process,
-    including file fetching, analysis, and content generation.
+    including file fetching, analysis, and content generation. Generation stops
+    when the client disconnects, unless `finish_in_background` is set.
 
     Args:
         request: The README generation request
+        http_request: FastAPI request object, used to detect disconnects
 
     Returns:
         StreamingResponse: Server-Sent Events with generation progress and content
@@ -218,13 +251,16 @@ async def generate_readme_stream(request: ReadmeRequest):
             - complete: Final complete README
             - error: If an error occurs during processing
             """
+            sse = SSEEmitter()
             try:
-                yield f"data: {json.dumps({'status': 'started', 'message': 'Starting README generation...'})}\n\n"
-                await asyncio.sleep(0.1)
+                yield sse.event(
+                    {"status": "started", "message": "Starting README generation..."}
+                )
 
                 # Fetch repository files
-                yield f"data: {json.dumps({'status': 'fetching', 'message': 'Fetching repository files...'})}\n\n"
-                await asyncio.sleep(0.1)
+                yield sse.event(
+                    {"status": "fetching", "message": "Fetching repository files..."}
+                )
 
                 try:
                     files = github_service.get_repository_files_with_contents(
@@ -235,67 +271,92 @@ async def generate_readme_stream(request: ReadmeRequest):
                     )
 
                     if not files:
-                        yield f"data: {json.dumps({'error': 'No files found in repository'})}\n\n"
+                        yield sse.event({"error": "No files found in repository"})
                         return
                 except Exception as e:
-                    yield f"data: {json.dumps({'error': f'Failed to fetch repository files: {str(e)}'})}\n\n"
+                    yield sse.event(
+                        {"error": f"Failed to fetch repository files: {str(e)}"}
+                    )
                     return
 
-                yield f"data: {json.dumps({'status': 'fetched', 'message': f'Fetched {len(files)} files from repository'})}\n\n"
-                await asyncio.sleep(0.1)
+                yield sse.event(
+                    {
+                        "status": "fetched",
+                        "message": f"Fetched {len(files)} files from repository",
+                    }
+                )
 
                 # Analyze repository content
-                yield f"data: {json.dumps({'status': 'analyzing', 'message': 'Analyzing repository structure and content...'})}\n\n"
-                await asyncio.sleep(0.1)
+                yield sse.event(
+                    {
+                        "status": "analyzing",
+                        "message": "Analyzing repository structure and content...",
+                    }
+                )
 
                 # Format files for the AI prompt
                 formatted_files = format_files_for_prompt(files)
 
-                # Prepare the prompt with custom instructions if provided
-                system_prompt = SYSTEM_README_GENERATION_PROMPT
+                # Custom instructions are sent after the files, keeping the
+                # prompt cacheable
+                instructions_prompt = None
                 if request.instructions:
-                    system_prompt += (
-                        f"\n\nAdditional Instructions: {request.instructions}"
+                    instructions_prompt = (
+                        f"Additional Instructions: {request.instructions}"
                     )
 
                 # Generate README content with streaming
-                yield f"data: {json.dumps({'status': 'generating', 'message': 'Generating README content...'})}\n\n"
-                await asyncio.sleep(0.1)
+                yield sse.event(
+                    {"status": "generating", "message": "Generating README content..."}
+                )
 
-                full_readme = ""
-                async for chunk in o4_service.call_o4_api_stream(
-                    system_prompt=system_prompt, data={"files": formatted_files}
-                ):
-                    full_readme += chunk
-                    yield f"data: {json.dumps({'status': 'llm_chunk', 'chunk': chunk})}\n\n"
+                readme_stream = sse.chunks(
+                    o4_service.call_o4_api_stream(
+                        system_prompt=SYSTEM_README_GENERATION_PROMPT,
+                        data={"files": formatted_files},
+                        priority=Priority.README,
+                        usage={
+                            **usage_tags(
+                                "readme",
+                                request.username,
+                                await count_input_tokens(files, request.instructions),
+                            ),
+                            "phase": "readme",
+                        },
+                        instructions_prompt=instructions_prompt,
+                    ),
+                    {"status": "llm_chunk"},
+                )
+                async for frame in readme_stream:
+                    yield frame
+                full_readme = readme_stream.text
 
                 # Clean up the generated content
                 full_readme = clean_readme_content(full_readme)
 
                 # Send final complete response
-                yield f"data: {json.dumps({'status': 'complete', 'readme': full_readme})}\n\n"
-
-                # Save README to database (async, don't wait for it)
-                asyncio.create_task(
-                    cache_readme(
-                        request.username,
-                        request.repo,
-                        full_readme,
-                        request.instructions,
-                    )
+                yield sse.event({"status": "complete", "readme": full_readme})
+
+                # Save README to database (in the background)
+                cache_readme(
+                    request.username,
+                    request.repo,
+                    full_readme,
+                    request.instructions,
                 )
 
             except Exception as e:
-                yield f"data: {json.dumps({'error': str(e)})}\n\n"
+                yield sse.event({"error": str(e)})
 
         return StreamingResponse(
-            event_generator(),
+            cancel_on_disconnect(
+                http_request,
+                event_generator(),
+                kind="readme",
+                finish_in_background=request.finish_in_background,
+            ),
             media_type="text/event-stream",
-            headers={
-                "X-Accel-Buffering": "no",
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-            },
+            headers=SSE_HEADERS,
         )
 
     except Exception as e:
@@ -307,6 +368,10 @@ async def get_readme_generation_cost(request: ReadmeRequest):
     """
     Estimate the cost for generating a README for a repository.
 
+    Selects the same files as generation from the repository tree, without
+    downloading them: token counts come from a stored snapshot of the commit
+    where there is one and are estimated from the file sizes otherwise.
+
     Args:
         request: The README generation request
 
@@ -314,36 +379,40 @@ async def get_readme_generation_cost(request: ReadmeRequest):
         dict: Estimated cost information
     """
     try:
-        # Fetch repository files to estimate token usage
         try:
-            files = github_service.get_repository_files_with_contents(
-                request.username, request.repo, request.githubAccessToken, max_files=30
+            tree, commit_sha = await fetch_tree(
+                request.username, request.repo, request.githubAccessToken
             )
-
-            if not files:
-                return {"error": "No files found in repository"}
-
         except Exception as e:
             return {"error": f"Failed to fetch repository files: {str(e)}"}
 
-        # Calculate total tokens from files
-        total_tokens = 0
-        for file in files:
-            total_tokens += o4_service.count_tokens(file["content"])
+        # Same selection as generation
+        selected_files = select_important_files(tree, max_files=30)
+        if not selected_files:
+            return {"error": "No files found in repository"}
 
-        # Add tokens for instructions if provided
+        file_tokens = await count_file_tokens(
+            request.username,
+            request.repo,
+            commit_sha,
+            [(path, size) for path, _, size in selected_files],
+        )
+
+        # Calculate total tokens from files and instructions
+        total_tokens = sum(file_tokens.values())
         if request.instructions:
             total_tokens += o4_service.count_tokens(request.instructions)
 
-        # Estimate output tokens (typical README length)
-        estimated_output_tokens = 2000
-
-        # Calculate costs
-        # Input cost: $1.1 per 1M tokens ($0.0000011 per token)
-        # Output cost: $4.4 per 1M tokens ($0.0000044 per token)
-        input_cost = total_tokens * 0.0000011
-        output_cost = estimated_output_tokens * 0.0000044
-        estimated_cost = input_cost + output_cost
+        # Calibrated from recorded usage once enough READMEs have been generated;
+        # until then the prompt is the files and the output a typical README
+        calibration = await calibrate("readme")
+        estimated_output_tokens = calibration["output_tokens"] or 2000
+        estimated_cost = estimate_cost(
+            input_tokens=total_tokens,
+            default_prompt_tokens=total_tokens,
+            default_output_tokens=estimated_output_tokens,
+            calibration=calibration,
+        )
 
         # Format as currency string
         cost_string = f"${estimated_cost:.2f} USD"
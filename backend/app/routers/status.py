@@ -1,9 +1,24 @@
 """
-Check the status of the database connection from the backend.
+Check the status of the database connection from the backend, and inspect or
+trigger the retention sweep for stale repository snapshots, and read the
+in-process metrics, LLM queue state and token usage.
+
+Triggering a sweep loads the database, so it requires the `ADMIN_TOKEN`
+environment variable to be set and sent in the `X-Admin-Token` header.
 """
 
-from fastapi import APIRouter
+import hmac
+import os
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException
 from app.db.db import get_pool
+from app.rag.retention import retention_report, run_retention
+from app.services.llm_scheduler import scheduler
+from app.services.llm_usage import usage_report
+from app.utils.metrics import snapshot
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
 
 router = APIRouter(prefix="/db", tags=["PostgreSQL"])
 
@@ -20,3 +35,50 @@ async def health_check():
         return {"status": "healthy", "database": "connected"}
     except Exception as e:
         return {"status": "unhealthy", "error": str(e)}
+
+
+@router.get("/retention")
+async def get_retention_report():
+    """
+    Dry-run report of what the next retention sweep would delete.
+    """
+    try:
+        return await retention_report()
+    except Exception as e:
+        return {"error": str(e)}
+
+
+@router.post("/retention")
+async def trigger_retention(x_admin_token: Optional[str] = Header(None)):
+    """
+    Run a retention sweep now instead of waiting for the background task.
+    Requires the `X-Admin-Token` header; disabled when `ADMIN_TOKEN` is not set.
+    """
+    if not ADMIN_TOKEN or not hmac.compare_digest(
+        (x_admin_token or "").encode(), ADMIN_TOKEN.encode()
+    ):
+        raise HTTPException(status_code=403, detail="Admin token required")
+    try:
+        return await run_retention()
+    except Exception as e:
+        return {"error": str(e)}
+
+
+@router.get("/metrics")
+async def get_metrics():
+    """
+    Counters recorded by this worker process since it started, and the current
+    load of its LLM scheduler.
+    """
+    return {"metrics": snapshot(), "llm_scheduler": scheduler.stats()}
+
+
+@router.get("/usage")
+async def get_usage_report(days: int = 7):
+    """
+    Token usage and cost per route and phase over the last `days` days.
+    """
+    try:
+        return {"days": days, "usage": await usage_report(days)}
+    except Exception as e:
+        return {"error": str(e)}
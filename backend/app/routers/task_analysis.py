@@ -3,7 +3,7 @@ from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, List
 import json
-import asyncio
+from app.utils.sse import SSE_HEADERS, SSEEmitter
 
 router = APIRouter(prefix="/task-analysis", tags=["task-analysis"])
 
@@ -74,14 +74,18 @@ async def analyze_task(request: TaskAnalysisRequest):
         """
 
         # Call your existing GPT implementation
+        from ..services.llm_scheduler import Priority
+        from ..services.llm_usage import usage_tags
         from ..services.o4_mini_service import OpenAIo4Service
 
         try:
             # Create GPT service instance and call it
             gpt_service = OpenAIo4Service()
-            gpt_response = gpt_service.call_o4_api(
+            gpt_response = await gpt_service.call_o4_api(
                 system_prompt="You are an expert software development task analyzer. You must respond with ONLY a valid JSON object in the exact format requested. Do not include any explanatory text, markdown formatting, or additional content outside the JSON object.",
                 data={"prompt": prompt},
+                priority=Priority.TASK_ANALYSIS,
+                usage={**usage_tags("task_analysis"), "phase": "estimate"},
             )
 
             # Debug: Log the raw response
@@ -259,12 +263,25 @@ async def stream_analyze_task(request: TaskAnalysisRequest):
         }
 
         async def event_generator():
+            sse = SSEEmitter()
             try:
                 # Send initial status
-                yield f"data: {json.dumps({'type': 'status', 'status': 'starting', 'message': 'Starting task analysis...'})}\n\n"
+                yield sse.event(
+                    {
+                        "type": "status",
+                        "status": "starting",
+                        "message": "Starting task analysis...",
+                    }
+                )
 
                 # Send analysis step
-                yield f"data: {json.dumps({'type': 'status', 'status': 'analyzing', 'message': 'Analyzing task complexity and requirements...'})}\n\n"
+                yield sse.event(
+                    {
+                        "type": "status",
+                        "status": "analyzing",
+                        "message": "Analyzing task complexity and requirements...",
+                    }
+                )
 
                 # Create the prompt for GPT analysis
                 prompt = f"""
@@ -301,20 +318,36 @@ async def stream_analyze_task(request: TaskAnalysisRequest):
                 """
 
                 # Send GPT processing step
-                yield f"data: {json.dumps({'type': 'status', 'status': 'gpt_processing', 'message': 'Processing with AI model...'})}\n\n"
+                yield sse.event(
+                    {
+                        "type": "status",
+                        "status": "gpt_processing",
+                        "message": "Processing with AI model...",
+                    }
+                )
 
                 # Call GPT service
+                from ..services.llm_scheduler import Priority
+                from ..services.llm_usage import usage_tags
                 from ..services.o4_mini_service import OpenAIo4Service
 
                 try:
                     gpt_service = OpenAIo4Service()
-                    gpt_response = gpt_service.call_o4_api(
+                    gpt_response = await gpt_service.call_o4_api(
                         system_prompt="You are an expert software development task analyzer. You must respond with ONLY a valid JSON object in the exact format requested. Do not include any explanatory text, markdown formatting, or additional content outside the JSON object.",
                         data={"prompt": prompt},
+                        priority=Priority.TASK_ANALYSIS,
+                        usage={**usage_tags("task_analysis"), "phase": "estimate"},
                     )
 
                     # Send processing complete
-                    yield f"data: {json.dumps({'type': 'status', 'status': 'processing_complete', 'message': 'AI analysis complete, validating results...'})}\n\n"
+                    yield sse.event(
+                        {
+                            "type": "status",
+                            "status": "processing_complete",
+                            "message": "AI analysis complete, validating results...",
+                        }
+                    )
 
                     # Clean the response - remove any markdown formatting or extra text
                     cleaned_response = gpt_response.strip()
@@ -364,54 +397,77 @@ async def stream_analyze_task(request: TaskAnalysisRequest):
                         confidence = 0.7
 
                     # Send final results
-                    yield f"data: {json.dumps({'type': 'complete', 'result': {
-                        'estimated_hours': estimated_hours,
-                        'complexity': complexity,
-                        'task_type': task_type,
-                        'confidence': confidence,
-                        'reasoning': reasoning,
-                    }})}\n\n"
+                    yield sse.event(
+                        {
+                            "type": "complete",
+                            "result": {
+                                "estimated_hours": estimated_hours,
+                                "complexity": complexity,
+                                "task_type": task_type,
+                                "confidence": confidence,
+                                "reasoning": reasoning,
+                            },
+                        }
+                    )
 
                 except json.JSONDecodeError as e:
                     # Fallback to heuristics
                     print(f"DEBUG: JSON decode error in streaming: {e}")
                     print(f"DEBUG: Failed to parse response: {gpt_response}")
                     print(f"DEBUG: Cleaned response that failed: {cleaned_response}")
-                    yield f"data: {json.dumps({'type': 'status', 'status': 'fallback', 'message': 'Using fallback analysis...'})}\n\n"
+                    yield sse.event(
+                        {
+                            "type": "status",
+                            "status": "fallback",
+                            "message": "Using fallback analysis...",
+                        }
+                    )
 
                     fallback_result = await _fallback_analysis(task_data)
-                    yield f"data: {json.dumps({'type': 'complete', 'result': {
-                        'estimated_hours': fallback_result.estimated_hours,
-                        'complexity': fallback_result.complexity,
-                        'task_type': fallback_result.task_type,
-                        'confidence': fallback_result.confidence,
-                        'reasoning': fallback_result.reasoning,
-                    }})}\n\n"
+                    yield sse.event(
+                        {
+                            "type": "complete",
+                            "result": {
+                                "estimated_hours": fallback_result.estimated_hours,
+                                "complexity": fallback_result.complexity,
+                                "task_type": fallback_result.task_type,
+                                "confidence": fallback_result.confidence,
+                                "reasoning": fallback_result.reasoning,
+                            },
+                        }
+                    )
 
                 except Exception as e:
                     # Fallback to heuristics
-                    yield f"data: {json.dumps({'type': 'status', 'status': 'fallback', 'message': f'AI analysis failed, using fallback: {str(e)}'})}\n\n"
+                    yield sse.event(
+                        {
+                            "type": "status",
+                            "status": "fallback",
+                            "message": f"AI analysis failed, using fallback: {str(e)}",
+                        }
+                    )
 
                     fallback_result = await _fallback_analysis(task_data)
-                    yield f"data: {json.dumps({'type': 'complete', 'result': {
-                        'estimated_hours': fallback_result.estimated_hours,
-                        'complexity': fallback_result.complexity,
-                        'task_type': fallback_result.task_type,
-                        'confidence': fallback_result.confidence,
-                        'reasoning': fallback_result.reasoning,
-                    }})}\n\n"
+                    yield sse.event(
+                        {
+                            "type": "complete",
+                            "result": {
+                                "estimated_hours": fallback_result.estimated_hours,
+                                "complexity": fallback_result.complexity,
+                                "task_type": fallback_result.task_type,
+                                "confidence": fallback_result.confidence,
+                                "reasoning": fallback_result.reasoning,
+                            },
+                        }
+                    )
 
             except Exception as e:
-                yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+                yield sse.event({"type": "error", "message": str(e)})
 
         return StreamingResponse(
             event_generator(),
             media_type="text/event-stream",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-                "X-Accel-Buffering": "no",
-            },
+            headers=SSE_HEADERS,
         )
 
     except Exception as e:
@@ -3,12 +3,13 @@ from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
 import json
-import asyncio
 from datetime import datetime, timedelta
 from decimal import Decimal
 from app.db.db import get_pool
+from app.services.llm_scheduler import Priority
+from app.services.llm_usage import usage_tags
 from app.services.o4_mini_service import OpenAIo4Service
-
+from app.utils.sse import SSEEmitter
 
 router = APIRouter(prefix="/user-insights", tags=["user-insights"])
 
@@ -67,9 +68,11 @@ async def analyze_user_performance(request: UserInsightsRequest):
         from ..services.o4_mini_service import OpenAIo4Service
 
         gpt_service = OpenAIo4Service()
-        ai_response = gpt_service.call_o4_api(
+        ai_response = await gpt_service.call_o4_api(
             system_prompt="You are a professional performance analyst providing balanced, realistic feedback on software developer performance. Be honest and constructive in your assessment, highlighting both strengths and areas for improvement. Provide actionable insights that help the developer grow while acknowledging their contributions.",
             data={"prompt": prompt},
+            priority=Priority.INSIGHTS,
+            usage={**usage_tags("insights", request.userId), "phase": "analysis"},
         )
 
         # Parse the AI response
@@ -178,19 +181,22 @@ async def stream_analyze_user_performance(request: UserInsightsRequest):
     """
 
     async def event_generator():
+        sse = SSEEmitter()
         try:
             # Send initial status
-            yield f"data: {json.dumps({'type': 'status', 'message': 'Starting analysis...'})}\n\n"
-            await asyncio.sleep(0.1)
+            yield sse.event({"type": "status", "message": "Starting analysis..."})
 
             # Gather comprehensive user data
-            yield f"data: {json.dumps({'type': 'status', 'message': 'Gathering user data...'})}\n\n"
-            await asyncio.sleep(0.1)
+            yield sse.event({"type": "status", "message": "Gathering user data..."})
 
             user_data = await _gather_user_data(request.userId, request.enterpriseId)
 
-            yield f"data: {json.dumps({'type': 'status', 'message': 'Data collected, analyzing performance...'})}\n\n"
-            await asyncio.sleep(0.1)
+            yield sse.event(
+                {
+                    "type": "status",
+                    "message": "Data collected, analyzing performance...",
+                }
+            )
 
             # Get the user's current performance grade
             current_grade = await _get_user_current_grade(
@@ -200,8 +206,7 @@ async def stream_analyze_user_performance(request: UserInsightsRequest):
             # Create a comprehensive prompt for balanced AI analysis
             prompt = _create_analysis_prompt(user_data, current_grade)
 
-            yield f"data: {json.dumps({'type': 'status', 'message': 'Generating AI insights...'})}\n\n"
-            await asyncio.sleep(0.1)
+            yield sse.event({"type": "status", "message": "Generating AI insights..."})
 
             # Call AI service for analysis
             from ..services.o4_mini_service import OpenAIo4Service
@@ -210,17 +215,17 @@ async def stream_analyze_user_performance(request: UserInsightsRequest):
             ai_response = gpt_service.call_o4_api_stream(
                 system_prompt="You are a professional performance analyst providing balanced, realistic feedback on software developer performance. Be honest and constructive in your assessment, highlighting both strengths and areas for improvement. Provide actionable insights that help the developer grow while acknowledging their contributions.",
                 data={"prompt": prompt},
+                priority=Priority.INSIGHTS,
+                usage={**usage_tags("insights", request.userId), "phase": "analysis"},
             )
 
-            yield f"data: {json.dumps({'type': 'status', 'message': 'Processing AI response...'})}\n\n"
-            await asyncio.sleep(0.1)
+            yield sse.event({"type": "status", "message": "Processing AI response..."})
 
             # Handle streaming AI response
-            full_response = ""
-            async for chunk in ai_response:
-                if chunk:
-                    full_response += chunk
-                    yield f"data: {json.dumps({'type': 'chunk', 'data': chunk})}\n\n"
+            response_stream = sse.chunks(ai_response, {"type": "chunk"}, key="data")
+            async for frame in response_stream:
+                yield frame
+            full_response = response_stream.text
 
             # Parse the complete response
             analysis_result = json.loads(full_response)
@@ -254,7 +259,7 @@ async def stream_analyze_user_performance(request: UserInsightsRequest):
             )
 
             # Send final result
-            yield f"data: {json.dumps({'type': 'complete', 'data': analysis_result})}\n\n"
+            yield sse.event({"type": "complete", "data": analysis_result})
 
         except Exception as e:
             # Provide fallback analysis for any other errors
@@ -281,7 +286,7 @@ async def stream_analyze_user_performance(request: UserInsightsRequest):
                 },
                 "generatedAt": datetime.utcnow().isoformat(),
             }
-            yield f"data: {json.dumps({'type': 'complete', 'data': fallback_result})}\n\n"
+            yield sse.event({"type": "complete", "data": fallback_result})
 
     return StreamingResponse(
         event_generator(),
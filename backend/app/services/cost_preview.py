@@ -0,0 +1,107 @@
+"""
+Input token counts for the cost endpoints, without downloading repository files.
+
+A preview needs the head commit and the recursive tree at it, which lists every
+blob's size. The tree is cached by commit (`app.services.github_data_cache`), so
+it is only fetched the first time a commit is previewed or generated, and
+generation after a preview reuses it. Files are then counted exactly when their
+content is already stored locally (a RAG snapshot of the same commit, or the
+cached README) and estimated from their size otherwise
+(`app.utils.token_estimate`).
+"""
+
+import asyncio
+from typing import Dict, List, Optional, Tuple
+
+from app.rag.snapshots import find_snapshot, get_snapshot_files
+from app.services.github import GitHubService
+from app.services.github_data_cache import cache_github_data, get_github_data_cached
+from app.utils.repo_tree import RepoTree
+from app.utils.token_estimate import estimate_tokens, observe
+from app.utils.tokenizer import count_tokens_batch_async
+
+github_service = GitHubService()
+
+
+async def fetch_tree(
+    username: str, repo: str, githubAccessToken: str
+) -> Tuple[RepoTree, Optional[str]]:
+    """
+    Fetches a repository's head commit and its tree, from the cache if it holds
+    the commit.
+
+    Args:
+        username (str): The GitHub username or organization name.
+        repo (str): The repository name.
+        githubAccessToken (str): GitHub access token for authentication.
+
+    Returns:
+        Tuple[RepoTree, Optional[str]]: The tree of the default branch, and its
+        head commit SHA (None if it could not be resolved).
+
+    Raises:
+        ValueError: If the repository tree cannot be fetched.
+    """
+    commit_sha = await asyncio.to_thread(
+        github_service.get_head_commit_sha, username, repo, "HEAD", githubAccessToken
+    )
+    if commit_sha:
+        cached = await get_github_data_cached(username, repo, commit_sha)
+        if cached:
+            return cached["tree"], commit_sha
+
+    tree = await asyncio.to_thread(
+        github_service.get_repository_tree,
+        username,
+        repo,
+        githubAccessToken,
+        commit_sha or "HEAD",
+    )
+    if commit_sha:
+        cache_github_data(username, repo, commit_sha, tree)
+    return tree, commit_sha
+
+
+async def count_file_tokens(
+    username: str,
+    repo: str,
+    commit_sha: Optional[str],
+    files: List[Tuple[str, int]],
+) -> Dict[str, int]:
+    """
+    Counts the tokens of repository files, exactly where a snapshot of the commit
+    holds them and estimated from their size otherwise.
+
+    Args:
+        username (str): The GitHub username or organization name.
+        repo (str): The repository name.
+        commit_sha (str, optional): The commit the files are read at.
+        files (List[Tuple[str, int]]): The (path, size in bytes) of the files.
+
+    Returns:
+        Dict[str, int]: The tokens per path.
+    """
+    tokens = {}
+    snapshot_id = None
+    if commit_sha and files:
+        try:
+            snapshot_id = await find_snapshot(username, repo, commit_sha)
+            if snapshot_id:
+                stored = await get_snapshot_files(
+                    snapshot_id, [path for path, _ in files]
+                )
+                counts = await count_tokens_batch_async(
+                    [file["content"] for file in stored]
+                )
+                for file, count in zip(stored, counts):
+                    tokens[file["path"]] = count
+        except Exception as e:
+            print(f"Could not read snapshot for {username}/{repo}: {e}")
+
+    for path, size in files:
+        if path in tokens:
+            # Exact counts keep the size-based estimates calibrated
+            observe(path, size, tokens[path], source=snapshot_id)
+        else:
+            tokens[path] = estimate_tokens(path, size)
+    return tokens
@@ -1,5 +1,26 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
 
+from app.utils.json_stream import iter_array
+from app.utils.path_filter import rank_by_priority, should_include_file
+from app.utils.repo_tree import RepoTree
+
+# Subtrees of a truncated tree are fetched this many at a time
+TREE_WALK_THREADS = 8
+
+_tree_walk_executor = ThreadPoolExecutor(
+    TREE_WALK_THREADS, thread_name_prefix="tree-walk"
+)
+
+# (username, repo, ref) -> (ETag, commit SHA) of the last resolved refs, so they
+# are revalidated with conditional requests
+HEAD_ETAG_CACHE_SIZE = 4096
+_head_etags = OrderedDict()
+_head_etags_lock = threading.Lock()
+
 
 def _get_headers(githubAccessToken):
     headers = {"Accept": "application/vnd.github+json"}
@@ -8,6 +29,64 @@ def _get_headers(githubAccessToken):
     return headers
 
 
+def format_file_tree(tree):
+    """
+    Formats a repository tree as the file tree sent to the LLM.
+
+    Args:
+        tree (RepoTree): A repository tree, whose paths were filtered as fetched
+
+    Returns:
+        str: The paths, one per line
+    """
+    return tree.to_text()
+
+
+def find_readme(tree):
+    """
+    Finds the README GitHub shows for a repository tree, looking in the same
+    directories as the README API (.github/, the root, then docs/).
+
+    Args:
+        tree (RepoTree): A repository tree
+
+    Returns:
+        TreeEntry: The README's entry, or None if there is none
+    """
+    for directory in (".github", "", "docs"):
+        for entry in tree.entries(directory, recursive=False):
+            name = entry.path.rpartition("/")[2]
+            if entry.type == "blob" and name.lower().split(".")[0] == "readme":
+                return entry
+    return None
+
+
+def select_important_files(tree, max_files):
+    """
+    Selects the files whose contents are sent to the LLM to generate a README.
+    Prioritizes configuration files, source files, and documentation.
+
+    Args:
+        tree (RepoTree): A repository tree
+        max_files (int): Maximum number of files to select
+
+    Returns:
+        List[Tuple[str, int, int]]: The (path, priority, size in bytes) of the
+        selected files, highest priority first
+    """
+    # Skip directories and files larger than 100KB
+    files = [
+        entry for entry in tree if entry.type == "blob" and entry.size <= 100 * 1024
+    ]
+
+    # Highest priority first, in tree order among equal priorities, without
+    # binary files
+    ranked = rank_by_priority([entry.path for entry in files], max_files)
+    return [
+        (files[index].path, priority, files[index].size) for index, priority in ranked
+    ]
+
+
 class GitHubService:
     def __init__(self):
         self.access_token = None
@@ -36,6 +115,47 @@ class GitHubService:
             return response.json().get("default_branch")
         return None
 
+    def get_head_commit_sha(self, username, repo, ref, githubAccessToken):
+        """
+        Resolves a branch, tag or commit-ish to a full commit SHA.
+
+        Uses the `application/vnd.github.sha` media type so GitHub returns the bare
+        SHA instead of the full commit payload. Refs resolved before are revalidated
+        with their ETag: an unchanged ref is answered with 304 Not Modified, which
+        does not count against the rate limit.
+
+        Args:
+            username (str): The GitHub username or organization name
+            repo (str): The repository name
+            ref (str): The branch, tag or commit to resolve
+            githubAccessToken (str): GitHub access token for authentication
+
+        Returns:
+            str: The commit SHA, or None if the ref could not be resolved
+        """
+        api_url = f"https://api.github.com/repos/{username}/{repo}/commits/{ref}"
+        headers = _get_headers(githubAccessToken)
+        headers["Accept"] = "application/vnd.github.sha"
+        key = (username.lower(), repo.lower(), ref)
+        with _head_etags_lock:
+            known = _head_etags.get(key)
+        if known:
+            headers["If-None-Match"] = known[0]
+        response = requests.get(api_url, headers=headers)
+
+        if response.status_code == 304 and known:
+            return known[1]
+        if response.status_code == 200:
+            sha = response.text.strip()
+            if response.headers.get("ETag"):
+                with _head_etags_lock:
+                    _head_etags[key] = (response.headers["ETag"], sha)
+                    _head_etags.move_to_end(key)
+                    while len(_head_etags) > HEAD_ETAG_CACHE_SIZE:
+                        _head_etags.popitem(last=False)
+            return sha
+        return None
+
     def get_github_file_paths_as_list(self, username, repo, githubAccessToken):
         """
         Fetches the file tree of an open-source GitHub repository,
@@ -48,84 +168,176 @@ class GitHubService:
         Returns:
             str: A filtered and formatted string of file paths in the repository, one per line.
         """
+        return format_file_tree(
+            self.get_file_tree(username, repo, githubAccessToken)
+        )
 
-        def should_include_file(path):
-            # Patterns to exclude
-            excluded_patterns = [
-                # Dependencies
-                "node_modules/",
-                "vendor/",
-                "venv/",
-                # Compiled files
-                ".min.",
-                ".pyc",
-                ".pyo",
-                ".pyd",
-                ".so",
-                ".dll",
-                ".class",
-                # Asset files
-                ".jpg",
-                ".jpeg",
-                ".png",
-                ".gif",
-                ".ico",
-                ".svg",
-                ".ttf",
-                ".woff",
-                ".webp",
-                # Cache and temporary files
-                "__pycache__/",
-                ".cache/",
-                ".tmp/",
-                # Lock files and logs
-                "yarn.lock",
-                "poetry.lock",
-                "*.log",
-                # Configuration files
-                ".vscode/",
-                ".idea/",
-            ]
-
-            return not any(pattern in path.lower() for pattern in excluded_patterns)
+    def get_file_tree(self, username, repo, githubAccessToken):
+        """
+        Fetches the file tree of an open-source GitHub repository, excluding static
+        files and generated code, as a `RepoTree`.
+
+        Args:
+            username (str): The GitHub username or organization name
+            repo (str): The repository name
+
+        Returns:
+            RepoTree: The included paths of the default branch
+        """
 
         # Try to get the default branch first
         branch = self.get_default_branch(username, repo, githubAccessToken)
         if branch:
-            api_url = f"https://api.github.com/repos/{username}/{repo}/git/trees/{branch}?recursive=1"
-            response = requests.get(api_url, headers=_get_headers(githubAccessToken))
-
-            if response.status_code == 200:
-                data = response.json()
-                if "tree" in data:
-                    # Filter the paths and join them with newlines
-                    paths = [
-                        item["path"]
-                        for item in data["tree"]
-                        if should_include_file(item["path"])
-                    ]
-                    return "\n".join(paths)
+            try:
+                return self._fetch_tree(username, repo, branch, githubAccessToken)
+            except Exception:
+                pass
 
         # If default branch didn't work or wasn't found, try common branch names
         for branch in ["main", "master"]:
-            api_url = f"https://api.github.com/repos/{username}/{repo}/git/trees/{branch}?recursive=1"
-            response = requests.get(api_url, headers=_get_headers(githubAccessToken))
-
-            if response.status_code == 200:
-                data = response.json()
-                if "tree" in data:
-                    # Filter the paths and join them with newlines
-                    paths = [
-                        item["path"]
-                        for item in data["tree"]
-                        if should_include_file(item["path"])
-                    ]
-                    return "\n".join(paths)
+            try:
+                return self._fetch_tree(username, repo, branch, githubAccessToken)
+            except Exception:
+                continue
 
         raise ValueError(
             "Could not fetch repository file tree. Repository might not exist, be empty or private."
         )
 
+    def _read_tree(
+        self, username, repo, ref, githubAccessToken, tree, recursive=True, prefix=""
+    ):
+        """
+        Streams one git trees API response into a `RepoTree`, keeping the included
+        paths.
+
+        The response is decoded as it arrives and each path that passes the path
+        filter is added to `tree`, so memory does not grow with the size of the
+        response. Directories are filtered with a trailing slash, which leaves
+        out excluded directories (e.g. node_modules/) themselves, not only their
+        contents.
+
+        Args:
+            username (str): The GitHub username or organization name
+            repo (str): The repository name
+            ref (str): The branch, tag, commit or tree SHA to read
+            githubAccessToken (str): GitHub access token for authentication
+            tree (RepoTree): The tree the paths are added to
+            recursive (bool): Whether to list the whole tree or only its top level
+            prefix (str): The tree's path in the repository, with a trailing slash,
+                prepended to the paths of its entries
+
+        Returns:
+            bool: Whether GitHub truncated the listing
+
+        Raises:
+            Exception: If the tree cannot be fetched
+        """
+        api_url = f"https://api.github.com/repos/{username}/{repo}/git/trees/{ref}"
+        if recursive:
+            api_url += "?recursive=1"
+        with requests.get(
+            api_url, headers=_get_headers(githubAccessToken), stream=True
+        ) as response:
+            if response.status_code != 200:
+                error_detail = "Unknown error"
+                try:
+                    error_detail = response.json()
+                except:
+                    error_detail = response.text
+                raise Exception(
+                    f"Failed to fetch repository tree: {response.status_code}, {error_detail}"
+                )
+
+            rest = {}
+            for item in iter_array(response.iter_content(64 * 1024), "tree", rest):
+                path = prefix + item["path"]
+                kind = item["type"]
+                if should_include_file(path + "/" if kind == "tree" else path):
+                    tree.add(path, kind, item.get("size", 0), item["sha"])
+        return bool(rest.get("truncated"))
+
+    def _fetch_tree(self, username, repo, ref, githubAccessToken):
+        """
+        Fetches the included paths of a repository tree.
+
+        GitHub truncates recursive listings of very large trees (over 100,000
+        entries or 7 MB). A truncated tree is walked instead: each directory still
+        truncated is listed on its own level, and its subdirectories are listed
+        recursively, `TREE_WALK_THREADS` at a time. Excluded directories are not
+        walked.
+
+        Args:
+            username (str): The GitHub username or organization name
+            repo (str): The repository name
+            ref (str): The branch, tag or commit to read
+            githubAccessToken (str): GitHub access token for authentication
+
+        Returns:
+            RepoTree: The included paths
+
+        Raises:
+            Exception: If the tree cannot be fetched
+        """
+        tree = RepoTree()
+        if not self._read_tree(username, repo, ref, githubAccessToken, tree):
+            return tree
+
+        def read(directory, sha, recursive):
+            subtree = RepoTree()
+            truncated = self._read_tree(
+                username, repo, sha, githubAccessToken, subtree, recursive, directory
+            )
+            return subtree, truncated
+
+        # Each directory keeps its children in the order they are added, which is
+        # git's order whatever the order the directories are read in
+        tree = RepoTree()
+        pending = [("", ref)]
+        while pending:
+            subtrees = []
+            for top, _ in _tree_walk_executor.map(
+                lambda item: read(*item, False), pending
+            ):
+                tree.extend(top)
+                subtrees.extend(
+                    (entry.path + "/", entry.sha) for entry in top if entry.type == "tree"
+                )
+            pending = []
+            for (directory, sha), (subtree, truncated) in zip(
+                subtrees,
+                _tree_walk_executor.map(lambda item: read(*item, True), subtrees),
+            ):
+                if truncated:
+                    pending.append((directory, sha))
+                else:
+                    tree.extend(subtree)
+        return tree
+
+    def get_repository_tree(self, username, repo, githubAccessToken, ref="HEAD"):
+        """
+        Fetches the recursive tree of a repository, with the size of every blob.
+        Defaults to the tree of the default branch.
+
+        Args:
+            username (str): The GitHub username or organization name
+            repo (str): The repository name
+            githubAccessToken (str): GitHub access token for authentication
+            ref (str): The branch, tag or commit to read
+
+        Returns:
+            RepoTree: The paths the file tree includes
+
+        Raises:
+            ValueError: If the repository does not exist, is empty or is private
+        """
+        try:
+            return self._fetch_tree(username, repo, ref, githubAccessToken)
+        except Exception as e:
+            raise ValueError(
+                "Could not fetch repository file tree. Repository might not exist, be empty or private."
+            ) from e
+
     def get_github_readme(self, username, repo, githubAccessToken):
         """
         Fetches the README contents of an open-source GitHub repository.
@@ -159,7 +371,9 @@ class GitHubService:
         readme_content = requests.get(data["download_url"]).text
         return readme_content
 
-    def get_file_contents(self, username, repo, file_path, githubAccessToken):
+    def get_file_contents(
+        self, username, repo, file_path, githubAccessToken, ref=None
+    ):
         """
         Fetches the contents of a specific file from a GitHub repository.
 
@@ -168,6 +382,8 @@ class GitHubService:
             repo (str): The repository name
             file_path (str): The path to the file in the repository
             githubAccessToken (str): GitHub access token for authentication
+            ref (str): Optional branch or commit to read from (defaults to the
+                default branch)
 
         Returns:
             str: The contents of the file
@@ -176,13 +392,16 @@ class GitHubService:
             ValueError: If file does not exist or is too large
             Exception: For other unexpected API errors
         """
-        # First check if the repository exists
-        self._check_repository_exists(username, repo, githubAccessToken)
+        if ref:
+            branch = ref
+        else:
+            # First check if the repository exists
+            self._check_repository_exists(username, repo, githubAccessToken)
 
-        # Get the default branch
-        branch = self.get_default_branch(username, repo, githubAccessToken)
-        if not branch:
-            branch = "main"  # fallback
+            # Get the default branch
+            branch = self.get_default_branch(username, repo, githubAccessToken)
+            if not branch:
+                branch = "main"  # fallback
 
         # Fetch file contents
         api_url = f"https://api.github.com/repos/{username}/{repo}/contents/{file_path}?ref={branch}"
@@ -208,7 +427,7 @@ class GitHubService:
         return content
 
     def get_repository_files_with_contents(
-        self, username, repo, githubAccessToken, max_files=50
+        self, username, repo, githubAccessToken, max_files=50, ref=None
     ):
         """
         Fetches a list of important files from the repository with their contents.
@@ -219,6 +438,8 @@ class GitHubService:
             repo (str): The repository name
             githubAccessToken (str): GitHub access token for authentication
             max_files (int): Maximum number of files to fetch
+            ref (str): Optional branch or commit to read from (defaults to the
+                default branch)
 
         Returns:
             List[Dict]: List of dictionaries with 'path' and 'content' keys
@@ -227,144 +448,31 @@ class GitHubService:
         self._check_repository_exists(username, repo, githubAccessToken)
 
         # Get the default branch
-        branch = self.get_default_branch(username, repo, githubAccessToken)
+        branch = ref or self.get_default_branch(username, repo, githubAccessToken)
         if not branch:
             branch = "main"  # fallback
 
         # Get the file tree
-        api_url = f"https://api.github.com/repos/{username}/{repo}/git/trees/{branch}?recursive=1"
-        response = requests.get(api_url, headers=_get_headers(githubAccessToken))
-
-        if response.status_code != 200:
-            error_detail = "Unknown error"
-            try:
-                error_detail = response.json()
-            except:
-                error_detail = response.text
-            raise Exception(
-                f"Failed to fetch repository tree: {response.status_code}, {error_detail}"
-            )
-
-        data = response.json()
-        if "tree" not in data:
+        tree = self._fetch_tree(username, repo, branch, githubAccessToken)
+        if not tree:
             raise ValueError("Repository tree is empty")
 
-        print(f"Repository tree contains {len(data['tree'])} items")
-        print(
-            f"Files found: {[item['path'] for item in data['tree'] if item['type'] == 'blob']}"
-        )
+        print(f"Repository tree contains {len(tree)} items")
+        print(f"Files found: {[entry.path for entry in tree if entry.type == 'blob']}")
 
-        # Define priority patterns for file selection
-        priority_patterns = [
-            # Configuration files
-            "package.json",
-            "pyproject.toml",
-            "requirements.txt",
-            "Cargo.toml",
-            "go.mod",
-            "composer.json",
-            "Gemfile",
-            "pom.xml",
-            "build.gradle",
-            "Makefile",
-            # Documentation
-            "README",
-            "CHANGELOG",
-            "LICENSE",
-            "CONTRIBUTING",
-            "docs/",
-            # Source code (limit to main directories)
-            "src/",
-            "app/",
-            "lib/",
-            "main.",
-            "index.",
-            "app.py",
-            "main.py",
-            # Shell scripts and executables
-            ".sh",
-            ".bash",
-            ".zsh",
-            ".fish",
-            # Configuration
-            ".env.example",
-            "config/",
-            "settings/",
-            # Common source files
-            ".js",
-            ".ts",
-            ".jsx",
-            ".tsx",
-            ".py",
-            ".java",
-            ".cpp",
-            ".c",
-            ".h",
-            ".go",
-            ".rs",
-            ".php",
-            ".rb",
-            ".swift",
-            ".kt",
-            ".scala",
-        ]
-
-        def get_priority_score(path):
-            """Calculate priority score for file selection"""
-            path_lower = path.lower()
-            for i, pattern in enumerate(priority_patterns):
-                if pattern.lower() in path_lower:
-                    return len(priority_patterns) - i  # Higher index = higher priority
-            return 0
-
-        # Filter and sort files by priority
-        files = []
-        for item in data["tree"]:
-            if item["type"] == "blob":  # Only files, not directories
-                path = item["path"]
-                # Skip binary files and large files
-                if any(
-                    ext in path.lower()
-                    for ext in [
-                        ".jpg",
-                        ".jpeg",
-                        ".png",
-                        ".gif",
-                        ".ico",
-                        ".svg",
-                        ".ttf",
-                        ".woff",
-                        ".webp",
-                        ".min.",
-                        ".pyc",
-                        ".so",
-                        ".dll",
-                        ".class",
-                    ]
-                ):
-                    continue
-                if item.get("size", 0) > 100 * 1024:  # Skip files larger than 100KB
-                    continue
-
-                priority = get_priority_score(path)
-                # Include all files, but prioritize based on patterns
-                files.append((path, priority))
-
-        # Sort by priority and take top files
-        files.sort(key=lambda x: x[1], reverse=True)
-        selected_files = files[:max_files]
+        selected_files = select_important_files(tree, max_files)
 
         print(f"Selected {len(selected_files)} files for fetching:")
-        for path, priority in selected_files:
+        for path, priority, _ in selected_files:
             print(f"  - {path} (priority: {priority})")
 
         # Fetch contents for selected files
         result = []
         print(f"Attempting to fetch {len(selected_files)} files from {username}/{repo}")
-        for path, priority in selected_files:
+        for path, priority, _ in selected_files:
             try:
                 content = self.get_file_contents(
-                    username, repo, path, githubAccessToken
+                    username, repo, path, githubAccessToken, ref=branch
                 )
                 result.append({"path": path, "content": content})
                 print(f"Successfully fetched {path} (priority: {priority})")
@@ -0,0 +1,155 @@
+"""
+Cache of the repository data generation starts from, keyed by commit.
+
+The default branch, file tree and README that `get_github_data` gathers, and the
+tree the cost previews count, only change when the repository does. They are
+cached by (owner, repo, head commit SHA) in two tiers:
+- an in-process LRU of the `GITHUB_DATA_CACHE_SIZE` most recently used entries,
+- the `github_data_cache` table, shared by every worker process.
+
+Entries are filled in as the data is computed: a cost preview stores the tree, and
+generation adds the default branch and README. Looking an entry up needs the head
+commit, which `GitHubService.get_head_commit_sha` revalidates with a conditional
+request, so a repository that has not changed costs one 304 response.
+"""
+
+import asyncio
+import os
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from app.db.db import get_pool
+from app.utils.repo_tree import RepoTree
+
+GITHUB_DATA_CACHE_SIZE = int(os.getenv("GITHUB_DATA_CACHE_SIZE", "32"))
+
+# (owner, repo, commit SHA) -> {"default_branch", "file_tree", "tree", "readme"}
+_entries: "OrderedDict[Tuple[str, str, str], Dict]" = OrderedDict()
+# Strong references to pending writes
+_pending_writes = set()
+
+
+def _key(username: str, repo: str, commit_sha: str) -> Tuple[str, str, str]:
+    # GitHub owner and repository names are case-insensitive
+    return (username.lower(), repo.lower(), commit_sha)
+
+
+def _remember(key: Tuple[str, str, str], entry: Dict):
+    _entries[key] = entry
+    _entries.move_to_end(key)
+    while len(_entries) > GITHUB_DATA_CACHE_SIZE:
+        _entries.popitem(last=False)
+
+
+async def get_github_data_cached(
+    username: str, repo: str, commit_sha: str
+) -> Optional[Dict]:
+    """
+    Looks up the cached data of a repository at a commit.
+
+    Args:
+        username (str): The GitHub username or organization name.
+        repo (str): The repository name.
+        commit_sha (str): The commit.
+
+    Returns:
+        Dict: "default_branch" and "readme" (None until generation has stored
+        them), "tree" (a `RepoTree`) and "file_tree" (its text), or None if the
+        commit is not cached.
+    """
+    key = _key(username, repo, commit_sha)
+    entry = _entries.get(key)
+    if entry is not None:
+        _entries.move_to_end(key)
+        return dict(entry)
+
+    try:
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            row = await conn.fetchrow(
+                """
+                SELECT default_branch, tree, readme FROM github_data_cache
+                WHERE owner = $1 AND repo = $2 AND commit_sha = $3
+                """,
+                *key,
+            )
+    except Exception as e:
+        print(f"Could not read cached data for {username}/{repo}: {e}")
+        return None
+    if row is None:
+        return None
+
+    tree = await asyncio.to_thread(RepoTree.from_bytes, row["tree"])
+    entry = {
+        "default_branch": row["default_branch"],
+        "file_tree": await asyncio.to_thread(tree.to_text),
+        "tree": tree,
+        "readme": row["readme"],
+    }
+    _remember(key, entry)
+    return dict(entry)
+
+
+async def _write(key: Tuple[str, str, str], entry: Dict):
+    try:
+        tree = await asyncio.to_thread(entry["tree"].to_bytes)
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            await conn.execute(
+                """
+                INSERT INTO github_data_cache
+                    (owner, repo, commit_sha, default_branch, tree, readme)
+                VALUES ($1, $2, $3, $4, $5, $6)
+                ON CONFLICT (owner, repo, commit_sha) DO UPDATE SET
+                    default_branch = COALESCE(
+                        EXCLUDED.default_branch, github_data_cache.default_branch
+                    ),
+                    readme = COALESCE(EXCLUDED.readme, github_data_cache.readme),
+                    updated_at = CURRENT_TIMESTAMP
+                """,
+                *key,
+                entry["default_branch"],
+                tree,
+                entry["readme"],
+            )
+    except Exception as e:
+        print(f"Failed to cache data for {key[0]}/{key[1]}: {e}")
+
+
+def cache_github_data(
+    username: str,
+    repo: str,
+    commit_sha: str,
+    tree: RepoTree,
+    default_branch: Optional[str] = None,
+    readme: Optional[str] = None,
+    file_tree: Optional[str] = None,
+):
+    """
+    Caches the data of a repository at a commit, keeping what is already cached
+    for the fields left out. The in-process tier is updated right away and the
+    table in the background.
+
+    Args:
+        username (str): The GitHub username or organization name.
+        repo (str): The repository name.
+        commit_sha (str): The commit.
+        tree (RepoTree): The repository tree at the commit.
+        default_branch (str, optional): The default branch.
+        readme (str, optional): The README the pipeline uses.
+        file_tree (str, optional): The tree's text, if already formatted.
+    """
+    key = _key(username, repo, commit_sha)
+    cached = _entries.get(key) or {}
+    entry = {
+        "default_branch": default_branch or cached.get("default_branch"),
+        "file_tree": file_tree
+        or (cached["file_tree"] if cached.get("tree") is tree else tree.to_text()),
+        "tree": tree,
+        "readme": readme if readme is not None else cached.get("readme"),
+    }
+    _remember(key, entry)
+
+    task = asyncio.create_task(_write(key, entry))
+    _pending_writes.add(task)
+    task.add_done_callback(_pending_writes.discard)
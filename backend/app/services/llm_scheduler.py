@@ -0,0 +1,201 @@
+"""
+Scheduler for upstream LLM calls shared by every OpenAIo4Service instance.
+
+All calls to OpenAI go through one process-wide `LLMScheduler`, which admits them
+within three budgets:
+- `OPENAI_RPM_LIMIT` requests and `OPENAI_TPM_LIMIT` tokens per sliding minute.
+  Tokens are estimated before the call as the prompt tokens plus
+  `OPENAI_EXPECTED_OUTPUT_TOKENS`.
+- `OPENAI_MAX_CONCURRENCY` calls in flight, of which `OPENAI_INTERACTIVE_RESERVE`
+  are kept free for interactive chat so that long batch calls cannot fill them.
+
+Calls that do not fit wait in a priority queue: interactive chat first, then
+diagrams, READMEs, task analysis and performance insights, first come first served
+within a class. Queue depth, in-flight calls and wait times are reported by
+`LLMScheduler.stats` and the `llm_queue_*` metrics.
+
+The budgets are per worker process; divide the account limits by the number of
+workers when running several.
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from enum import IntEnum
+from typing import AsyncIterator, Dict
+
+from app.utils.metrics import increment
+
+RPM_LIMIT = int(os.getenv("OPENAI_RPM_LIMIT", "500"))
+TPM_LIMIT = int(os.getenv("OPENAI_TPM_LIMIT", "200000"))
+MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "16"))
+INTERACTIVE_RESERVE = int(os.getenv("OPENAI_INTERACTIVE_RESERVE", "2"))
+EXPECTED_OUTPUT_TOKENS = int(os.getenv("OPENAI_EXPECTED_OUTPUT_TOKENS", "4000"))
+
+WINDOW_SECONDS = 60
+
+
+class Priority(IntEnum):
+    """Priority classes of LLM calls; lower values are served first."""
+
+    CHAT = 0
+    DIAGRAM = 1
+    README = 2
+    TASK_ANALYSIS = 3
+    INSIGHTS = 4
+
+
+class LLMScheduler:
+    """
+    Admits LLM calls by priority within rate, token and concurrency budgets.
+
+    Args:
+        rpm_limit (int): Requests allowed per sliding minute.
+        tpm_limit (int): Estimated tokens allowed per sliding minute.
+        max_concurrency (int): Calls allowed in flight.
+        interactive_reserve (int): In-flight slots only `Priority.CHAT` may use.
+    """
+
+    def __init__(
+        self,
+        rpm_limit: int = RPM_LIMIT,
+        tpm_limit: int = TPM_LIMIT,
+        max_concurrency: int = MAX_CONCURRENCY,
+        interactive_reserve: int = INTERACTIVE_RESERVE,
+    ):
+        self.rpm_limit = rpm_limit
+        self.tpm_limit = tpm_limit
+        self.max_concurrency = max_concurrency
+        self.interactive_reserve = min(interactive_reserve, max_concurrency - 1)
+        self.in_flight = 0
+        # (admitted at, estimated tokens) of calls admitted in the last minute
+        self._window = deque()
+        self._window_tokens = 0
+        # (priority, sequence, future, estimated tokens) of waiting calls
+        self._queue = []
+        self._sequence = itertools.count()
+        self._timer = None
+
+    def _expire_window(self, now: float):
+        while self._window and now - self._window[0][0] >= WINDOW_SECONDS:
+            self._window_tokens -= self._window.popleft()[1]
+
+    def _fits(self, priority: Priority, tokens: int) -> bool:
+        limit = self.max_concurrency
+        if priority != Priority.CHAT:
+            limit -= self.interactive_reserve
+        if self.in_flight >= limit:
+            return False
+        if len(self._window) >= self.rpm_limit:
+            return False
+        # A call larger than the whole budget is admitted into an empty window
+        return not self._window or self._window_tokens + tokens <= self.tpm_limit
+
+    def _admit(self, tokens: int, now: float):
+        self.in_flight += 1
+        self._window.append((now, tokens))
+        self._window_tokens += tokens
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
+
+    def _dispatch(self):
+        """Admits queued calls in priority order while the budgets allow."""
+        now = time.monotonic()
+        self._expire_window(now)
+        while self._queue:
+            priority, _, future, tokens = self._queue[0]
+            if future.done():
+                # Cancelled while waiting
+                heapq.heappop(self._queue)
+                continue
+            if not self._fits(priority, tokens):
+                break
+            heapq.heappop(self._queue)
+            self._admit(tokens, now)
+            future.set_result(None)
+
+        # Calls blocked by the rate window are retried when its oldest entry
+        # expires; calls blocked by concurrency are retried on release
+        if self._queue and self._window and self._timer is None:
+            delay = self._window[0][0] + WINDOW_SECONDS - now
+            self._timer = asyncio.get_running_loop().call_later(
+                max(delay, 0), self._on_timer
+            )
+
+    def _release(self):
+        self.in_flight -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, priority: Priority, tokens: int) -> AsyncIterator[None]:
+        """
+        Waits until a call may be sent, and holds its in-flight slot.
+
+        Args:
+            priority (Priority): The call's priority class.
+            tokens (int): Estimated prompt and completion tokens of the call.
+        """
+        priority = Priority(priority)
+        queued_at = time.monotonic()
+        self._expire_window(queued_at)
+        if not self._queue and self._fits(priority, tokens):
+            self._admit(tokens, queued_at)
+        else:
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(
+                self._queue, (priority, next(self._sequence), future, tokens)
+            )
+            self._dispatch()
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # Admitted just as the waiter was cancelled
+                    self._release()
+                else:
+                    future.cancel()
+                raise
+
+        waited = time.monotonic() - queued_at
+        increment("llm_queue_requests", priority=priority.name.lower())
+        increment("llm_queue_wait_seconds", waited, priority=priority.name.lower())
+        try:
+            yield
+        finally:
+            self._release()
+
+    def stats(self) -> Dict:
+        """
+        Reports the scheduler's current load.
+
+        Returns:
+            Dict: 'queued' (waiting calls per priority class), 'in_flight',
+            'window_requests' and 'window_tokens' (admitted in the last minute),
+            and the configured limits.
+        """
+        self._expire_window(time.monotonic())
+        queued = {priority.name.lower(): 0 for priority in Priority}
+        for priority, _, future, _ in self._queue:
+            if not future.done():
+                queued[Priority(priority).name.lower()] += 1
+        return {
+            "queued": queued,
+            "in_flight": self.in_flight,
+            "window_requests": len(self._window),
+            "window_tokens": self._window_tokens,
+            "limits": {
+                "rpm": self.rpm_limit,
+                "tpm": self.tpm_limit,
+                "max_concurrency": self.max_concurrency,
+                "interactive_reserve": self.interactive_reserve,
+            },
+        }
+
+
+scheduler = LLMScheduler()
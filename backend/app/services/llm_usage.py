@@ -0,0 +1,334 @@
+"""
+Token usage accounting for upstream LLM calls.
+
+OpenAIo4Service reports the usage returned by the API for every call (prompt,
+completion, reasoning and cached prompt tokens) through `record_usage`. Usage is
+attributed with tags passed by the caller, built once per request with
+`usage_tags` and extended with the pipeline phase:
+- route: the feature making the call ("generate", "readme", "chat", ...)
+- phase: the step within the route ("explanation", "validation", ...)
+- user: the user or repository owner the work is done for, when known
+- request_id: groups the calls made for one user request
+- input_tokens: the size of the request's input (e.g. file tree plus README), the
+  figure the cost endpoints know before anything runs
+
+Rows are written to the `llm_usage` table in the background and counted in the
+`llm_tokens` metric. `calibrate` turns a route's recent requests into the figures
+the cost endpoints need: billed prompt tokens as a linear function of the input
+size (which captures phases feeding earlier outputs back in), the output tokens a
+request typically produces including reasoning, and the share of the prompt
+served from OpenAI's prompt cache.
+"""
+
+import asyncio
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from app.db.db import get_pool
+from app.utils.metrics import increment
+
+# o4-mini pricing in USD per token
+INPUT_PRICE_PER_TOKEN = 1.1 / 1_000_000
+CACHED_INPUT_PRICE_PER_TOKEN = 0.275 / 1_000_000
+OUTPUT_PRICE_PER_TOKEN = 4.4 / 1_000_000
+
+# Calibration looks at this many recent requests of a route, and falls back to
+# the caller's defaults until it has seen CALIBRATION_MIN_REQUESTS of them.
+CALIBRATION_REQUESTS = 200
+CALIBRATION_MIN_REQUESTS = 20
+CALIBRATION_TTL_SECONDS = 300
+
+# Strong references to pending usage writes
+_pending_writes = set()
+# route -> (computed at, calibration)
+_calibrations: Dict[str, tuple] = {}
+
+
+def usage_tags(
+    route: str, user: Optional[str] = None, input_tokens: Optional[int] = None
+) -> Dict:
+    """
+    Creates the usage tags for one user request.
+
+    Args:
+        route (str): The feature making the calls, e.g. "generate".
+        user (str, optional): The user or repository owner the work is for.
+        input_tokens (int, optional): Size of the request's input, as used by the
+            route's cost estimate.
+
+    Returns:
+        Dict: Tags to pass (with a "phase" added) to the service calls.
+    """
+    tags = {"route": route, "request_id": uuid.uuid4().hex}
+    if user:
+        tags["user"] = user
+    if input_tokens is not None:
+        tags["input_tokens"] = input_tokens
+    return tags
+
+
+def parse_usage(usage) -> Dict[str, int]:
+    """
+    Normalizes the `usage` object of a completion or of a stream's final chunk.
+
+    Args:
+        usage: The usage as a dict (streamed JSON) or an SDK object.
+
+    Returns:
+        Dict[str, int]: 'prompt_tokens', 'completion_tokens', 'reasoning_tokens'
+        and 'cached_tokens'.
+    """
+    if hasattr(usage, "model_dump"):
+        usage = usage.model_dump()
+    usage = usage or {}
+    completion_details = usage.get("completion_tokens_details") or {}
+    prompt_details = usage.get("prompt_tokens_details") or {}
+    return {
+        "prompt_tokens": usage.get("prompt_tokens") or 0,
+        "completion_tokens": usage.get("completion_tokens") or 0,
+        "reasoning_tokens": completion_details.get("reasoning_tokens") or 0,
+        "cached_tokens": prompt_details.get("cached_tokens") or 0,
+    }
+
+
+def record_usage(
+    usage: Dict[str, int],
+    tags: Optional[Dict],
+    model: str,
+    estimated_prompt_tokens: int,
+    streamed: bool,
+    duration: float,
+):
+    """
+    Records the usage of one call: counts it in the metrics right away and
+    writes it to `llm_usage` in the background.
+
+    Args:
+        usage (Dict[str, int]): Usage as returned by `parse_usage`.
+        tags (Dict, optional): Tags from `usage_tags`, plus "phase".
+        model (str): The model called.
+        estimated_prompt_tokens (int): The prompt size estimated by count_tokens.
+        streamed (bool): Whether the call was streamed.
+        duration (float): Seconds the call took.
+    """
+    tags = tags or {}
+    route = tags.get("route", "other")
+    phase = tags.get("phase", "")
+    for kind in ("prompt", "completion", "reasoning", "cached"):
+        increment(
+            "llm_tokens", usage[f"{kind}_tokens"], route=route, phase=phase, kind=kind
+        )
+
+    task = asyncio.create_task(
+        _write_usage(
+            usage,
+            tags,
+            route,
+            phase,
+            model,
+            estimated_prompt_tokens,
+            streamed,
+            duration,
+        )
+    )
+    _pending_writes.add(task)
+    task.add_done_callback(_pending_writes.discard)
+
+
+async def _write_usage(
+    usage, tags, route, phase, model, estimated_prompt_tokens, streamed, duration
+):
+    try:
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            await conn.execute(
+                """
+                INSERT INTO llm_usage (
+                    request_id, route, phase, user_id, model, streamed,
+                    input_tokens, prompt_tokens, completion_tokens,
+                    reasoning_tokens, cached_tokens, estimated_prompt_tokens,
+                    duration_ms
+                )
+                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13)
+                """,
+                tags.get("request_id"),
+                route,
+                phase,
+                tags.get("user"),
+                model,
+                streamed,
+                tags.get("input_tokens"),
+                usage["prompt_tokens"],
+                usage["completion_tokens"],
+                usage["reasoning_tokens"],
+                usage["cached_tokens"],
+                estimated_prompt_tokens,
+                int(duration * 1000),
+            )
+    except Exception as e:
+        print(f"Could not record LLM usage: {e}")
+
+
+async def calibrate(route: str) -> Dict:
+    """
+    Derives cost estimation figures from a route's recent requests.
+
+    Args:
+        route (str): The route to calibrate, e.g. "generate".
+
+    Returns:
+        Dict: 'prompt_slope' and 'prompt_intercept' (billed prompt tokens per
+        request as a linear function of its input tokens), 'output_tokens'
+        (completion tokens, including reasoning, per request), 'cached_fraction'
+        (share of prompt tokens served from cache) and 'requests' (number of
+        requests the figures are based on; 0 while there is too little history).
+    """
+    cached = _calibrations.get(route)
+    if cached and time.monotonic() - cached[0] < CALIBRATION_TTL_SECONDS:
+        return cached[1]
+
+    calibration = {
+        "prompt_slope": None,
+        "prompt_intercept": None,
+        "output_tokens": None,
+        "cached_fraction": 0.0,
+        "requests": 0,
+    }
+    try:
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            row = await conn.fetchrow(
+                """
+                WITH recent AS (
+                    SELECT request_id,
+                           max(input_tokens) AS input_tokens,
+                           sum(prompt_tokens) AS prompt_tokens,
+                           sum(completion_tokens) AS completion_tokens,
+                           sum(cached_tokens) AS cached_tokens,
+                           max(created_at) AS created_at
+                    FROM llm_usage
+                    WHERE route = $1 AND request_id IS NOT NULL
+                      AND input_tokens IS NOT NULL
+                    GROUP BY request_id
+                    ORDER BY created_at DESC
+                    LIMIT $2
+                )
+                SELECT count(*) AS requests,
+                       regr_slope(prompt_tokens, input_tokens) AS prompt_slope,
+                       regr_intercept(prompt_tokens, input_tokens) AS prompt_intercept,
+                       avg(completion_tokens)::float AS output_tokens,
+                       sum(cached_tokens)::float
+                           / NULLIF(sum(prompt_tokens), 0) AS cached_fraction
+                FROM recent
+                """,
+                route,
+                CALIBRATION_REQUESTS,
+            )
+    except Exception as e:
+        print(f"Could not calibrate cost estimate for {route}: {e}")
+        return calibration
+
+    if row["requests"] >= CALIBRATION_MIN_REQUESTS:
+        calibration = {
+            "prompt_slope": row["prompt_slope"],
+            "prompt_intercept": row["prompt_intercept"],
+            "output_tokens": int(row["output_tokens"]),
+            "cached_fraction": row["cached_fraction"] or 0.0,
+            "requests": row["requests"],
+        }
+    _calibrations[route] = (time.monotonic(), calibration)
+    return calibration
+
+
+def estimate_cost(
+    input_tokens: int,
+    default_prompt_tokens: int,
+    default_output_tokens: int,
+    calibration: Dict,
+) -> float:
+    """
+    Estimates the cost of a request in USD, using the route's calibration where
+    it has enough history and the caller's defaults otherwise.
+
+    Args:
+        input_tokens (int): Size of the request's input.
+        default_prompt_tokens (int): Uncalibrated estimate of the prompt tokens
+            over all of the request's calls.
+        default_output_tokens (int): Uncalibrated estimate of the output tokens.
+        calibration (Dict): The route's calibration from `calibrate`.
+
+    Returns:
+        float: The estimated cost.
+    """
+    prompt_tokens = default_prompt_tokens
+    if calibration["prompt_slope"] is not None:
+        prompt_tokens = max(
+            calibration["prompt_slope"] * input_tokens
+            + calibration["prompt_intercept"],
+            input_tokens,
+        )
+    output_tokens = calibration["output_tokens"] or default_output_tokens
+    cached_tokens = prompt_tokens * calibration["cached_fraction"]
+    return (
+        (prompt_tokens - cached_tokens) * INPUT_PRICE_PER_TOKEN
+        + cached_tokens * CACHED_INPUT_PRICE_PER_TOKEN
+        + output_tokens * OUTPUT_PRICE_PER_TOKEN
+    )
+
+
+async def usage_report(days: int) -> List[Dict]:
+    """
+    Summarizes recorded usage per route and phase.
+
+    Args:
+        days (int): How many days back to look.
+
+    Returns:
+        List[Dict]: One dict per route and phase with the number of calls, the
+        token counts, the share of prompt tokens served from cache and the cost
+        in USD, most expensive first.
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(
+            """
+            SELECT route, phase,
+                   count(*) AS calls,
+                   sum(prompt_tokens) AS prompt_tokens,
+                   sum(cached_tokens) AS cached_tokens,
+                   sum(completion_tokens) AS completion_tokens,
+                   sum(reasoning_tokens) AS reasoning_tokens
+            FROM llm_usage
+            WHERE created_at > CURRENT_TIMESTAMP - make_interval(days => $1)
+            GROUP BY route, phase
+            """,
+            days,
+        )
+
+    report = []
+    for row in rows:
+        prompt_tokens = int(row["prompt_tokens"])
+        cached_tokens = int(row["cached_tokens"])
+        completion_tokens = int(row["completion_tokens"])
+        cost = (
+            (prompt_tokens - cached_tokens) * INPUT_PRICE_PER_TOKEN
+            + cached_tokens * CACHED_INPUT_PRICE_PER_TOKEN
+            + completion_tokens * OUTPUT_PRICE_PER_TOKEN
+        )
+        report.append(
+            {
+                "route": row["route"],
+                "phase": row["phase"],
+                "calls": row["calls"],
+                "prompt_tokens": prompt_tokens,
+                "cached_tokens": cached_tokens,
+                "cached_fraction": (
+                    cached_tokens / prompt_tokens if prompt_tokens else 0.0
+                ),
+                "completion_tokens": completion_tokens,
+                "reasoning_tokens": int(row["reasoning_tokens"]),
+                "cost_usd": round(cost, 4),
+            }
+        )
+    return sorted(report, key=lambda entry: entry["cost_usd"], reverse=True)
@@ -1,115 +1,225 @@
 import os
-import tiktoken
+import asyncio
+import itertools
+import random
+import time
 import aiohttp
 import json
-from openai import OpenAI
-from app.utils.format_user_message import format_user_message
-from typing import AsyncGenerator
+from collections import deque
+from openai import APIConnectionError, APIStatusError, AsyncOpenAI
+from app.services.llm_scheduler import EXPECTED_OUTPUT_TOKENS, Priority, scheduler
+from app.services.llm_usage import parse_usage, record_usage
+from app.utils.format_user_message import build_messages
+from app.utils.metrics import increment
+from app.utils.tokenizer import count_tokens, count_tokens_batch_async, get_encoding
+from typing import AsyncGenerator, Dict, List, Mapping, Optional, Tuple
+
+# Transient failures (rate limits, overloaded or failing upstream, dropped
+# connections) are retried with jittered exponential backoff, waiting at least as
+# long as the response's Retry-After header asks.
+MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 30.0
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+# Hedging: when a stream's first token takes longer than the observed p95
+# time-to-first-token, a second identical request is sent and whichever streams
+# first is kept. Off unless OPENAI_HEDGE_STREAMS is set, as it spends requests.
+HEDGE_STREAMS = os.getenv("OPENAI_HEDGE_STREAMS", "").lower() in ("1", "true", "yes")
+HEDGE_QUANTILE = 0.95
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_DELAY_SECONDS = 1.0
+
+# Recent times-to-first-token of streams, shared by all service instances
+_ttft_samples = deque(maxlen=200)
+
+
+class UpstreamError(ValueError):
+    """
+    A failed OpenAI request.
+
+    Args:
+        message (str): The error message.
+        retryable (bool): Whether the failure is transient.
+        status (int, optional): The HTTP status, or None for connection failures.
+        retry_after (float, optional): Seconds the API asked us to wait.
+    """
+
+    def __init__(
+        self,
+        message: str,
+        retryable: bool,
+        status: Optional[int] = None,
+        retry_after: Optional[float] = None,
+    ):
+        super().__init__(message)
+        self.retryable = retryable
+        self.status = status
+        self.retry_after = retry_after
+
+
+def _retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """Reads the wait requested by a response's retry-after(-ms) header."""
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        pass  # HTTP-date values fall back to backoff
+    return None
+
+
+def _backoff_delay(attempt: int, retry_after: Optional[float]) -> float:
+    """Full-jitter exponential backoff, never shorter than `retry_after`."""
+    delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2**attempt)
+    delay = random.uniform(delay / 2, delay)
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def _hedge_delay() -> Optional[float]:
+    """Time to first token after which a stream is hedged, or None to not hedge."""
+    if not HEDGE_STREAMS or len(_ttft_samples) < HEDGE_MIN_SAMPLES:
+        return None
+    samples = sorted(_ttft_samples)
+    p95 = samples[min(int(len(samples) * HEDGE_QUANTILE), len(samples) - 1)]
+    return max(p95, HEDGE_MIN_DELAY_SECONDS)
 
 
 class OpenAIo4Service:
     def __init__(self):
-        self.default_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        # Retries are handled by call_o4_api, consistently with streaming calls
+        self.default_client = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"), max_retries=0
+        )
         self.model = "o4-mini-2025-04-16"
-        self.encoding = tiktoken.get_encoding("o200k_base")
+        self.encoding = get_encoding()
         self.api_key = os.getenv("OPENAI_API_KEY")
         self.base_url = "https://api.openai.com/v1/chat/completions"
         self.reasoning_effort = "low"
 
-    def call_o4_api(
+    async def _estimate_prompt_tokens(self, messages: List[Dict[str, str]]) -> int:
+        """Estimates the prompt tokens of a call."""
+        return sum(
+            await count_tokens_batch_async([message["content"] for message in messages])
+        )
+
+    async def call_o4_api(
         self,
         system_prompt: str,
         data: dict,
+        priority: Priority = Priority.INSIGHTS,
+        usage: Optional[Dict] = None,
+        instructions_prompt: Optional[str] = None,
     ) -> str:
         """
         Makes an API call to OpenAI o4-mini and returns the response.
 
+        The call waits for the shared LLM scheduler to admit it. Rate limits,
+        server errors and connection failures are retried up to `MAX_RETRIES`
+        times with backoff.
+
         Args:
             system_prompt (str): The instruction/system prompt
             data (dict): Dictionary of variables to format into the user message
+            priority (Priority): Scheduling priority class of the call
+            usage (Dict, optional): Tags the call's token usage is
+                recorded with (see `llm_usage.usage_tags`)
+            instructions_prompt (str, optional): Extra system instructions sent
+                after the data (see `format_user_message.build_messages`)
 
         Returns:
             str: o4-mini's response text
         """
 
-        user_message = format_user_message(data)
+        messages = build_messages(system_prompt, data, instructions_prompt)
 
         client = self.default_client
 
-        try:
-            completion = client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message},
-                ],
-                max_completion_tokens=12000,
-                reasoning_effort=self.reasoning_effort,
-            )
+        prompt_tokens = await self._estimate_prompt_tokens(messages)
 
-            if completion.choices[0].message.content is None:
-                raise ValueError("No content returned from OpenAI o4-mini")
+        for attempt in itertools.count():
+            try:
+                async with scheduler.slot(
+                    priority, prompt_tokens + EXPECTED_OUTPUT_TOKENS
+                ):
+                    started_at = time.monotonic()
+                    completion = await client.chat.completions.create(
+                        model=self.model,
+                        messages=messages,
+                        max_completion_tokens=12000,
+                        reasoning_effort=self.reasoning_effort,
+                    )
 
-            return completion.choices[0].message.content
+                record_usage(
+                    parse_usage(completion.usage),
+                    usage,
+                    self.model,
+                    prompt_tokens,
+                    streamed=False,
+                    duration=time.monotonic() - started_at,
+                )
+                if completion.choices[0].message.content is None:
+                    raise ValueError("No content returned from OpenAI o4-mini")
 
-        except Exception as e:
-            print(f"Error in o4-mini API call {str(e)}")
-            raise
+                return completion.choices[0].message.content
 
-    async def call_o4_api_stream(
+            except (APIConnectionError, APIStatusError) as e:
+                status = getattr(e, "status_code", None)
+                if attempt >= MAX_RETRIES or (
+                    status is not None and status not in RETRYABLE_STATUS
+                ):
+                    print(f"Error in o4-mini API call {str(e)}")
+                    raise
+                retry_after = (
+                    _retry_after(e.response.headers) if status is not None else None
+                )
+                increment(
+                    "llm_retries", call="completion", reason=str(status or "connection")
+                )
+                await asyncio.sleep(_backoff_delay(attempt, retry_after))
+            except Exception as e:
+                print(f"Error in o4-mini API call {str(e)}")
+                raise
+
+    async def _stream_once(
         self,
-        system_prompt: str,
-        data: dict,
+        payload: dict,
+        prompt_tokens: int,
+        priority: Priority,
+        usage: Optional[Dict],
+        sent: asyncio.Future,
     ) -> AsyncGenerator[str, None]:
         """
-        Asynchronously streams a response from the OpenAI o4-mini model using SSE.
-
-        This function sends a system prompt and a user-formatted message to the OpenAI
-        Chat Completions API with streaming enabled. It yields incremental chunks of
-        the model's response as they arrive.
-
-        Args:
-            system_prompt (str): The system-level instructions for the model.
-            data (dict): Dictionary containing user input to be formatted into the prompt.
-
-        Yields:
-            str: Chunks of the model's response text as they are received.
-
-        Raises:
-            ValueError: If the API returns a non-200 response or the stream is malformed.
-            aiohttp.ClientError: If there's a connection issue with the API.
-            Exception: For any unexpected errors during the streaming process.
+        Sends one streaming request and yields its content chunks, recording the
+        usage reported in the stream's final chunk.
 
+        `sent` is resolved with the send time once the scheduler has admitted the
+        request. Failures are raised as UpstreamError.
         """
-        user_message = format_user_message(data)
-        api_key = self.api_key
-
         headers = {
             "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}",
-        }
-
-        payload = {
-            "model": self.model,
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_message},
-            ],
-            "max_completion_tokens": 12000,
-            "stream": True,
-            "reasoning_effort": self.reasoning_effort,
+            "Authorization": f"Bearer {self.api_key}",
         }
 
         try:
-            async with aiohttp.ClientSession() as session:
+            async with scheduler.slot(
+                priority, prompt_tokens + EXPECTED_OUTPUT_TOKENS
+            ), aiohttp.ClientSession() as session:
+                sent.set_result(time.monotonic())
                 async with session.post(
                     self.base_url, headers=headers, json=payload
                 ) as response:
                     if response.status != 200:
                         error_text = await response.text()
                         print(f"Error response: {error_text}")
-                        raise ValueError(
-                            f"OpenAI API returned status code {response.status}: {error_text}"
+                        raise UpstreamError(
+                            f"OpenAI API returned status code {response.status}: {error_text}",
+                            retryable=response.status in RETRYABLE_STATUS,
+                            status=response.status,
+                            retry_after=_retry_after(response.headers),
                         )
 
                     line_count = 0
@@ -125,11 +235,19 @@ class OpenAIo4Service:
                                 break
                             try:
                                 data = json.loads(line[6:])
-                                content = (
-                                    data.get("choices", [{}])[0]
-                                    .get("delta", {})
-                                    .get("content")
-                                )
+                                # With include_usage the last chunk carries the
+                                # usage and no choices
+                                if data.get("usage"):
+                                    record_usage(
+                                        parse_usage(data["usage"]),
+                                        usage,
+                                        self.model,
+                                        prompt_tokens,
+                                        streamed=True,
+                                        duration=time.monotonic() - sent.result(),
+                                    )
+                                choices = data.get("choices") or [{}]
+                                content = choices[0].get("delta", {}).get("content")
                                 if content:
                                     yield content
                             except json.JSONDecodeError as e:
@@ -141,7 +259,154 @@ class OpenAIo4Service:
 
         except aiohttp.ClientError as e:
             print(f"Connection error: {str(e)}")
-            raise ValueError(f"Failed to connect to OpenAI API: {str(e)}") from e
+            raise UpstreamError(
+                f"Failed to connect to OpenAI API: {str(e)}", retryable=True
+            ) from e
+
+    async def _open_stream(
+        self,
+        payload: dict,
+        prompt_tokens: int,
+        priority: Priority,
+        usage: Optional[Dict],
+    ) -> Tuple[AsyncGenerator[str, None], Optional[str]]:
+        """
+        Starts a streaming request and waits for its first content chunk,
+        hedging it with a second request if the first chunk is late.
+
+        Returns:
+            Tuple[AsyncGenerator[str, None], Optional[str]]: The winning stream and
+            its first chunk (None if the response was empty).
+        """
+        loop = asyncio.get_running_loop()
+        # first-chunk task -> (stream, sent future, whether it is the hedge)
+        racers = {}
+
+        def start(hedge: bool) -> asyncio.Task:
+            sent = loop.create_future()
+            stream = self._stream_once(payload, prompt_tokens, priority, usage, sent)
+            task = asyncio.ensure_future(anext(stream, None))
+            racers[task] = (stream, sent, hedge)
+            return task
+
+        primary = start(hedge=False)
+        hedged = False
+        try:
+            hedge_after = _hedge_delay()
+            if hedge_after is not None:
+                # Time spent queued in the scheduler does not count
+                sent = racers[primary][1]
+                await asyncio.wait({primary, sent}, return_when=asyncio.FIRST_COMPLETED)
+                if not primary.done():
+                    done, _ = await asyncio.wait({primary}, timeout=hedge_after)
+                    if not done:
+                        start(hedge=True)
+                        hedged = True
+
+            error = None
+            while racers:
+                done, _ = await asyncio.wait(
+                    racers, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    stream, sent, hedge = racers.pop(task)
+                    if task.exception() is None:
+                        _ttft_samples.append(time.monotonic() - sent.result())
+                        if hedged:
+                            increment(
+                                "llm_hedges", winner="hedge" if hedge else "primary"
+                            )
+                        return stream, task.result()
+                    error = error or task.exception()
+                    await stream.aclose()
+            raise error
+        finally:
+            # Losers, or every racer if the caller was cancelled
+            for task in racers:
+                task.cancel()
+            await asyncio.gather(*racers, return_exceptions=True)
+            for stream, _, _ in racers.values():
+                await stream.aclose()
+
+    async def call_o4_api_stream(
+        self,
+        system_prompt: str,
+        data: dict,
+        priority: Priority = Priority.INSIGHTS,
+        usage: Optional[Dict] = None,
+        instructions_prompt: Optional[str] = None,
+    ) -> AsyncGenerator[str, None]:
+        """
+        Asynchronously streams a response from the OpenAI o4-mini model using SSE.
+
+        This function sends a system prompt and a user-formatted message to the OpenAI
+        Chat Completions API with streaming enabled. It yields incremental chunks of
+        the model's response as they arrive. The request waits for the shared LLM
+        scheduler to admit it, and holds its slot until the stream ends.
+
+        Failures before the first chunk (rate limits, server errors, connection
+        resets) are retried with backoff, since nothing has been yielded yet; a
+        stream that breaks after its first chunk raises. With hedging enabled, a
+        slow-starting request is raced against a second one.
+
+        Args:
+            system_prompt (str): The system-level instructions for the model.
+            data (dict): Dictionary containing user input to be formatted into the prompt.
+            priority (Priority): Scheduling priority class of the call.
+            usage (Dict, optional): Tags the call's token usage is
+                recorded with (see `llm_usage.usage_tags`).
+            instructions_prompt (str, optional): Extra system instructions sent
+                after the data (see `format_user_message.build_messages`).
+
+        Yields:
+            str: Chunks of the model's response text as they are received.
+
+        Raises:
+            UpstreamError: If the API returns a non-200 response or the connection
+                fails, after retries for transient failures.
+            Exception: For any unexpected errors during the streaming process.
+
+        """
+        messages = build_messages(system_prompt, data, instructions_prompt)
+
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "max_completion_tokens": 12000,
+            "stream": True,
+            "stream_options": {"include_usage": True},
+            "reasoning_effort": self.reasoning_effort,
+        }
+        prompt_tokens = await self._estimate_prompt_tokens(messages)
+
+        try:
+            for attempt in itertools.count():
+                try:
+                    stream, first = await self._open_stream(
+                        payload, prompt_tokens, priority, usage
+                    )
+                    break
+                except UpstreamError as e:
+                    if not e.retryable or attempt >= MAX_RETRIES:
+                        raise
+                    increment(
+                        "llm_retries",
+                        call="stream",
+                        reason=str(e.status or "connection"),
+                    )
+                    await asyncio.sleep(_backoff_delay(attempt, e.retry_after))
+
+            try:
+                if first is None:
+                    return
+                yield first
+                async for content in stream:
+                    yield content
+            finally:
+                await stream.aclose()
+
+        except UpstreamError:
+            raise
         except Exception as e:
             print(f"Unexpected error in streaming API call: {str(e)}")
             raise
@@ -156,5 +421,4 @@ class OpenAIo4Service:
         Returns:
             int: Estimated number of input tokens
         """
-        num_tokens = len(self.encoding.encode(prompt))
-        return num_tokens
+        return count_tokens(prompt)
@@ -0,0 +1,111 @@
+"""
+Cache of generated READMEs, in the `readme_cache` table.
+
+READMEs generated for repositories without one (by `get_github_data`, or the
+README endpoints) are stored per (username, repo) and reused by later
+generations and cost previews. The table is read and upserted on the shared
+asyncpg pool, behind an in-process LRU of the `README_CACHE_SIZE` most recently
+used READMEs. The frontend writes the same table, so entries of the LRU are
+trusted for `README_CACHE_TTL` seconds only.
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from app.db.db import get_pool
+
+README_CACHE_SIZE = int(os.getenv("README_CACHE_SIZE", "128"))
+README_CACHE_TTL = float(os.getenv("README_CACHE_TTL", "300"))
+
+# (username, repo) -> (README, time it was read or written)
+_entries: "OrderedDict[Tuple[str, str], Tuple[str, float]]" = OrderedDict()
+# Strong references to pending writes
+_pending_writes = set()
+
+
+def _remember(key: Tuple[str, str], readme: str):
+    _entries[key] = (readme, time.monotonic())
+    _entries.move_to_end(key)
+    while len(_entries) > README_CACHE_SIZE:
+        _entries.popitem(last=False)
+
+
+async def get_cached_readme(username: str, repo: str) -> Optional[str]:
+    """
+    Looks up the cached README of a repository.
+
+    Args:
+        username (str): The GitHub username or organization name.
+        repo (str): The repository name.
+
+    Returns:
+        str: The cached README, or None if there is none or it could not be read.
+    """
+    key = (username, repo)
+    entry = _entries.get(key)
+    if entry is not None and time.monotonic() - entry[1] < README_CACHE_TTL:
+        _entries.move_to_end(key)
+        return entry[0]
+
+    try:
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            readme = await conn.fetchval(
+                "SELECT readme FROM readme_cache WHERE username = $1 AND repo = $2",
+                *key,
+            )
+    except Exception as e:
+        print(f"Could not read cached README for {username}/{repo}: {e}")
+        return None
+    if readme is None:
+        _entries.pop(key, None)
+        return None
+    _remember(key, readme)
+    return readme
+
+
+async def _write(key: Tuple[str, str], readme: str, instructions: Optional[str]):
+    try:
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            await conn.execute(
+                """
+                INSERT INTO readme_cache (username, repo, readme, instructions, updated_at)
+                VALUES ($1, $2, $3, $4, CURRENT_TIMESTAMP)
+                ON CONFLICT (username, repo) DO UPDATE SET
+                    readme = EXCLUDED.readme,
+                    instructions = EXCLUDED.instructions,
+                    updated_at = CURRENT_TIMESTAMP
+                """,
+                *key,
+                readme,
+                instructions,
+            )
+        print(f"Cached README for {key[0]}/{key[1]}")
+    except Exception as e:
+        print(f"Failed to cache README for {key[0]}/{key[1]}: {e}")
+
+
+def cache_readme(
+    username: str, repo: str, readme: str, instructions: Optional[str] = None
+):
+    """
+    Caches the README of a repository, replacing any cached one. The in-process
+    tier is updated right away and the table in the background.
+
+    Args:
+        username (str): The GitHub username or organization name.
+        repo (str): The repository name.
+        readme (str): The README.
+        instructions (str, optional): The custom instructions it was generated
+            with.
+    """
+    key = (username, repo)
+    _remember(key, readme)
+
+    task = asyncio.create_task(_write(key, readme, instructions))
+    _pending_writes.add(task)
+    task.add_done_callback(_pending_writes.discard)
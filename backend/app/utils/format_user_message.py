@@ -1,36 +1,87 @@
+"""
+Formatting of the data sent to the LLM, laid out for prompt-prefix caching.
+
+OpenAI caches prompt prefixes automatically (from 1024 tokens, in 128-token
+steps), so the layout puts content that repeats across calls first and content
+that varies last:
+1. Repository context (file tree, README, file contents), always in the order of
+   `CONTEXT_KEYS`. The diagram pipeline's explanation and mapping phases both
+   start with the same file tree, so the second reuses the first's cached prefix.
+2. The system prompt, static per phase, and a prefix shared by every user for
+   phases without repository context (e.g. the diagram phase).
+3. Per-call inputs such as earlier phases' output.
+4. Volatile inputs (`VOLATILE_KEYS`), then the optional instructions prompt.
+
+The share of prompt tokens served from the cache is reported per route and phase
+by GET /db/usage.
+"""
+
+from typing import Dict, List, Optional
+
+# Repository context, largest and most shared first
+CONTEXT_KEYS = ("file_tree", "readme", "files", "file_content")
+# Inputs that differ between otherwise identical calls
+VOLATILE_KEYS = (
+    "function_name",
+    "question",
+    "user_question",
+    "prompt",
+    "instructions",
+)
+
+
 def format_user_message(data: dict[str, str]) -> str:
     """
     Formats a dictionary of data into a structured user message with XML-style tags.
 
+    Repository context comes first and volatile inputs last, whatever the order of
+    `data`, so that equal content yields equal prefixes.
+
     Args:
         data (dict[str, str]): Dictionary of key-value pairs to format
 
     Returns:
         str: Formatted message with each key-value pair wrapped in appropriate tags
     """
-    parts = []
-    for key, value in data.items():
-        # Map keys to their XML-style tags
-        if key == "file_tree":
-            parts.append(f"<file_tree>\n{value}\n</file_tree>")
-        elif key == "readme":
-            parts.append(f"<readme>\n{value}\n</readme>")
-        elif key == "explanation":
-            parts.append(f"<explanation>\n{value}\n</explanation>")
-        elif key == "component_mapping":
-            parts.append(f"<component_mapping>\n{value}\n</component_mapping>")
-        elif key == "instructions":
-            parts.append(f"<instructions>\n{value}\n</instructions>")
-        elif key == "diagram":
-            parts.append(f"<diagram>\n{value}\n</diagram>")
-        elif key == "user_question":
-            parts.append(f"<user_question>\n{value}\n</user_question>")
-        elif key == "function_name":
-            parts.append(f"<function_name>\n{value}\n</function_name>")
-        elif key == "file_content":
-            parts.append(f"<file_content>\n{value}\n</file_content>")
-        else:
-            # For any other keys, use a generic format
-            parts.append(f"<{key}>\n{value}\n</{key}>")
-
-    return "\n\n".join(parts)
+
+    def rank(key: str) -> int:
+        if key in CONTEXT_KEYS:
+            return CONTEXT_KEYS.index(key)
+        if key in VOLATILE_KEYS:
+            return len(CONTEXT_KEYS) + 1 + VOLATILE_KEYS.index(key)
+        return len(CONTEXT_KEYS)
+
+    # sorted() is stable, so other keys keep the caller's order
+    return "\n\n".join(
+        f"<{key}>\n{data[key]}\n</{key}>" for key in sorted(data, key=rank)
+    )
+
+
+def build_messages(
+    system_prompt: str, data: dict[str, str], instructions_prompt: Optional[str] = None
+) -> List[Dict[str, str]]:
+    """
+    Builds the chat messages for a call in the cache-friendly layout.
+
+    Args:
+        system_prompt (str): The phase's static system prompt.
+        data (dict[str, str]): The inputs, formatted with `format_user_message`.
+        instructions_prompt (str, optional): System instructions that only apply
+            to some calls (e.g. how to treat custom user instructions); sent last
+            so they do not break the shared prefix.
+
+    Returns:
+        List[Dict[str, str]]: The messages.
+    """
+    context = {key: value for key, value in data.items() if key in CONTEXT_KEYS}
+    inputs = {key: value for key, value in data.items() if key not in CONTEXT_KEYS}
+
+    messages = []
+    if context:
+        messages.append({"role": "user", "content": format_user_message(context)})
+    messages.append({"role": "system", "content": system_prompt})
+    if inputs:
+        messages.append({"role": "user", "content": format_user_message(inputs)})
+    if instructions_prompt:
+        messages.append({"role": "system", "content": instructions_prompt})
+    return messages
@@ -0,0 +1,116 @@
+"""
+Incremental decoding of large JSON objects that hold one big array.
+
+Some GitHub responses (recursive git trees) are tens of megabytes, nearly all of it
+one array of small objects. `iter_array` decodes such a response chunk by chunk:
+the array's items are decoded and yielded one at a time, so only a chunk of the
+raw text and the item being decoded are held in memory, never the whole document
+or all of its items at once.
+"""
+
+import codecs
+import json
+import re
+from typing import Any, Dict, Iterable, Iterator
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_SCALAR_END = re.compile(r"[,\]} \t\n\r]")
+_decoder = json.JSONDecoder()
+
+# Chunks are read until this much text has arrived, and appended to the buffer
+# together: appending each small chunk would copy the buffer every time
+_READ_CHARS = 64 * 1024
+
+
+class _Reader:
+    """A text buffer over byte chunks, decoding JSON values from its position."""
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self.chunks = iter(chunks)
+        self.utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.position = 0
+        self.done = False
+
+    def more(self) -> bool:
+        """Reads more of the input; False at its end."""
+        if self.done:
+            return False
+        texts, length = [], 0
+        for chunk in self.chunks:
+            texts.append(self.utf8.decode(chunk))
+            length += len(texts[-1])
+            if length >= _READ_CHARS:
+                break
+        else:
+            texts.append(self.utf8.decode(b"", final=True))
+            self.done = True
+        # Consumed text is dropped
+        self.buffer = self.buffer[self.position :] + "".join(texts)
+        self.position = 0
+        return True
+
+    def peek(self) -> str:
+        """The next character besides whitespace, or "" at the end of the input."""
+        while True:
+            self.position = _WHITESPACE.match(self.buffer, self.position).end()
+            if self.position < len(self.buffer) or not self.more():
+                return self.buffer[self.position : self.position + 1]
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise ValueError(
+                f"Expected {char!r} at offset {self.position} of the JSON buffer"
+            )
+        self.position += 1
+
+    def value(self) -> Any:
+        """Decodes the next value."""
+        if self.peek() not in '{["':
+            # Numbers and literals end at a delimiter, which must have arrived
+            while not _SCALAR_END.search(self.buffer, self.position) and self.more():
+                pass
+        while True:
+            try:
+                value, self.position = _decoder.raw_decode(self.buffer, self.position)
+                return value
+            except json.JSONDecodeError:
+                # Incomplete, unless there is nothing more to read
+                if not self.more():
+                    raise
+
+
+def iter_array(chunks: Iterable[bytes], key: str, rest: Dict[str, Any]) -> Iterator:
+    """
+    Yields the items of the array at `key` of a JSON object, decoding it as its
+    chunks arrive.
+
+    Args:
+        chunks (Iterable[bytes]): The UTF-8 encoded object, in pieces of any size.
+        key (str): The member holding the array; other members are decoded whole.
+        rest (Dict[str, Any]): Receives the object's other members, complete once
+            the iterator is exhausted.
+
+    Yields:
+        Any: The decoded items of the array, in order.
+
+    Raises:
+        ValueError: If the input is not a JSON object, or `key` is not an array.
+    """
+    reader = _Reader(chunks)
+    reader.expect("{")
+    while reader.peek() != "}":
+        if reader.peek() == ",":
+            reader.position += 1
+        name = reader.value()
+        reader.expect(":")
+        if name != key:
+            rest[name] = reader.value()
+            continue
+        reader.expect("[")
+        while reader.peek() != "]":
+            if reader.peek() == ",":
+                reader.position += 1
+            yield reader.value()
+        reader.position += 1
+    reader.expect("}")
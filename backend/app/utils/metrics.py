@@ -0,0 +1,38 @@
+"""
+In-process counters for operational metrics.
+
+Counters are identified by a name and a set of labels, e.g.
+``increment("sse_disconnects", kind="readme", outcome="cancelled")``. They are
+kept per worker process, reset on restart, and exposed by GET /db/metrics.
+"""
+
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+_counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = defaultdict(float)
+
+
+def increment(name: str, value: float = 1, **labels: str):
+    """
+    Adds `value` to a counter.
+
+    Args:
+        name (str): The counter name.
+        value (float, optional): The amount to add. Defaults to 1.
+        **labels (str): Labels distinguishing series of the same counter.
+    """
+    _counters[(name, tuple(sorted(labels.items())))] += value
+
+
+def snapshot() -> List[Dict]:
+    """
+    Returns the current value of every counter.
+
+    Returns:
+        List[Dict]: One dict per series with 'name', 'labels' and 'value' keys,
+        sorted by name.
+    """
+    return [
+        {"name": name, "labels": dict(labels), "value": value}
+        for (name, labels), value in sorted(_counters.items())
+    ]
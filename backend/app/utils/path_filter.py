@@ -0,0 +1,283 @@
+"""
+Compiled path patterns for choosing which repository files reach the LLM.
+
+Repository trees can list hundreds of thousands of paths, and each path used to
+be tested against every pattern in turn. Each pattern list is compiled once, at
+import, into a single regular expression:
+- Plain patterns match anywhere in the lowercased path, as substrings. They are
+  merged into a character trie (``node_modules/|.pyc|.pyo`` becomes
+  ``node_modules/|\\.py[co]``), so a path is scanned once whatever the number of
+  patterns, and most positions are rejected on their first character.
+- Patterns with ``*``, ``?`` or ``[...]`` are gitignore-style globs matched against
+  whole path components: ``*.log`` excludes ``server.log`` and
+  ``logs/2024.log/part`` at any depth, but not ``catalog.py``.
+
+Priorities are computed in the opposite direction: each priority pattern is found
+with one scan of all the paths joined together, highest priority first, stopping
+once enough files are found.
+"""
+
+import re
+from bisect import bisect_right
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+# Not part of the file tree: dependencies, compiled files, assets, caches, lock
+# files and logs, editor settings
+EXCLUDED_PATTERNS = (
+    # Dependencies
+    "node_modules/",
+    "vendor/",
+    "venv/",
+    # Compiled files
+    ".min.",
+    ".pyc",
+    ".pyo",
+    ".pyd",
+    ".so",
+    ".dll",
+    ".class",
+    # Asset files
+    ".jpg",
+    ".jpeg",
+    ".png",
+    ".gif",
+    ".ico",
+    ".svg",
+    ".ttf",
+    ".woff",
+    ".webp",
+    # Cache and temporary files
+    "__pycache__/",
+    ".cache/",
+    ".tmp/",
+    # Lock files and logs
+    "yarn.lock",
+    "poetry.lock",
+    "*.log",
+    # Configuration files
+    ".vscode/",
+    ".idea/",
+)
+
+# Never read as file contents: binary and minified files
+BINARY_PATTERNS = (
+    ".jpg",
+    ".jpeg",
+    ".png",
+    ".gif",
+    ".ico",
+    ".svg",
+    ".ttf",
+    ".woff",
+    ".webp",
+    ".min.",
+    ".pyc",
+    ".so",
+    ".dll",
+    ".class",
+)
+
+# File contents worth reading, most important first
+PRIORITY_PATTERNS = (
+    # Configuration files
+    "package.json",
+    "pyproject.toml",
+    "requirements.txt",
+    "Cargo.toml",
+    "go.mod",
+    "composer.json",
+    "Gemfile",
+    "pom.xml",
+    "build.gradle",
+    "Makefile",
+    # Documentation
+    "README",
+    "CHANGELOG",
+    "LICENSE",
+    "CONTRIBUTING",
+    "docs/",
+    # Source code (limit to main directories)
+    "src/",
+    "app/",
+    "lib/",
+    "main.",
+    "index.",
+    "app.py",
+    "main.py",
+    # Shell scripts and executables
+    ".sh",
+    ".bash",
+    ".zsh",
+    ".fish",
+    # Configuration
+    ".env.example",
+    "config/",
+    "settings/",
+    # Common source files
+    ".js",
+    ".ts",
+    ".jsx",
+    ".tsx",
+    ".py",
+    ".java",
+    ".cpp",
+    ".c",
+    ".h",
+    ".go",
+    ".rs",
+    ".php",
+    ".rb",
+    ".swift",
+    ".kt",
+    ".scala",
+)
+
+_GLOB_CHARS = re.compile(r"[*?\[]")
+
+
+def _trie(patterns: Iterable[str]) -> str:
+    """A regex matching any of `patterns`, with common prefixes merged."""
+    root: Dict[str, Dict] = {}
+    for pattern in patterns:
+        node = root
+        for char in pattern:
+            node = node.setdefault(char, {})
+        # The empty key marks the end of a pattern
+        node[""] = {}
+
+    def render(node: Dict[str, Dict]) -> str:
+        # Searching for substrings, a pattern that ends here makes the longer
+        # patterns it prefixes redundant
+        if "" in node:
+            return ""
+        branches = [re.escape(char) + render(child) for char, child in node.items()]
+        if len(branches) == 1:
+            return branches[0]
+        if all(
+            len(branch) == len(re.escape(char)) for char, branch in zip(node, branches)
+        ):
+            return "[" + "".join(branches) + "]"
+        return "(?:" + "|".join(branches) + ")"
+
+    return render(root)
+
+
+def _glob(pattern: str) -> str:
+    """A regex matching the path components `pattern` matches, gitignore-style."""
+    parts = []
+    for token in re.split(r"(\*\*|\*|\?|\[[^\]]*\])", pattern.strip("/")):
+        if token == "**":
+            parts.append(".*")
+        elif token == "*":
+            parts.append("[^/]*")
+        elif token == "?":
+            parts.append("[^/]")
+        elif token.startswith("["):
+            parts.append(token.replace("[!", "[^", 1))
+        else:
+            parts.append(re.escape(token))
+    # A trailing "/" limits the pattern to directories
+    end = "/" if pattern.endswith("/") else "(?:/|$)"
+    if parts[0] == "" and parts[1] == "[^/]*":
+        # Every component start matches, and a literal first is much faster
+        return "".join(parts[2:]) + end
+    return "(?:^|/)" + "".join(parts) + end
+
+
+def compile_patterns(patterns: Sequence[str]) -> List["re.Pattern[str]"]:
+    """
+    Compiles path patterns into regular expressions for lowercased paths.
+
+    The substrings make one expression and the globs another: alternating the two
+    kinds in one expression is slower than running both.
+
+    Args:
+        patterns (Sequence[str]): Substrings, or gitignore-style globs.
+
+    Returns:
+        List[re.Pattern]: Patterns one of which `search`es successfully in a path
+        containing any of `patterns`. Multi-line, so they also find the paths of
+        a text with one path per line.
+    """
+    plain = [p.lower() for p in patterns if not _GLOB_CHARS.search(p)]
+    globs = [_glob(p.lower()) for p in patterns if _GLOB_CHARS.search(p)]
+    expressions = ([_trie(plain)] if plain else []) + (
+        ["|".join(globs)] if globs else []
+    )
+    return [re.compile(expression, re.MULTILINE) for expression in expressions]
+
+
+_EXCLUDED = compile_patterns(EXCLUDED_PATTERNS)
+_BINARY = compile_patterns(BINARY_PATTERNS)
+
+
+def _lower_all(paths: List[str]) -> List[str]:
+    # Paths have no newlines, and one str.lower call is far cheaper than one per path
+    return "\n".join(paths).lower().split("\n") if paths else []
+
+
+def should_include_file(path: str) -> bool:
+    """
+    Whether a path belongs in the file tree sent to the LLM, i.e. is not a static
+    file or generated code.
+    """
+    path = path.lower()
+    return not any(pattern.search(path) for pattern in _EXCLUDED)
+
+
+def rank_by_priority(paths: List[str], limit: int) -> List[Tuple[int, int]]:
+    """
+    Picks the `limit` most important paths by `PRIORITY_PATTERNS`, leaving out
+    binary and minified files (`BINARY_PATTERNS`).
+
+    A path's priority is set by the first pattern it contains (case-insensitive):
+    ``len(PRIORITY_PATTERNS)`` for the first pattern down to 1 for the last, and 0
+    if it contains none. Patterns are searched for in order across all paths at
+    once, so the scan stops as soon as `limit` paths have a priority.
+
+    Args:
+        paths (List[str]): The candidate paths.
+        limit (int): The number of paths to pick.
+
+    Returns:
+        List[Tuple[int, int]]: The (index into `paths`, priority) of the picked
+        paths, highest priority first and in their original order among equals.
+    """
+    if limit <= 0 or not paths:
+        return []
+    lowered = _lower_all(paths)
+    text = "\n".join(lowered)
+    starts = []
+    position = 0
+    for path in lowered:
+        starts.append(position)
+        position += len(path) + 1
+
+    # Binary paths are rare, so they are found in the whole text too
+    skipped = {
+        bisect_right(starts, match.start()) - 1
+        for pattern in _BINARY
+        for match in pattern.finditer(text)
+    }
+    picked: Dict[int, int] = {}
+    for rank, pattern in enumerate(PRIORITY_PATTERNS):
+        priority = len(PRIORITY_PATTERNS) - rank
+        pattern = pattern.lower()
+        position = text.find(pattern)
+        while position != -1 and len(picked) < limit:
+            index = bisect_right(starts, position) - 1
+            if index not in picked and index not in skipped:
+                picked[index] = priority
+            # Next path; a path matches each pattern at most once
+            position = text.find(pattern, starts[index] + len(lowered[index]))
+        if len(picked) >= limit:
+            break
+
+    ranked = sorted(picked.items(), key=lambda item: (-item[1], item[0]))
+    # Paths matching no pattern fill the rest, in order
+    index = 0
+    while len(ranked) < limit and index < len(paths):
+        if index not in picked and index not in skipped:
+            ranked.append((index, 0))
+        index += 1
+    return ranked
@@ -0,0 +1,340 @@
+"""
+Compact in-memory representation of a repository's file tree.
+
+Repository trees can hold hundreds of thousands of paths, and are kept around for
+the length of a generation (and longer once cached). `RepoTree` stores one node per
+path in parallel arrays instead of one object per path:
+- each node's name (its last path component, interned, so that common names such
+  as ``src`` or ``index.ts`` are stored once) and its parent's index,
+- a type flag, the size and the binary SHA of each node,
+- first-child and next-sibling indices, so a directory's children keep the order
+  in which they were added (git's order) and a subtree is walked without scanning
+  the rest of the tree.
+
+Full paths are only built when serializing (`to_text`) or iterating (`entries`).
+Lookups (`kind`, `is_file`, `is_dir`) probe a hash table of node indices by
+(parent, name), one probe per path component; the table is itself an array, at
+most half full, instead of a dictionary of tuples that would outweigh the rest of
+the tree.
+"""
+
+import struct
+import sys
+import zlib
+from array import array
+from typing import Iterable, Iterator, NamedTuple, Optional, Tuple
+
+FILE = 0
+DIRECTORY = 1
+SUBMODULE = 2
+# Flag bit of nodes that are paths of the tree; a directory that only appears as
+# the parent of added paths is not listed
+_LISTED = 4
+_KIND_MASK = 3
+
+# git trees API types
+_KINDS = {"blob": FILE, "tree": DIRECTORY, "commit": SUBMODULE}
+_TYPES = ("blob", "tree", "commit")
+
+_NO_SHA = bytes(20)
+# Serialized trees are shared between machines through the database
+_SWAP_BYTES = sys.byteorder != "little"
+
+
+class TreeEntry(NamedTuple):
+    """A path of a repository tree: only what is used of a git trees API item."""
+
+    path: str
+    size: int
+    sha: str
+    type: str  # "blob", "tree" or "commit" (a submodule)
+
+
+class RepoTree:
+    """The paths of a repository tree, with their type, size and SHA."""
+
+    __slots__ = (
+        "_names",
+        "_parents",
+        "_flags",
+        "_sizes",
+        "_shas",
+        "_first_child",
+        "_next_sibling",
+        "_last_child",
+        "_table",
+        "_listed",
+    )
+
+    def __init__(self, entries: Iterable[TreeEntry] = ()):
+        # Node 0 is the root
+        self._names = [""]
+        self._parents = array("i", [-1])
+        self._flags = bytearray([DIRECTORY])
+        self._sizes = array("q", [0])
+        self._shas = bytearray(_NO_SHA)
+        self._first_child = array("i", [-1])
+        self._next_sibling = array("i", [-1])
+        self._last_child = array("i", [-1])
+        # Open addressing by hash((parent, name)); -1 marks free slots
+        self._table = array("i", [-1]) * 8
+        self._listed = 0
+        self.extend(entries)
+
+    def _slot(self, parent: int, name: str) -> int:
+        """The slot of the child `name` of `parent`, or of the free slot for it."""
+        table, names, parents = self._table, self._names, self._parents
+        mask = len(table) - 1
+        slot = hash((parent, name)) & mask
+        while True:
+            node = table[slot]
+            if node == -1 or (parents[node] == parent and names[node] == name):
+                return slot
+            slot = (slot + 1) & mask
+
+    def _grow(self):
+        self._table = array("i", [-1]) * (len(self._table) * 2)
+        for node in range(1, len(self._names)):
+            self._table[self._slot(self._parents[node], self._names[node])] = node
+
+    def _link(self, node: int, slot: int):
+        """Makes a new node its parent's last child and indexes it at `slot`."""
+        parent = self._parents[node]
+        if self._last_child[parent] == -1:
+            self._first_child[parent] = node
+        else:
+            self._next_sibling[self._last_child[parent]] = node
+        self._last_child[parent] = node
+        self._table[slot] = node
+
+    def _child(self, parent: int, name: str) -> int:
+        slot = self._slot(parent, name)
+        if self._table[slot] != -1:
+            return self._table[slot]
+        name = sys.intern(name)
+        node = len(self._names)
+        self._names.append(name)
+        self._parents.append(parent)
+        self._flags.append(DIRECTORY)
+        self._sizes.append(0)
+        self._shas += _NO_SHA
+        self._first_child.append(-1)
+        self._next_sibling.append(-1)
+        self._last_child.append(-1)
+        self._link(node, slot)
+        if 2 * len(self._names) > len(self._table):
+            self._grow()
+        return node
+
+    def add(self, path: str, type: str = "blob", size: int = 0, sha: str = None):
+        """
+        Adds a path, and its parent directories if they are not in the tree yet.
+
+        Args:
+            path (str): The path, without leading or trailing slashes.
+            type (str, optional): "blob", "tree" or "commit". Defaults to "blob".
+            size (int, optional): The size in bytes. Defaults to 0.
+            sha (str, optional): The object's SHA-1, in hex.
+        """
+        node = 0
+        for name in path.split("/"):
+            node = self._child(node, name)
+        if not self._flags[node] & _LISTED:
+            self._listed += 1
+        self._flags[node] = _KINDS[type] | _LISTED
+        self._sizes[node] = size or 0
+        if sha:
+            self._shas[node * 20 : node * 20 + 20] = bytes.fromhex(sha)
+
+    def extend(self, entries: Iterable[TreeEntry]):
+        """Adds paths, e.g. the entries of another tree."""
+        for entry in entries:
+            self.add(entry.path, entry.type, entry.size, entry.sha)
+
+    def __len__(self) -> int:
+        """The number of paths in the tree."""
+        return self._listed
+
+    def _find(self, path: str) -> Optional[int]:
+        node = 0
+        for name in path.strip("/").split("/"):
+            node = self._table[self._slot(node, name)]
+            if node == -1:
+                return None
+        return node
+
+    def __contains__(self, path: str) -> bool:
+        node = self._find(path)
+        return node is not None and bool(self._flags[node] & _LISTED)
+
+    def kind(self, path: str) -> Optional[str]:
+        """
+        The type of a path.
+
+        Args:
+            path (str): The path; leading and trailing slashes are ignored.
+
+        Returns:
+            str: "blob", "tree" or "commit", or None if the path is not in the tree.
+        """
+        node = self._find(path)
+        if node is None:
+            return None
+        return _TYPES[self._flags[node] & _KIND_MASK]
+
+    def is_file(self, path: str) -> bool:
+        return self.kind(path) == "blob"
+
+    def is_dir(self, path: str) -> bool:
+        return self.kind(path) == "tree"
+
+    def _walk(self, node: int) -> Iterator[Tuple[int, str]]:
+        """Yields the (node, path) of the subtree below `node`, in pre-order."""
+        names, first_child, next_sibling = (
+            self._names,
+            self._first_child,
+            self._next_sibling,
+        )
+        base = self.path(node)
+        # One pending sibling and one path prefix per level being walked
+        pending = [first_child[node]]
+        prefixes = [f"{base}/" if base else ""]
+        while pending:
+            current = pending[-1]
+            if current == -1:
+                pending.pop()
+                prefixes.pop()
+                continue
+            pending[-1] = next_sibling[current]
+            path = prefixes[-1] + names[current]
+            yield current, path
+            if first_child[current] != -1:
+                pending.append(first_child[current])
+                prefixes.append(path + "/")
+
+    def path(self, node: int) -> str:
+        """The full path of a node."""
+        names = []
+        while node > 0:
+            names.append(self._names[node])
+            node = self._parents[node]
+        return "/".join(reversed(names))
+
+    def _children(self, node: int) -> Iterator[Tuple[int, str]]:
+        base = self.path(node)
+        prefix = f"{base}/" if base else ""
+        child = self._first_child[node]
+        while child != -1:
+            yield child, prefix + self._names[child]
+            child = self._next_sibling[child]
+
+    def entries(self, path: str = "", recursive: bool = True) -> Iterator[TreeEntry]:
+        """
+        Iterates over the paths below a directory, in the order they were added
+        within each directory (depth first).
+
+        Args:
+            path (str, optional): The directory; defaults to the whole tree.
+            recursive (bool, optional): Whether to include the whole subtree, or
+                only the directory's children. Defaults to True.
+
+        Yields:
+            TreeEntry: The paths below `path`, without `path` itself.
+        """
+        node = self._find(path) if path.strip("/") else 0
+        if node is None:
+            return
+        flags, sizes, shas = self._flags, self._sizes, self._shas
+        nodes = self._walk(node) if recursive else self._children(node)
+        for current, current_path in nodes:
+            flag = flags[current]
+            if flag & _LISTED:
+                sha = shas[current * 20 : current * 20 + 20]
+                yield TreeEntry(
+                    current_path,
+                    sizes[current],
+                    sha.hex() if sha != _NO_SHA else "",
+                    _TYPES[flag & _KIND_MASK],
+                )
+
+    def __iter__(self) -> Iterator[TreeEntry]:
+        return self.entries()
+
+    def to_text(self) -> str:
+        """The paths of the tree, one per line, as in the prompts' file tree."""
+        flags = self._flags
+        return "\n".join(path for node, path in self._walk(0) if flags[node] & _LISTED)
+
+    def to_bytes(self) -> bytes:
+        """
+        Serializes the tree, e.g. to store it in a database; see `from_bytes`.
+
+        Returns:
+            bytes: The tree's arrays (little-endian) and names, compressed.
+        """
+        names = "\0".join(self._names[1:]).encode("utf-8", errors="surrogatepass")
+        parents, sizes = self._parents, self._sizes
+        if _SWAP_BYTES:
+            parents, sizes = array("i", parents), array("q", sizes)
+            parents.byteswap()
+            sizes.byteswap()
+        return zlib.compress(
+            b"".join(
+                [
+                    struct.pack("<qq", len(self._names), len(names)),
+                    parents.tobytes(),
+                    bytes(self._flags),
+                    sizes.tobytes(),
+                    bytes(self._shas),
+                    names,
+                ]
+            )
+        )
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "RepoTree":
+        """
+        Restores a tree serialized by `to_bytes`.
+
+        Args:
+            data (bytes): The serialized tree.
+
+        Returns:
+            RepoTree: The tree.
+        """
+        data = zlib.decompress(data)
+        count, names_length = struct.unpack_from("<qq", data)
+        offset = struct.calcsize("<qq")
+
+        def take(length: int) -> bytes:
+            nonlocal offset
+            offset += length
+            return data[offset - length : offset]
+
+        tree = cls()
+        tree._parents = array("i")
+        tree._parents.frombytes(take(count * tree._parents.itemsize))
+        tree._flags = bytearray(take(count))
+        tree._sizes = array("q")
+        tree._sizes.frombytes(take(count * tree._sizes.itemsize))
+        tree._shas = bytearray(take(count * 20))
+        if _SWAP_BYTES:
+            tree._parents.byteswap()
+            tree._sizes.byteswap()
+        names = take(names_length).decode("utf-8", errors="surrogatepass")
+        tree._names = [""] + [
+            sys.intern(name) for name in (names.split("\0") if count > 1 else [])
+        ]
+
+        # Parents precede their children, which were added in order
+        tree._first_child = array("i", [-1]) * count
+        tree._next_sibling = array("i", [-1]) * count
+        tree._last_child = array("i", [-1]) * count
+        size = 8
+        while size < 2 * count:
+            size *= 2
+        tree._table = array("i", [-1]) * size
+        for node in range(1, count):
+            tree._link(node, tree._slot(tree._parents[node], tree._names[node]))
+        tree._listed = sum(1 for flag in tree._flags if flag & _LISTED)
+        return tree
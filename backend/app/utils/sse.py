@@ -0,0 +1,286 @@
+"""
+Server-Sent Events encoding shared by every streaming endpoint.
+
+`SSEEmitter` frames JSON payloads as SSE events:
+- Payloads are encoded with orjson when it is installed (several times faster than
+  the stdlib for the small dicts sent per token), falling back to `json`.
+- Every event carries an incrementing `id:` so clients can resume with
+  `Last-Event-ID`.
+- LLM token streams are coalesced: consecutive chunks are merged into one event
+  until `flush_interval` seconds have passed or `max_chunk_chars` characters are
+  buffered. Clients concatenate chunk text, so merging is transparent to them.
+
+`cancel_on_disconnect` stops an event generator once its client has gone away, so
+abandoned streams no longer keep the upstream LLM busy.
+"""
+
+import asyncio
+import json
+import time
+from decimal import Decimal
+from typing import AsyncIterator, Optional
+
+from fastapi import Request
+
+from app.utils.metrics import increment
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is listed in requirements.txt
+    orjson = None
+
+FLUSH_INTERVAL = 0.05
+MAX_CHUNK_CHARS = 1024
+# How often a stream waiting on its upstream checks whether the client is still there
+DISCONNECT_POLL_SECONDS = 0.5
+
+SSE_HEADERS = {
+    "X-Accel-Buffering": "no",
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+}
+
+
+def _default(obj):
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if hasattr(obj, "isoformat"):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def encode_json(payload) -> bytes:
+    """
+    Encodes a payload as compact UTF-8 JSON.
+
+    Args:
+        payload: Any JSON-serializable value; Decimals and datetimes are converted.
+
+    Returns:
+        bytes: The encoded payload.
+    """
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default)
+    return json.dumps(
+        payload, ensure_ascii=False, separators=(",", ":"), default=_default
+    ).encode()
+
+
+class SSEEmitter:
+    """
+    Frames events for one SSE stream.
+
+    Args:
+        first_id (int, optional): Id of the first event. Defaults to 1.
+        flush_interval (float, optional): Maximum seconds a chunk is held back to
+            be merged with the following ones.
+        max_chunk_chars (int, optional): Buffered characters that force a flush.
+    """
+
+    def __init__(
+        self,
+        first_id: int = 1,
+        flush_interval: float = FLUSH_INTERVAL,
+        max_chunk_chars: int = MAX_CHUNK_CHARS,
+    ):
+        self.next_id = first_id
+        self.flush_interval = flush_interval
+        self.max_chunk_chars = max_chunk_chars
+
+    def event(self, payload: dict) -> bytes:
+        """
+        Frames a single event.
+
+        Args:
+            payload (dict): The event data.
+
+        Returns:
+            bytes: The framed event, ready to be yielded to a StreamingResponse.
+        """
+        frame = b"id: %d\ndata: %b\n\n" % (self.next_id, encode_json(payload))
+        self.next_id += 1
+        return frame
+
+    def chunks(
+        self, source: AsyncIterator[str], fields: dict, key: str = "chunk"
+    ) -> "CoalescedStream":
+        """
+        Wraps an LLM token stream so it yields coalesced chunk events.
+
+        Args:
+            source (AsyncIterator[str]): The token stream.
+            fields (dict): Fields sent with every chunk event, e.g.
+                ``{"status": "llm_chunk"}``.
+            key (str, optional): The field holding the chunk text. Defaults to "chunk".
+
+        Returns:
+            CoalescedStream: Iterate it for framed events; its `text` attribute
+            holds the full streamed text once iteration finishes.
+        """
+        return CoalescedStream(self, source, fields, key)
+
+
+class CoalescedStream:
+    """
+    Async iterator of coalesced chunk events over a token stream.
+
+    The token stream is consumed by a separate task feeding a queue, so buffered
+    text is flushed on time even while the upstream is silent, without ever
+    cancelling a pending read of the upstream stream.
+    """
+
+    _DONE = object()
+
+    def __init__(
+        self, emitter: SSEEmitter, source: AsyncIterator[str], fields: dict, key: str
+    ):
+        self.emitter = emitter
+        self.source = source
+        self.fields = fields
+        self.key = key
+        self.text = ""
+
+    def _frame(self, parts: list) -> bytes:
+        return self.emitter.event({**self.fields, self.key: "".join(parts)})
+
+    async def _pump(self, queue: asyncio.Queue):
+        try:
+            async for chunk in self.source:
+                if chunk:
+                    await queue.put(chunk)
+            await queue.put(self._DONE)
+        except Exception as e:
+            await queue.put(e)
+
+    async def __aiter__(self):
+        queue = asyncio.Queue()
+        pump = asyncio.create_task(self._pump(queue))
+        buffered = []
+        buffered_chars = 0
+        flush_at = None
+        try:
+            while True:
+                timeout = None
+                if buffered:
+                    timeout = max(flush_at - time.monotonic(), 0)
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    yield self._frame(buffered)
+                    buffered, buffered_chars, flush_at = [], 0, None
+                    continue
+
+                if item is self._DONE:
+                    break
+                if isinstance(item, Exception):
+                    if buffered:
+                        yield self._frame(buffered)
+                        buffered = []
+                    raise item
+
+                # The first chunk goes out at once so time-to-first-token is
+                # unaffected by coalescing
+                first = not self.text
+                self.text += item
+                if not buffered:
+                    flush_at = time.monotonic() + self.emitter.flush_interval
+                buffered.append(item)
+                buffered_chars += len(item)
+                if (
+                    first
+                    or buffered_chars >= self.emitter.max_chunk_chars
+                    or time.monotonic() >= flush_at
+                ):
+                    yield self._frame(buffered)
+                    buffered, buffered_chars, flush_at = [], 0, None
+
+            if buffered:
+                yield self._frame(buffered)
+        finally:
+            if not pump.done():
+                pump.cancel()
+                await asyncio.gather(pump, return_exceptions=True)
+
+
+# Strong references to abandoned streams that are still being closed or drained
+_abandoned = set()
+
+
+async def cancel_on_disconnect(
+    request: Request,
+    events: AsyncIterator[bytes],
+    kind: str,
+    finish_in_background: bool = False,
+) -> AsyncIterator[bytes]:
+    """
+    Forwards an SSE event generator until its client disconnects.
+
+    While the generator is busy (e.g. waiting for the LLM), the connection is
+    checked every `DISCONNECT_POLL_SECONDS`. When the client is gone the pending
+    step is cancelled and the generator closed, which cancels its in-flight
+    upstream request and skips its remaining phases. With `finish_in_background`
+    the generator instead runs to completion with its events discarded, so side
+    effects such as caching the result still happen.
+
+    Each abandoned stream is counted in the `sse_disconnects` metric.
+
+    Args:
+        request (Request): The request being answered.
+        events (AsyncIterator[bytes]): The framed events.
+        kind (str): Metric label naming the stream, e.g. "readme".
+        finish_in_background (bool, optional): Let the generator finish after a
+            disconnect. Defaults to False.
+
+    Yields:
+        bytes: The generator's events.
+    """
+    finished = False
+    step = None
+    try:
+        while True:
+            step = asyncio.ensure_future(anext(events, None))
+            while not step.done():
+                await asyncio.wait({step}, timeout=DISCONNECT_POLL_SECONDS)
+                if not step.done() and await request.is_disconnected():
+                    return
+            frame = step.result()
+            step = None
+            if frame is None:
+                finished = True
+                return
+            yield frame
+    except BaseException:
+        # The generator itself failed; there is nothing left to cancel
+        finished = step is not None and step.done()
+        raise
+    finally:
+        if not finished:
+            outcome = "background" if finish_in_background else "cancelled"
+            increment("sse_disconnects", kind=kind, outcome=outcome)
+            task = asyncio.create_task(
+                _abandon(events, step, finish_in_background, kind)
+            )
+            _abandoned.add(task)
+            task.add_done_callback(_abandoned.discard)
+
+
+async def _abandon(
+    events: AsyncIterator[bytes],
+    step: Optional[asyncio.Future],
+    finish_in_background: bool,
+    kind: str,
+):
+    """Cancels or drains a generator whose client disconnected."""
+    try:
+        if finish_in_background:
+            if step is not None and await step is None:
+                return
+            async for _ in events:
+                pass
+        else:
+            if step is not None:
+                step.cancel()
+                await asyncio.gather(step, return_exceptions=True)
+            await events.aclose()
+    except Exception as e:
+        print(f"Abandoned {kind} stream failed: {e}")
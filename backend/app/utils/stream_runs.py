@@ -0,0 +1,382 @@
+"""
+Registry of resumable Server-Sent Events streams.
+
+A run executes an SSE event generator in a background task, independent of the
+HTTP connection that started it, and buffers every framed event. Clients follow a
+run through `StreamRun.subscribe`; a client that lost its connection reconnects
+with the id of the last event it received (`Last-Event-ID`) and gets the missed
+events replayed before the stream continues live, without the run's LLM calls
+being started again.
+
+A run nobody follows is cancelled once no client has been connected for
+`SSE_RUN_ABANDON_SECONDS`, the grace period for reconnecting (counted from the
+start of the run for a client that never subscribed), and counted in the
+`sse_disconnects` metric. Runs started with `finish_in_background` keep going.
+
+Runs are kept in memory for `SSE_RUN_TTL_SECONDS` after they finish (at most
+`SSE_MAX_RUNS` finished runs). With `SSE_RUN_PERSIST=1` events are also written to
+the `stream_runs`/`stream_run_events` tables, so a reconnect that reaches another
+worker process can still replay the run and follow it until it finishes. Such a
+follower marks the run as followed (`stream_runs.followed_at`) while it polls, and
+the process producing the run does not cancel a run followed within the grace
+period.
+
+Events must be framed by `app.utils.sse.SSEEmitter`, whose ids start at 1 and
+increase by one per event.
+"""
+
+import asyncio
+import bisect
+import os
+import time
+import uuid
+from typing import AsyncIterator, Dict, Optional
+
+from fastapi import Request
+
+from app.db.db import get_pool
+from app.utils.metrics import increment
+from app.utils.sse import DISCONNECT_POLL_SECONDS, encode_json
+
+RUN_TTL_SECONDS = int(os.getenv("SSE_RUN_TTL_SECONDS", "900"))
+RUN_ABANDON_SECONDS = float(os.getenv("SSE_RUN_ABANDON_SECONDS", "30"))
+MAX_RUNS = int(os.getenv("SSE_MAX_RUNS", "200"))
+RUN_PERSIST = os.getenv("SSE_RUN_PERSIST", "").lower() in ("1", "true", "yes")
+
+# How often a reconnect served from Postgres polls for new events, and how long
+# it waits for a run that stopped writing events before giving up.
+PERSIST_POLL_SECONDS = 0.5
+PERSIST_IDLE_SECONDS = 120
+# How often a reconnect served from Postgres marks the run as followed; well within
+# the grace period, so that the producing process sees the follower in time.
+PERSIST_HEARTBEAT_SECONDS = min(5.0, RUN_ABANDON_SECONDS / 3)
+
+
+def _event_id(frame: bytes) -> int:
+    """Reads the id of a frame produced by SSEEmitter (``id: <n>\\n...``)."""
+    return int(frame[4 : frame.index(b"\n")])
+
+
+class StreamRun:
+    """
+    One SSE event generator running in the background, with its buffered events.
+
+    Args:
+        run_id (str): The run id.
+        kind (str): What the run produces, e.g. "generate".
+        finish_in_background (bool, optional): Keep running when no client
+            follows the run. Defaults to False.
+    """
+
+    def __init__(self, run_id: str, kind: str, finish_in_background: bool = False):
+        self.id = run_id
+        self.kind = kind
+        self.finish_in_background = finish_in_background
+        self.ids = []
+        self.frames = []
+        self.done = False
+        self.cancelled = False
+        self.finished_at = None
+        self.task = None
+        self.subscribers = 0
+        # Whether the run's events are written to Postgres
+        self.persisted = False
+        self._abandon_check = None
+        self._changed = asyncio.Condition()
+
+    def _append(self, frame: bytes):
+        self.ids.append(_event_id(frame))
+        self.frames.append(frame)
+        self._changed.notify_all()
+
+    async def _produce(self, events: AsyncIterator[bytes]):
+        persist = RUN_PERSIST and await _try_persist(_persist_start, self)
+        self.persisted = persist
+        try:
+            async for frame in events:
+                async with self._changed:
+                    self._append(frame)
+                if persist:
+                    # Persistence is best effort; the in-memory buffer stays complete
+                    persist = await _try_persist(_persist_frame, self, frame)
+                    self.persisted = persist
+        except asyncio.CancelledError:
+            # Tell clients that reconnect too late why the run ended early
+            frame = b"id: %d\ndata: %b\n\n" % (
+                (self.ids[-1] if self.ids else 0) + 1,
+                encode_json({"error": "Cancelled after the client disconnected"}),
+            )
+            async with self._changed:
+                self._append(frame)
+            if persist:
+                persist = await _try_persist(_persist_frame, self, frame)
+        except Exception as e:
+            print(f"Stream run {self.id} failed: {e}")
+        finally:
+            async with self._changed:
+                self.done = True
+                self.finished_at = time.monotonic()
+                self._changed.notify_all()
+            if persist:
+                await _try_persist(_persist_finish, self)
+
+    async def _cancel_if_abandoned(self):
+        while True:
+            await asyncio.sleep(RUN_ABANDON_SECONDS)
+            if self.subscribers or self.done:
+                return
+            # Clients following from other processes do not subscribe here
+            if not (self.persisted and await _persisted_run_followed(self.id)):
+                break
+        if self.finish_in_background:
+            increment("sse_disconnects", kind=self.kind, outcome="background")
+            return
+        increment("sse_disconnects", kind=self.kind, outcome="cancelled")
+        self.cancelled = True
+        self.task.cancel()
+
+    def _arm_abandon_check(self):
+        """(Re)starts the grace period after which an unfollowed run is cancelled."""
+        if self._abandon_check is not None:
+            self._abandon_check.cancel()
+        self._abandon_check = asyncio.create_task(self._cancel_if_abandoned())
+
+    async def subscribe(
+        self, last_event_id: int = 0, request: Optional[Request] = None
+    ) -> AsyncIterator[bytes]:
+        """
+        Yields the run's events after `last_event_id`, then follows the run live
+        until it finishes.
+
+        Args:
+            last_event_id (int, optional): Id of the last event the client has
+                seen. Defaults to 0 (replay everything).
+            request (Request, optional): The request the events are streamed to.
+                If given, the subscription ends as soon as its client disconnects,
+                even while the run is silent.
+
+        Yields:
+            bytes: Framed SSE events.
+        """
+        position = bisect.bisect_right(self.ids, last_event_id)
+        poll = DISCONNECT_POLL_SECONDS if request is not None else None
+        self.subscribers += 1
+        try:
+            while True:
+                async with self._changed:
+                    try:
+                        await asyncio.wait_for(
+                            self._changed.wait_for(
+                                lambda: position < len(self.frames) or self.done
+                            ),
+                            poll,
+                        )
+                    except asyncio.TimeoutError:
+                        pass
+                    pending = self.frames[position:]
+                    finished = self.done
+                if not pending and not finished:
+                    if await request.is_disconnected():
+                        return
+                    continue
+                for frame in pending:
+                    yield frame
+                position += len(pending)
+                if finished and position >= len(self.frames):
+                    return
+        finally:
+            self.subscribers -= 1
+            if not self.subscribers and not self.done:
+                self._arm_abandon_check()
+
+
+_runs: Dict[str, StreamRun] = {}
+
+
+def _evict_runs():
+    """Drops finished runs past their TTL, then the oldest finished runs over MAX_RUNS."""
+    now = time.monotonic()
+    finished = sorted(
+        (run for run in _runs.values() if run.done), key=lambda run: run.finished_at
+    )
+    for run in finished:
+        if now - run.finished_at > RUN_TTL_SECONDS or len(_runs) > MAX_RUNS:
+            del _runs[run.id]
+
+
+def start_run(
+    events: AsyncIterator[bytes], kind: str, finish_in_background: bool = False
+) -> StreamRun:
+    """
+    Starts consuming an SSE event generator in the background.
+
+    Args:
+        events (AsyncIterator[bytes]): Events framed by an SSEEmitter.
+        kind (str): What the run produces, e.g. "generate".
+        finish_in_background (bool, optional): Keep running when no client
+            follows the run. Defaults to False.
+
+    Returns:
+        StreamRun: The run; stream `run.subscribe()` to the client.
+    """
+    _evict_runs()
+    run = StreamRun(uuid.uuid4().hex, kind, finish_in_background)
+    _runs[run.id] = run
+    run.task = asyncio.create_task(run._produce(events))
+    # Also covers clients that disconnect before subscribing
+    run._arm_abandon_check()
+    return run
+
+
+def get_run(run_id: str) -> Optional[StreamRun]:
+    """Returns a run still held in this process, or None."""
+    return _runs.get(run_id)
+
+
+async def resume_run(
+    run_id: str, last_event_id: int = 0, request: Optional[Request] = None
+) -> Optional[AsyncIterator[bytes]]:
+    """
+    Resumes a run after the last event a client received.
+
+    Args:
+        run_id (str): The run id.
+        last_event_id (int, optional): The client's `Last-Event-ID`.
+        request (Request, optional): The reconnecting request, to notice when
+            its client disconnects again.
+
+    Returns:
+        Optional[AsyncIterator[bytes]]: The missed and upcoming events, or None if
+        the run is unknown or expired.
+    """
+    run = get_run(run_id)
+    if run is not None:
+        return run.subscribe(last_event_id, request)
+    if RUN_PERSIST and await _persisted_run_exists(run_id):
+        return _persisted_events(run_id, last_event_id)
+    return None
+
+
+async def _try_persist(write, *args) -> bool:
+    """Runs a persistence write, returning False instead of raising on failure."""
+    try:
+        await write(*args)
+        return True
+    except Exception as e:
+        print(f"Could not persist stream run: {e}")
+        return False
+
+
+async def _persist_start(run: StreamRun):
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        await conn.execute(
+            "INSERT INTO stream_runs (id, kind) VALUES ($1, $2)", run.id, run.kind
+        )
+
+
+async def _persist_frame(run: StreamRun, frame: bytes):
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        await conn.execute(
+            """
+            WITH event AS (
+                INSERT INTO stream_run_events (run_id, event_id, frame)
+                VALUES ($1, $2, $3)
+                ON CONFLICT DO NOTHING
+            )
+            UPDATE stream_runs SET updated_at = CURRENT_TIMESTAMP WHERE id = $1
+            """,
+            run.id,
+            _event_id(frame),
+            frame.decode(),
+        )
+
+
+async def _persist_finish(run: StreamRun):
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        await conn.execute(
+            """
+            UPDATE stream_runs SET status = $2, updated_at = CURRENT_TIMESTAMP
+            WHERE id = $1
+            """,
+            run.id,
+            "cancelled" if run.cancelled else "finished",
+        )
+
+
+async def _persisted_run_exists(run_id: str) -> bool:
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        return bool(
+            await conn.fetchval("SELECT 1 FROM stream_runs WHERE id = $1", run_id)
+        )
+
+
+async def _persisted_run_followed(run_id: str) -> bool:
+    """Whether a client in another process followed the run within the grace period."""
+    try:
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            return bool(
+                await conn.fetchval(
+                    """
+                    SELECT CURRENT_TIMESTAMP - followed_at <= make_interval(secs => $2)
+                    FROM stream_runs WHERE id = $1
+                    """,
+                    run_id,
+                    RUN_ABANDON_SECONDS,
+                )
+            )
+    except Exception as e:
+        # Assume it is followed; the run is checked again after the grace period
+        print(f"Could not check followers of stream run {run_id}: {e}")
+        return True
+
+
+async def _persisted_events(run_id: str, last_event_id: int) -> AsyncIterator[bytes]:
+    """Replays and follows a run written to Postgres by another process."""
+    pool = await get_pool()
+    heartbeat = None
+    while True:
+        async with pool.acquire() as conn:
+            # Tell the producing process the run is still followed
+            if heartbeat is None or (
+                time.monotonic() - heartbeat >= PERSIST_HEARTBEAT_SECONDS
+            ):
+                await conn.execute(
+                    """
+                    UPDATE stream_runs SET followed_at = CURRENT_TIMESTAMP
+                    WHERE id = $1 AND status = 'running'
+                    """,
+                    run_id,
+                )
+                heartbeat = time.monotonic()
+            # Status first: a run no longer running has written all of its events
+            status = await conn.fetchrow(
+                """
+                SELECT status,
+                       CURRENT_TIMESTAMP - updated_at > make_interval(secs => $2) AS idle
+                FROM stream_runs WHERE id = $1
+                """,
+                run_id,
+                PERSIST_IDLE_SECONDS,
+            )
+            rows = await conn.fetch(
+                """
+                SELECT event_id, frame FROM stream_run_events
+                WHERE run_id = $1 AND event_id > $2
+                ORDER BY event_id
+                """,
+                run_id,
+                last_event_id,
+            )
+        for row in rows:
+            last_event_id = row["event_id"]
+            yield row["frame"].encode()
+        if rows:
+            continue
+        if status is None or status["status"] != "running" or status["idle"]:
+            return
+        await asyncio.sleep(PERSIST_POLL_SECONDS)
@@ -0,0 +1,120 @@
+"""
+Token estimates from file sizes, for cost previews that must not download files.
+
+The GitHub tree API reports every blob's size in bytes. Token counts are estimated
+from it with a bytes-per-token ratio per file extension: a default for each
+extension, calibrated as files are actually tokenized (`observe`). Each
+extension's ratio starts as `PRIOR_TOKENS` worth of observations at the default
+and moves towards the measured ratio as real counts accumulate.
+
+Calibration is kept per worker process and starts over on restart. A file read
+from the same source (e.g. a snapshot previewed again and again) is only observed
+once, so that one repository does not skew the ratios.
+"""
+
+import os
+from collections import OrderedDict, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+# Typical o200k_base bytes per token; prose packs more bytes per token than code,
+# data formats and lock files fewer
+DEFAULT_BYTES_PER_TOKEN = 3.8
+EXTENSION_BYTES_PER_TOKEN = {
+    ".md": 4.4,
+    ".rst": 4.4,
+    ".txt": 4.4,
+    ".py": 3.9,
+    ".rb": 3.9,
+    ".java": 4.0,
+    ".kt": 3.9,
+    ".scala": 3.9,
+    ".go": 3.6,
+    ".rs": 3.6,
+    ".php": 3.6,
+    ".swift": 3.7,
+    ".c": 3.5,
+    ".h": 3.5,
+    ".cpp": 3.5,
+    ".js": 3.6,
+    ".jsx": 3.5,
+    ".ts": 3.6,
+    ".tsx": 3.5,
+    ".html": 3.2,
+    ".css": 3.2,
+    ".sh": 3.5,
+    ".json": 3.0,
+    ".yaml": 3.4,
+    ".yml": 3.4,
+    ".toml": 3.4,
+    ".xml": 3.0,
+    ".lock": 2.6,
+}
+
+# Weight of the default ratio, in tokens, against observed counts
+PRIOR_TOKENS = 20_000
+
+# How many (source, path) pairs already observed are remembered
+OBSERVED_FILES_SIZE = 65536
+
+# extension -> [bytes, tokens] observed
+_observed: Dict[str, List[int]] = defaultdict(lambda: [0, 0])
+_observed_files: "OrderedDict[Tuple[str, str], None]" = OrderedDict()
+
+
+def _extension(path: str) -> str:
+    return os.path.splitext(path)[1].lower()
+
+
+def bytes_per_token(path: str) -> float:
+    """
+    Returns the calibrated bytes-per-token ratio for a file's extension.
+
+    Args:
+        path (str): The file path.
+
+    Returns:
+        float: Bytes per token.
+    """
+    extension = _extension(path)
+    default = EXTENSION_BYTES_PER_TOKEN.get(extension, DEFAULT_BYTES_PER_TOKEN)
+    observed_bytes, observed_tokens = _observed.get(extension, (0, 0))
+    return (default * PRIOR_TOKENS + observed_bytes) / (PRIOR_TOKENS + observed_tokens)
+
+
+def estimate_tokens(path: str, size: int) -> int:
+    """
+    Estimates the tokens of a file from its size.
+
+    Args:
+        path (str): The file path.
+        size (int): The file size in bytes.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    return round(size / bytes_per_token(path))
+
+
+def observe(path: str, size: int, tokens: int, source: Optional[str] = None):
+    """
+    Calibrates the ratio of a file's extension with an exact token count.
+
+    Args:
+        path (str): The file path.
+        size (int): The file size in bytes.
+        tokens (int): The file's token count.
+        source (str, optional): What the file was read from, e.g. a snapshot id.
+            Each path of a source is only observed once.
+    """
+    if source is not None:
+        key = (source, path)
+        if key in _observed_files:
+            _observed_files.move_to_end(key)
+            return
+        _observed_files[key] = None
+        while len(_observed_files) > OBSERVED_FILES_SIZE:
+            _observed_files.popitem(last=False)
+    if size and tokens:
+        observed = _observed[_extension(path)]
+        observed[0] += size
+        observed[1] += tokens
@@ -0,0 +1,245 @@
+"""
+Shared tiktoken encoding for token counting and token-exact truncation.
+
+Loading an encoding is expensive, so it is created once per process and reused by
+every caller. The encoding matches the one used by o4-mini so counts line up with
+what the API bills.
+
+Counting is the expensive part for large inputs (file trees, READMEs, repository
+files), so:
+- Counts of texts of at least `TOKEN_CACHE_MIN_CHARS` are cached by content hash,
+  keeping the `TOKEN_CACHE_SIZE` most recently used.
+- Large texts are split into pieces at boundaries the encoding never merges across
+  (a newline followed by anything but whitespace or "/"), and the pieces are
+  encoded in a thread pool; tiktoken releases the GIL while encoding.
+  `count_tokens_batch` does the same for many texts at once.
+- `token_upper_bound` bounds a count without encoding at all, and `limit` stops
+  counting as soon as a text is known to exceed it.
+"""
+
+import asyncio
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import List, Optional
+
+import tiktoken
+
+ENCODING_NAME = "o200k_base"
+
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "1024"))
+TOKEN_CACHE_MIN_CHARS = 4096
+TOKENIZER_THREADS = int(
+    os.getenv("TOKENIZER_THREADS", str(min(os.cpu_count() or 1, 8)))
+)
+# Texts longer than this are split into pieces of about PIECE_CHARS
+PARALLEL_MIN_CHARS = 128 * 1024
+PIECE_CHARS = 32 * 1024
+
+# A newline followed by anything but whitespace or "/" always ends a pre-token of
+# the o200k_base pattern (only whitespace runs and the punctuation pattern's
+# [\r\n/]* suffix reach past a newline), so the pieces encode to the same tokens
+_PIECE_BOUNDARY = re.compile(r"\n(?=[^\s/])")
+
+_executor = ThreadPoolExecutor(TOKENIZER_THREADS, thread_name_prefix="tokenizer")
+_cache: "OrderedDict[bytes, int]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
+def get_encoding() -> tiktoken.Encoding:
+    """
+    Returns the process-wide tiktoken encoding.
+
+    Returns:
+        tiktoken.Encoding: The o200k_base encoding
+    """
+    return tiktoken.get_encoding(ENCODING_NAME)
+
+
+def token_upper_bound(text: str) -> int:
+    """
+    Bounds the token count of a string without encoding it.
+
+    Every token covers at least one byte, so the UTF-8 length is an upper bound
+    (typically about four times the count).
+
+    Args:
+        text (str): The text
+
+    Returns:
+        int: A number of tokens the text cannot exceed
+    """
+    if text.isascii():
+        return len(text)
+    return len(text.encode("utf-8", errors="surrogatepass"))
+
+
+def _split(text: str) -> List[str]:
+    """Splits a text into pieces that encode to the same tokens as the whole."""
+    pieces = []
+    start = 0
+    while len(text) - start > PIECE_CHARS:
+        boundary = _PIECE_BOUNDARY.search(text, start + PIECE_CHARS)
+        if boundary is None:
+            break
+        pieces.append(text[start : boundary.end()])
+        start = boundary.end()
+    pieces.append(text[start:])
+    return pieces
+
+
+def _encode_length(text: str) -> int:
+    # Same as encode(text, disallowed_special=()): special tokens count as text
+    return len(get_encoding().encode_ordinary(text))
+
+
+def _cache_key(text: str) -> Optional[bytes]:
+    if len(text) < TOKEN_CACHE_MIN_CHARS:
+        return None
+    return hashlib.blake2b(
+        text.encode("utf-8", errors="surrogatepass"), digest_size=16
+    ).digest()
+
+
+def _cache_get(key: Optional[bytes]) -> Optional[int]:
+    if key is None:
+        return None
+    with _cache_lock:
+        tokens = _cache.get(key)
+        if tokens is not None:
+            _cache.move_to_end(key)
+        return tokens
+
+
+def _cache_put(key: Optional[bytes], tokens: int):
+    if key is None:
+        return
+    with _cache_lock:
+        _cache[key] = tokens
+        _cache.move_to_end(key)
+        while len(_cache) > TOKEN_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def count_tokens(text: str, limit: Optional[int] = None) -> int:
+    """
+    Counts the number of tokens in a string.
+
+    Special-token markers (e.g. ``<|endoftext|>``) that appear in repository files
+    are encoded as ordinary text instead of raising.
+
+    Args:
+        text (str): The text to count tokens for
+        limit (int, optional): Stop counting once the count exceeds this; the
+            result is then only known to be over the limit
+
+    Returns:
+        int: The number of tokens, or a number above `limit` if the text exceeds it
+    """
+    key = _cache_key(text)
+    tokens = _cache_get(key)
+    if tokens is not None:
+        return tokens
+
+    if len(text) < PARALLEL_MIN_CHARS:
+        tokens = _encode_length(text)
+    else:
+        pieces = _split(text)
+        if limit is None or token_upper_bound(text) <= limit:
+            tokens = sum(_executor.map(_encode_length, pieces))
+        else:
+            # Encode a round of pieces at a time, stopping once over the limit
+            tokens = 0
+            for start in range(0, len(pieces), TOKENIZER_THREADS):
+                batch = pieces[start : start + TOKENIZER_THREADS]
+                tokens += sum(_executor.map(_encode_length, batch))
+                if tokens > limit and start + len(batch) < len(pieces):
+                    return tokens
+
+    _cache_put(key, tokens)
+    return tokens
+
+
+def count_tokens_batch(texts: List[str]) -> List[int]:
+    """
+    Counts the tokens of many strings, encoding them in the tokenizer thread pool.
+
+    Args:
+        texts (List[str]): The texts to count tokens for
+
+    Returns:
+        List[int]: The number of tokens of each text
+    """
+    keys = [_cache_key(text) for text in texts]
+    counts = [_cache_get(key) for key in keys]
+
+    # Large texts are split so that one of them does not hold up the batch
+    pieces, owners = [], []
+    for i, text in enumerate(texts):
+        if counts[i] is None:
+            split = _split(text) if len(text) >= PARALLEL_MIN_CHARS else [text]
+            pieces.extend(split)
+            owners.extend([i] * len(split))
+            counts[i] = 0
+
+    for owner, tokens in zip(owners, _executor.map(_encode_length, pieces)):
+        counts[owner] += tokens
+    for i in set(owners):
+        _cache_put(keys[i], counts[i])
+    return counts
+
+
+async def count_tokens_async(text: str, limit: Optional[int] = None) -> int:
+    """
+    Counts the tokens of a string off the event loop; see `count_tokens`.
+
+    Args:
+        text (str): The text to count tokens for
+        limit (int, optional): Stop counting once the count exceeds this
+
+    Returns:
+        int: The number of tokens, or a number above `limit` if the text exceeds it
+    """
+    if len(text) < TOKEN_CACHE_MIN_CHARS:
+        return count_tokens(text)
+    return await asyncio.to_thread(count_tokens, text, limit)
+
+
+async def count_tokens_batch_async(texts: List[str]) -> List[int]:
+    """
+    Counts the tokens of many strings off the event loop; see `count_tokens_batch`.
+
+    Args:
+        texts (List[str]): The texts to count tokens for
+
+    Returns:
+        List[int]: The number of tokens of each text
+    """
+    if sum(len(text) for text in texts) < TOKEN_CACHE_MIN_CHARS:
+        return [count_tokens(text) for text in texts]
+    return await asyncio.to_thread(count_tokens_batch, texts)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    Truncates a string to at most `max_tokens` tokens.
+
+    Args:
+        text (str): The text to truncate
+        max_tokens (int): The maximum number of tokens to keep
+
+    Returns:
+        str: The text unchanged if it fits, otherwise its first `max_tokens` tokens
+    """
+    if token_upper_bound(text) <= max_tokens:
+        return text
+    encoding = get_encoding()
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[: max(max_tokens, 0)])
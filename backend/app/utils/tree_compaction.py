@@ -0,0 +1,295 @@
+"""
+Compaction of repository file trees that are too large to send to the LLM whole.
+
+A file tree (one path per line, as produced by `github.format_file_tree`) is
+rebuilt as a directory hierarchy and rendered within a token budget:
+- Small directories are listed in full, exactly as in the original tree.
+- Directories that do not fit their share of the budget are expanded one level
+  (their own entry, their files and a share of the budget for each
+  subdirectory), or, when even that does not fit, collapsed into one summary line
+  with the number of files per extension and a few representative files:
+  ``packages/web/ [1,204 files: 812 .tsx, 301 .ts, 91 other; e.g. ...]``
+- Directories with more files than fit are listed with their representative
+  files and a summary of the rest.
+
+The budget is shared between the subdirectories of a directory by water-filling:
+the smallest are listed in full first, and the rest split what is left equally.
+Every line keeps its full path, so phases that link diagram nodes to paths keep
+working on summarized directories.
+"""
+
+import os
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from app.utils.tokenizer import count_tokens, truncate_to_tokens
+
+# Extensions named in a summary line; the rest are counted as "other"
+SUMMARY_EXTENSIONS = 4
+REPRESENTATIVE_FILES = 3
+# Preferred representatives, by file name without extension
+REPRESENTATIVE_NAMES = (
+    "readme",
+    "package",
+    "pyproject",
+    "cargo",
+    "go",
+    "main",
+    "index",
+    "app",
+    "mod",
+    "lib",
+    "__init__",
+)
+# Tokens of a summary line besides its paths
+SUMMARY_TOKENS = 20
+# Attempts at fitting the exact token count after rendering by estimated costs
+MAX_ATTEMPTS = 4
+
+
+class _Node:
+    """A path of the tree; a directory if it has children."""
+
+    __slots__ = ("path", "children", "listed", "full_cost", "line_cost")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.children: Dict[str, "_Node"] = {}
+        # Whether the path has its own line in the original tree
+        self.listed = False
+        # Cost of listing the subtree in full
+        self.full_cost = 0.0
+        self.line_cost = 0.0
+
+
+def _build(paths: List[str], tokens_per_char: float) -> _Node:
+    root = _Node("")
+    for path in paths:
+        node = root
+        for part in path.split("/"):
+            child = node.children.get(part)
+            if child is None:
+                child_path = f"{node.path}/{part}" if node.path else part
+                child = node.children[part] = _Node(child_path)
+            node = child
+        node.listed = True
+        node.line_cost = (len(path) + 1) * tokens_per_char
+
+    # Post-order pass for the subtree costs
+    stack = [(root, False)]
+    while stack:
+        node, visited = stack.pop()
+        if not visited:
+            stack.append((node, True))
+            stack.extend((child, False) for child in node.children.values())
+            continue
+        for child in node.children.values():
+            node.full_cost += child.line_cost * child.listed + child.full_cost
+    return root
+
+
+def _rank(path: str) -> Tuple[int, int, int]:
+    """Well-known entry points and manifests first, then the shallowest files."""
+    stem = os.path.splitext(os.path.basename(path))[0].lower()
+    known = (
+        REPRESENTATIVE_NAMES.index(stem)
+        if stem in REPRESENTATIVE_NAMES
+        else len(REPRESENTATIVE_NAMES)
+    )
+    return (known, path.count("/"), len(path))
+
+
+def _representative(files: List[str]) -> List[str]:
+    return sorted(files, key=_rank)[:REPRESENTATIVE_FILES]
+
+
+def _subtree_files(node: _Node) -> List[str]:
+    files, stack = [], [node]
+    while stack:
+        current = stack.pop()
+        if current.children:
+            stack.extend(current.children.values())
+        else:
+            files.append(current.path)
+    return files
+
+
+def _summary(path: str, files: List[str], label: str = "files") -> str:
+    extensions = Counter(
+        os.path.splitext(file)[1].lower() or "(none)" for file in files
+    )
+    counts = [
+        f"{count:,} {extension}"
+        for extension, count in extensions.most_common(SUMMARY_EXTENSIONS)
+    ]
+    other = len(files) - sum(
+        count for _, count in extensions.most_common(SUMMARY_EXTENSIONS)
+    )
+    if other:
+        counts.append(f"{other:,} other")
+    examples = ", ".join(_representative(files))
+    return f"{path} [{len(files):,} {label}: {', '.join(counts)}; e.g. {examples}]"
+
+
+class _Renderer:
+    def __init__(self, tokens_per_char: float):
+        self.tokens_per_char = tokens_per_char
+
+    def cost(self, line: str) -> float:
+        return (len(line) + 1) * self.tokens_per_char
+
+    def summary_cost(self, path: str) -> float:
+        """Estimated cost of a summary line, which repeats a few paths."""
+        return self.cost(path) * (1 + REPRESENTATIVE_FILES) + SUMMARY_TOKENS
+
+    def collapsed(self, node: _Node) -> List[str]:
+        return [_summary(f"{node.path}/", _subtree_files(node))]
+
+    def expand_cost(self, node: _Node) -> float:
+        """Estimated minimum cost of expanding a directory one level."""
+        cost = node.line_cost * node.listed
+        files_cost = sum(
+            child.line_cost for child in node.children.values() if not child.children
+        )
+        cost += min(files_cost, self.summary_cost(node.path))
+        for child in node.children.values():
+            if child.children:
+                cost += self.summary_cost(child.path)
+        return cost
+
+    def render(self, node: _Node, budget: float) -> List[str]:
+        """Renders a directory's own line and its subtree within `budget`."""
+        if node.full_cost + node.line_cost * node.listed <= budget:
+            return self.full(node)
+        if node.path and self.expand_cost(node) > budget:
+            return self.collapsed(node)
+
+        lines = [node.path] if node.listed else []
+        budget -= node.line_cost * node.listed
+        files = [child for child in node.children.values() if not child.children]
+        directories = [child for child in node.children.values() if child.children]
+
+        # Files first: all of them if they fit next to the directories' summaries
+        directories_minimum = sum(
+            self.summary_cost(child.path) for child in directories
+        )
+        files_cost = sum(child.line_cost for child in files)
+        files_summary = None
+        if (
+            files_cost + directories_minimum > budget
+            and len(files) > REPRESENTATIVE_FILES
+        ):
+            # As many files as fit beside the summary, most representative first
+            available = budget - directories_minimum - self.summary_cost(node.path)
+            shown = set()
+            for index, child in enumerate(
+                sorted(files, key=lambda child: _rank(child.path))
+            ):
+                available -= child.line_cost
+                if available < 0 and index >= REPRESENTATIVE_FILES:
+                    break
+                shown.add(child.path)
+            rest = [child.path for child in files if child.path not in shown]
+            files_summary = _summary(
+                f"{node.path}/*" if node.path else "*", rest, "more files"
+            )
+            budget -= sum(self.cost(path) for path in shown)
+            budget -= self.cost(files_summary)
+        else:
+            shown = {child.path for child in files}
+            budget -= files_cost
+
+        # Water-filling: smallest directories first, each taking at most an equal
+        # share of what is left
+        rendered = {}
+        remaining = sorted(directories, key=lambda child: child.full_cost)
+        while remaining:
+            share = max(budget, 0) / len(remaining)
+            child = remaining.pop(0)
+            rendered[child.path] = self.render(child, share)
+            budget -= sum(self.cost(line) for line in rendered[child.path])
+
+        # Original order
+        for child in node.children.values():
+            if child.children:
+                lines.extend(rendered[child.path])
+            elif child.path in shown:
+                lines.append(child.path)
+        if files_summary:
+            lines.append(files_summary)
+        return lines
+
+    def full(self, node: _Node) -> List[str]:
+        lines, stack = [], [node]
+        while stack:
+            current = stack.pop()
+            if current.listed:
+                lines.append(current.path)
+            stack.extend(reversed(list(current.children.values())))
+        return lines
+
+
+def compact_file_tree(
+    file_tree: str, max_tokens: int, tokens: Optional[int] = None
+) -> str:
+    """
+    Compacts a file tree to at most `max_tokens` tokens.
+
+    Args:
+        file_tree (str): The file tree, one path per line.
+        max_tokens (int): The token budget.
+        tokens (int, optional): The tree's token count, if already known.
+
+    Returns:
+        str: The tree unchanged if it fits, otherwise its compacted rendering.
+    """
+    if tokens is None:
+        tokens = count_tokens(file_tree)
+    if tokens <= max_tokens or not file_tree:
+        return file_tree
+
+    tokens_per_char = tokens / len(file_tree)
+    root = _build(file_tree.split("\n"), tokens_per_char)
+    renderer = _Renderer(tokens_per_char)
+
+    # Line costs are estimates; shrink the budget until the exact count fits
+    budget = float(max_tokens)
+    for _ in range(MAX_ATTEMPTS):
+        compacted = "\n".join(renderer.render(root, budget))
+        compacted_tokens = count_tokens(compacted)
+        if compacted_tokens <= max_tokens:
+            return compacted
+        budget *= 0.95 * max_tokens / compacted_tokens
+    return truncate_to_tokens(compacted, max_tokens)
+
+
+def compact_repository_context(
+    file_tree: str, readme: str, max_tokens: int, readme_share: float = 0.3
+) -> Tuple[str, str]:
+    """
+    Fits a file tree and README into `max_tokens` tokens together.
+
+    The README keeps up to `readme_share` of the budget (more if the tree needs
+    less) and is truncated beyond that; the tree is compacted into the rest.
+
+    Args:
+        file_tree (str): The file tree, one path per line.
+        readme (str): The README.
+        max_tokens (int): The token budget for both.
+        readme_share (float, optional): The README's guaranteed share of the
+            budget. Defaults to 0.3.
+
+    Returns:
+        Tuple[str, str]: The file tree and README to use.
+    """
+    tree_tokens = count_tokens(file_tree)
+    readme_tokens = count_tokens(readme)
+    readme_budget = max(int(max_tokens * readme_share), max_tokens - tree_tokens)
+    if readme_tokens > readme_budget:
+        readme = truncate_to_tokens(readme, readme_budget)
+        readme_tokens = count_tokens(readme)
+    # One token for the newline joining them
+    file_tree = compact_file_tree(
+        file_tree, max_tokens - readme_tokens - 1, tokens=tree_tokens
+    )
+    return file_tree, readme
@@ -0,0 +1,74 @@
+import threading
+
+from app.services.github import GitHubService
+
+# Tree name -> its own level: (name, type); subtrees are named after their path
+LEVELS = {
+    "root": [("README.md", "blob"), ("lib", "tree"), ("src", "tree")],
+    "lib": [("a.py", "blob"), ("deep", "tree"), ("z.py", "blob")],
+    "deep": [("x.py", "blob"), ("y", "tree")],
+    "y": [("y.py", "blob")],
+    "src": [("main.py", "blob"), ("util", "tree")],
+    "util": [("u.py", "blob")],
+}
+SHAS = {name: f"{i + 1:040x}" for i, name in enumerate(LEVELS)}
+NAMES = {sha: name for name, sha in SHAS.items()}
+# Recursive listings GitHub truncates
+TRUNCATED = {"root", "lib"}
+
+
+def _listing(name, recursive, prefix=""):
+    for child, kind in LEVELS[name]:
+        yield prefix + child, kind, SHAS[child] if kind == "tree" else None
+        if recursive and kind == "tree":
+            yield from _listing(child, True, f"{prefix}{child}/")
+
+
+class StubService(GitHubService):
+    """Serves `LEVELS` instead of the git trees API, recording the reads."""
+
+    def __init__(self):
+        super().__init__()
+        self.reads = []
+        self.lock = threading.Lock()
+
+    def _read_tree(
+        self, username, repo, ref, githubAccessToken, tree, recursive=True, prefix=""
+    ):
+        name = "root" if ref == "HEAD" else NAMES[ref]
+        with self.lock:
+            self.reads.append((name, recursive, prefix))
+        for path, kind, sha in _listing(name, recursive):
+            tree.add(prefix + path, kind, 1, sha)
+        return recursive and name in TRUNCATED
+
+
+def test_untruncated_tree_is_read_once():
+    service = StubService()
+    tree = service._fetch_tree("o", "r", SHAS["src"], None)
+    assert tree.to_text().split("\n") == ["main.py", "util", "util/u.py"]
+    assert service.reads == [("src", True, "")]
+
+
+def test_truncated_tree_is_walked():
+    service = StubService()
+    tree = service._fetch_tree("o", "r", "HEAD", None)
+
+    # Git's order within each directory, whatever the order of the reads
+    expected = [path for path, _, _ in _listing("root", True)]
+    assert tree.to_text().split("\n") == expected
+    assert len(tree) == len(expected)
+    assert tree.kind("lib/deep") == "tree"
+    assert tree.kind("lib/deep/y/y.py") == "blob"
+    assert list(tree.entries("lib", recursive=False))[1].sha == SHAS["deep"]
+
+    # The truncated root is listed level by level and its subtrees recursively;
+    # the truncated lib/ is then listed level by level in turn
+    assert service.reads[0] == ("root", True, "")
+    assert sorted(service.reads[1:]) == [
+        ("deep", True, "lib/deep/"),
+        ("lib", False, "lib/"),
+        ("lib", True, "lib/"),
+        ("root", False, ""),
+        ("src", True, "src/"),
+    ]
@@ -0,0 +1,121 @@
+import json
+
+import pytest
+
+from app.utils import json_stream
+from app.utils.json_stream import iter_array
+
+TREE = {
+    "sha": "a" * 40,
+    "url": "https://api.github.com/repos/o/r/git/trees/a",
+    "tree": [
+        {"path": "README.md", "type": "blob", "size": 120, "sha": "b" * 40},
+        {"path": "src", "type": "tree", "sha": "c" * 40},
+        {"path": "src/naïve café.py", "type": "blob", "size": 0, "sha": "d" * 40},
+        {"path": "docs/日本語/🚀.md", "type": "blob", "size": 98765, "sha": "e" * 40},
+        {"path": 'quotes "and" \\ escapes\n', "type": "blob", "size": 7, "sha": "f"},
+        {"path": "nested", "extra": [1, [2.5, -3e2], {"x": None, "y": True}]},
+    ],
+    "truncated": False,
+}
+
+
+@pytest.fixture(autouse=True, params=[1, json_stream._READ_CHARS])
+def read_chars(request, monkeypatch):
+    # Reading one character at a time puts every chunk boundary at the end of
+    # the buffer, instead of batching small chunks together
+    monkeypatch.setattr(json_stream, "_READ_CHARS", request.param)
+
+
+def _chunks(data: bytes, size: int):
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+def _decode(document, size: int):
+    rest = {}
+    items = list(iter_array(_chunks(json.dumps(document).encode(), size), "tree", rest))
+    return items, rest
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7, 64, 1 << 20])
+def test_chunk_boundaries(size):
+    # Chunks of one byte split every string, escape, number and multi-byte
+    # character
+    items, rest = _decode(TREE, size)
+    assert items == TREE["tree"]
+    assert rest == {"sha": TREE["sha"], "url": TREE["url"], "truncated": False}
+
+
+def test_large_array():
+    document = {
+        "tree": [{"path": f"dir/{i}/file.py", "size": i} for i in range(20000)],
+        "truncated": True,
+    }
+    items, rest = _decode(document, 1000)
+    assert items == document["tree"]
+    assert rest == {"truncated": True}
+
+
+def test_members_after_the_array():
+    document = {"tree": [{"path": "a"}], "truncated": True, "sha": "x"}
+    items, rest = _decode(document, 3)
+    assert items == [{"path": "a"}]
+    assert rest == {"truncated": True, "sha": "x"}
+
+
+def test_rest_is_complete_only_once_exhausted():
+    rest = {}
+    items = iter_array([json.dumps(TREE).encode()], "tree", rest)
+    next(items)
+    assert "truncated" not in rest
+    list(items)
+    assert rest["truncated"] is False
+
+
+@pytest.mark.parametrize("size", [1, 4, 100])
+def test_scalars_split_across_chunks(size):
+    document = {"tree": [1234567890, -0.5e-10, True, False, None, 0], "n": 98765}
+    items, rest = _decode(document, size)
+    assert items == document["tree"]
+    assert rest == {"n": 98765}
+
+
+def test_scalar_before_closing_brace():
+    # Only the closing brace tells that the last digit has arrived
+    rest = {}
+    data = b'{"tree": [12, 345], "truncated": 1}'
+    assert list(iter_array(_chunks(data, 1), "tree", rest)) == [12, 345]
+    assert rest == {"truncated": 1}
+
+
+@pytest.mark.parametrize("data", [b'{"tree": []}', b'{ "tree" : [ ] , "n" : 1 }'])
+def test_empty_array(data):
+    assert list(iter_array(_chunks(data, 1), "tree", {})) == []
+
+
+def test_whitespace_between_tokens():
+    data = b'\n{\n  "tree" : [\n    {"path": "a"} ,\n\t{"path": "b"}\n  ]\n}\n'
+    items = list(iter_array(_chunks(data, 2), "tree", {}))
+    assert items == [{"path": "a"}, {"path": "b"}]
+
+
+def test_missing_key():
+    rest = {}
+    assert list(iter_array([b'{"message": "Not Found"}'], "tree", rest)) == []
+    assert rest == {"message": "Not Found"}
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"",
+        b"[1, 2]",
+        b'{"tree": {"path": "a"}}',
+        b'{"tree": [{"path": "a"}',
+        b'{"tree": [{"path": "a}]}',
+        b'{"tree" [1]}',
+    ],
+)
+def test_malformed_input(data):
+    with pytest.raises(ValueError):
+        list(iter_array(_chunks(data, 3), "tree", {}))
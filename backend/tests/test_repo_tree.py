@@ -0,0 +1,147 @@
+import struct
+import zlib
+
+from app.utils import repo_tree
+from app.utils.repo_tree import RepoTree, TreeEntry
+
+SHA = "0123456789abcdef0123456789abcdef01234567"
+
+
+def _paths(tree, **kwargs):
+    return [entry.path for entry in tree.entries(**kwargs)]
+
+
+def test_parents_that_were_never_added():
+    tree = RepoTree()
+    tree.add("a/b/c.py", "blob", 12, SHA)
+
+    assert len(tree) == 1
+    assert tree.kind("a/b/c.py") == "blob"
+    assert tree.is_file("a/b/c.py")
+    # Implied directories can be looked up, but are not paths of the tree
+    assert tree.kind("a") == "tree"
+    assert tree.is_dir("a/b")
+    assert tree.is_dir("/a/b/")
+    assert "a/b" not in tree
+    assert "a/b/c.py" in tree
+    assert tree.to_text() == "a/b/c.py"
+
+    assert tree.kind("a/c") is None
+    assert tree.kind("a/b/c.py/d") is None
+    assert not tree.is_dir("a/b/c.py")
+
+    # Listing the directory later keeps its place
+    tree.add("a", "tree")
+    assert len(tree) == 2
+    assert "a" in tree
+    assert tree.to_text() == "a\na/b/c.py"
+
+
+def test_to_text_keeps_insertion_order():
+    paths = ["z.py", "a", "a/x.py", "b.py", "a/w.py", "a/sub", "a/sub/v.py", "0.py"]
+    tree = RepoTree()
+    for path in paths:
+        tree.add(path, "tree" if path in ("a", "a/sub") else "blob")
+    # Depth first, each directory's children in the order they were added
+    assert tree.to_text().split("\n") == [
+        "z.py",
+        "a",
+        "a/x.py",
+        "a/w.py",
+        "a/sub",
+        "a/sub/v.py",
+        "b.py",
+        "0.py",
+    ]
+    assert _paths(tree) == tree.to_text().split("\n")
+
+
+def test_entries():
+    tree = RepoTree(
+        [
+            TreeEntry("README.md", 10, SHA, "blob"),
+            TreeEntry("src", 0, SHA, "tree"),
+            TreeEntry("src/main.py", 20, "", "blob"),
+            TreeEntry("src/lib", 0, "", "tree"),
+            TreeEntry("src/lib/util.py", 30, "", "blob"),
+            TreeEntry("vendor", 0, "", "commit"),
+        ]
+    )
+    assert _paths(tree, recursive=False) == ["README.md", "src", "vendor"]
+    assert _paths(tree, path="src", recursive=False) == ["src/main.py", "src/lib"]
+    assert _paths(tree, path="/src/") == ["src/main.py", "src/lib", "src/lib/util.py"]
+    assert _paths(tree, path="missing") == []
+    assert list(tree.entries("src/lib", recursive=False)) == [
+        TreeEntry("src/lib/util.py", 30, "", "blob")
+    ]
+    assert next(iter(tree)) == TreeEntry("README.md", 10, SHA, "blob")
+    assert tree.kind("vendor") == "commit"
+
+
+def test_many_paths():
+    # Enough nodes to grow the hash table several times
+    tree = RepoTree()
+    paths = [f"dir{i % 37}/sub{i % 11}/file{i}.py" for i in range(5000)]
+    for path in paths:
+        tree.add(path)
+    assert len(tree) == len(paths)
+    assert all(tree.is_file(path) for path in paths)
+    assert tree.is_dir("dir36/sub10")
+    assert tree.kind("dir37") is None
+
+
+def test_bytes_round_trip():
+    tree = RepoTree()
+    tree.add("docs", "tree", 0, SHA)
+    tree.add("docs/日本語.md", "blob", 2**40, SHA)
+    tree.add("src/app.py", "blob", 5)
+    tree.add("lib", "commit", 0, SHA)
+
+    restored = RepoTree.from_bytes(tree.to_bytes())
+    assert list(restored) == list(tree)
+    assert restored.to_text() == tree.to_text()
+    assert len(restored) == len(tree)
+    assert restored.is_dir("src") and "src" not in restored
+    assert restored.kind("lib") == "commit"
+
+    # A restored tree can still be added to, in order
+    restored.add("src/b.py")
+    restored.add("docs/a.md")
+    assert restored.to_text().split("\n") == [
+        "docs",
+        "docs/日本語.md",
+        "docs/a.md",
+        "src/app.py",
+        "src/b.py",
+        "lib",
+    ]
+
+
+def test_empty_tree_round_trip():
+    restored = RepoTree.from_bytes(RepoTree().to_bytes())
+    assert len(restored) == 0
+    assert restored.to_text() == ""
+    restored.add("a.py")
+    assert restored.to_text() == "a.py"
+
+
+def test_bytes_are_little_endian():
+    tree = RepoTree()
+    tree.add("a/b", "blob", 258)
+    data = zlib.decompress(tree.to_bytes())
+    count, names_length = struct.unpack_from("<qq", data)
+    assert (count, names_length) == (3, 3)
+    offset = struct.calcsize("<qq")
+    assert struct.unpack_from("<3i", data, offset) == (-1, 0, 1)
+    offset += 3 * 4 + 3
+    assert struct.unpack_from("<3q", data, offset) == (0, 0, 258)
+
+
+def test_round_trip_with_swapped_bytes(monkeypatch):
+    # What a big-endian machine does on both ends
+    monkeypatch.setattr(repo_tree, "_SWAP_BYTES", True)
+    tree = RepoTree()
+    tree.add("a/b", "blob", 258, SHA)
+    restored = RepoTree.from_bytes(tree.to_bytes())
+    assert list(restored) == list(tree)
+    assert restored.is_dir("a")
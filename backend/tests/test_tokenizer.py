@@ -0,0 +1,60 @@
+"""
+Split encoding must give the exact count of encoding the whole text.
+
+`_PIECE_BOUNDARY` relies on the o200k_base pre-tokenizer never merging across a
+newline followed by anything but whitespace or "/"; these tests check it against
+the encoding itself, so a new tiktoken or encoding that breaks it fails here.
+"""
+
+import pytest
+
+from app.utils import tokenizer
+
+
+@pytest.fixture(scope="module")
+def encoding():
+    try:
+        return tokenizer.get_encoding()
+    except Exception as e:  # The encoding is downloaded on first use
+        pytest.skip(f"{tokenizer.ENCODING_NAME} is not available: {e}")
+
+
+def _mixed_text() -> str:
+    """Code, prose, markup and non-ASCII text, with every kind of line start."""
+    blocks = [
+        "def add(a, b):\n    return a + b\n\n\n",
+        "// comment\n/* block */\n//path/to/file\n",
+        "Some prose, with punctuation!? And numbers: 12345, 3.14159.\n",
+        "# Heading\n\n- item one\n- item two\n  - nested\n\n",
+        "日本語のテキストと中文文本。\n한국어 문장입니다.\n",
+        "emoji 🚀🔥 and accents: café naïve résumé\n",
+        "\tindented with tabs\n\r\nwindows line\r\n",
+        "src/app/main.py\nsrc/app/utils/__init__.py\n",
+        '{"key": [1, 2, 3], "nested": {"a": null}}\n',
+        "<|endoftext|> special markers as text\n",
+        "    \n   \n\n\n\nwhitespace runs\n",
+        "'quoted'\n\"double\"\n)]}\n...\n",
+    ]
+    text = "".join(f"{i % 97}: {block}" for i, block in enumerate(blocks * 400))
+    assert len(text) > tokenizer.PARALLEL_MIN_CHARS
+    return text
+
+
+def test_split_count_matches_whole_text(encoding):
+    text = _mixed_text()
+    assert len(tokenizer._split(text)) > 1
+    assert tokenizer.count_tokens(text) == len(encoding.encode_ordinary(text))
+
+
+def test_split_pieces_rejoin():
+    text = _mixed_text()
+    assert "".join(tokenizer._split(text)) == text
+
+
+def test_batch_count_matches_whole_text(encoding):
+    text = _mixed_text() + "tail without newline"
+    small = "hello world"
+    assert tokenizer.count_tokens_batch([text, small]) == [
+        len(encoding.encode_ordinary(text)),
+        len(encoding.encode_ordinary(small)),
+    ]
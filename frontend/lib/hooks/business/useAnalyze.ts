@@ -1,4 +1,4 @@
-import { useState, useCallback } from "react";
+import { useState, useCallback, useRef } from "react";
 import { fetchFileTree, fetchFile } from "../../utils/api/fetchFile";
 
 interface StreamState {
@@ -22,6 +22,8 @@ interface StreamResponse {
   chunk?: string;
   response?: string;
   error?: string;
+  snapshot_id?: string;
+  session_id?: string;
 }
 
 export function useAnalyze() {
@@ -29,6 +31,11 @@ export function useAnalyze() {
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState<string | null>(null);
   const [response, setResponse] = useState<string>("");
+  // Server-side snapshot ids keyed by owner/repo@branch, so follow-up questions
+  // send only the id instead of every file
+  const snapshotIds = useRef<Record<string, string>>({});
+  // Server-side conversation ids, so follow-up questions keep their history
+  const sessionIds = useRef<Record<string, string>>({});
 
   // Accept repo info, question, and selectedFilePath
   const analyzeRepoWithRAG = useCallback(
@@ -53,29 +60,38 @@ export function useAnalyze() {
       setState({ status: "idle", message: "Preparing analysis..." });
 
       try {
-        // 1. Get file tree
-        setState({
-          status: "idle",
-          message: "Fetching repository files...",
-        });
-        const files = await fetchFileTree({ accessToken, owner, repo, branch });
-
-        // 2. Fetch contents for each file (in parallel)
-        setState({ status: "idle", message: "Loading file contents..." });
-        const fileContents = await Promise.all(
-          files.map(async (file: any) => {
-            const content = await fetchFile({
-              accessToken,
-              owner,
-              repo,
-              branch,
-              filePath: file.path,
-            });
-            return content ? { path: file.path, content } : null;
-          })
-        );
-
-        const validFiles = fileContents.filter(Boolean);
+        const snapshotKey = `${owner}/${repo}@${branch}`;
+
+        const loadFiles = async () => {
+          // 1. Get file tree
+          setState({
+            status: "idle",
+            message: "Fetching repository files...",
+          });
+          const files = await fetchFileTree({
+            accessToken,
+            owner,
+            repo,
+            branch,
+          });
+
+          // 2. Fetch contents for each file (in parallel)
+          setState({ status: "idle", message: "Loading file contents..." });
+          const fileContents = await Promise.all(
+            files.map(async (file: any) => {
+              const content = await fetchFile({
+                accessToken,
+                owner,
+                repo,
+                branch,
+                filePath: file.path,
+              });
+              return content ? { path: file.path, content } : null;
+            })
+          );
+
+          return fileContents.filter(Boolean);
+        };
 
         const isProd = process.env.NODE_ENV === "production";
 
@@ -85,18 +101,39 @@ export function useAnalyze() {
 
         const url = `${baseUrl}/chat/rag`;
 
-        setState({ status: "idle", message: "Starting analysis..." });
-        const ragResponse = await fetch(url, {
-          method: "POST",
-          headers: {
-            "Content-Type": "application/json",
-          },
-          body: JSON.stringify({
-            question,
-            files: validFiles,
-            selected_file_path: selectedFilePath,
-          }),
-        });
+        const postQuestion = async (
+          source: { snapshot_id: string } | { files: unknown[] }
+        ) =>
+          fetch(url, {
+            method: "POST",
+            headers: {
+              "Content-Type": "application/json",
+            },
+            body: JSON.stringify({
+              question,
+              ...source,
+              selected_file_path: selectedFilePath,
+              session_id: sessionIds.current[snapshotKey],
+            }),
+          });
+
+        let ragResponse: Response | null = null;
+        const cachedSnapshotId = snapshotIds.current[snapshotKey];
+        if (cachedSnapshotId) {
+          setState({ status: "idle", message: "Starting analysis..." });
+          ragResponse = await postQuestion({ snapshot_id: cachedSnapshotId });
+          if (ragResponse.status === 404) {
+            // Snapshot expired server-side; fall back to uploading the files
+            delete snapshotIds.current[snapshotKey];
+            ragResponse = null;
+          }
+        }
+
+        if (!ragResponse) {
+          const validFiles = await loadFiles();
+          setState({ status: "idle", message: "Starting analysis..." });
+          ragResponse = await postQuestion({ files: validFiles });
+        }
 
         if (!ragResponse.ok || !ragResponse.body) {
           throw new Error(`HTTP error! status: ${ragResponse.status}`);
@@ -138,6 +175,12 @@ export function useAnalyze() {
                         }));
                         break;
                       case "embedded":
+                        if (data.snapshot_id) {
+                          snapshotIds.current[snapshotKey] = data.snapshot_id;
+                        }
+                        if (data.session_id) {
+                          sessionIds.current[snapshotKey] = data.session_id;
+                        }
                         setState((prev) => ({
                           ...prev,
                           status: "embedding",
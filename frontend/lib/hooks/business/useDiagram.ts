@@ -51,6 +51,9 @@ interface StreamResponse {
   error?: string;
 }
 
+// How many times a dropped diagram stream is resumed before giving up
+const MAX_STREAM_RECONNECTS = 3;
+
 export function useDiagram(username: string, repo: string) {
   const [state, setState] = useState<StreamState>({ status: "idle" });
   const [diagram, setDiagram] = useState<string>("");
@@ -96,17 +99,20 @@ export function useDiagram(username: string, repo: string) {
           throw new Error("Failed to start streaming");
         }
 
-        const reader = response.body?.getReader();
-        if (!reader) {
-          throw new Error("Failed to get reader");
-        }
+        // Id of the server-side run, used to resume the stream after a dropped
+        // connection without regenerating anything
+        const runId = response.headers.get("X-Run-Id");
+        let lastEventId = 0;
+        let finished = false;
 
         let explanation = "";
         let mapping = "";
         let diagram = "";
         let phaseProgress = 0;
 
-        const processStream = async () => {
+        const processStream = async (
+          reader: ReadableStreamDefaultReader<Uint8Array>
+        ) => {
           try {
             let buffer = "";
 
@@ -123,7 +129,9 @@ export function useDiagram(username: string, repo: string) {
               buffer = lines.pop() || "";
 
               for (const line of lines) {
-                if (line.startsWith("data: ")) {
+                if (line.startsWith("id: ")) {
+                  lastEventId = Number(line.slice(4)) || lastEventId;
+                } else if (line.startsWith("data: ")) {
                   const jsonData = line.slice(6).trim();
 
                   // Skip empty data lines
@@ -133,6 +141,7 @@ export function useDiagram(username: string, repo: string) {
                     const data = JSON.parse(jsonData) as StreamResponse;
 
                     if (data.error) {
+                      finished = true;
                       setState({
                         status: "error",
                         error: data.error,
@@ -306,6 +315,7 @@ export function useDiagram(username: string, repo: string) {
                         }
                         break;
                       case "complete":
+                        finished = true;
                         setState((prev) => ({
                           ...prev,
                           status: "complete",
@@ -321,6 +331,7 @@ export function useDiagram(username: string, repo: string) {
                         setLastGenerated(date ? new Date(date) : undefined);
                         break;
                       case "error":
+                        finished = true;
                         setState({
                           status: "error",
                           error: data.error,
@@ -345,7 +356,32 @@ export function useDiagram(username: string, repo: string) {
             reader.releaseLock();
           }
         };
-        await processStream();
+
+        let reader = response.body?.getReader();
+        if (!reader) {
+          throw new Error("Failed to get reader");
+        }
+        for (let attempt = 0; ; attempt++) {
+          try {
+            await processStream(reader);
+          } catch (error) {
+            if (!runId || attempt >= MAX_STREAM_RECONNECTS) throw error;
+          }
+          if (finished || !runId || attempt >= MAX_STREAM_RECONNECTS) break;
+
+          // The connection dropped before the run finished: replay the events
+          // we missed from the server's buffer and keep following the run
+          await new Promise((resolve) =>
+            setTimeout(resolve, 1000 * (attempt + 1))
+          );
+          const resumed = await fetch(`${url}/${runId}`, {
+            headers: { "Last-Event-ID": String(lastEventId) },
+          });
+          if (!resumed.ok || !resumed.body) {
+            throw new Error("Lost connection to the diagram stream");
+          }
+          reader = resumed.body.getReader();
+        }
       } catch (error) {
         setState({
           status: "error",
@@ -8,10 +8,13 @@ import {
   timestamp,
   boolean,
   integer,
+  serial,
   foreignKey,
   primaryKey,
   pgEnum,
   decimal,
+  index,
+  customType,
 } from "drizzle-orm/pg-core";
 import { sql } from "drizzle-orm";
 
@@ -21,14 +24,282 @@ export const subscriptionPlan = pgEnum("subscription_plan", [
   "ENTERPRISE",
 ]);
 
-export const repoChunks = pgTable("repo_chunks", {
-  id: uuid().defaultRandom().primaryKey().notNull(),
-  repoHash: text("repo_hash"),
-  source: text(),
-  chunk: text(),
-  embedding: vector({ dimensions: 1536 }),
+const tsvector = customType<{ data: string }>({
+  dataType() {
+    return "tsvector";
+  },
 });
 
+const bytea = customType<{ data: Buffer }>({
+  dataType() {
+    return "bytea";
+  },
+});
+
+// Content-addressed chunk storage shared across repositories; keyed by the
+// SHA-256 of the chunk text
+export const chunkEmbeddings = pgTable(
+  "chunk_embeddings",
+  {
+    chunkHash: text("chunk_hash").primaryKey().notNull(),
+    chunk: text().notNull(),
+    embedding: vector({ dimensions: 1536 }),
+    // o200k_base token count, computed once at embed time
+    tokenCount: integer("token_count"),
+    // Full-text search vector for hybrid retrieval; the config must match
+    // TS_CONFIG in backend/app/rag/retriever_pgvector.py
+    chunkTsv: tsvector("chunk_tsv").generatedAlwaysAs(
+      sql`to_tsvector('english', chunk)`
+    ),
+    createdAt: timestamp("created_at", { withTimezone: true, mode: "string" })
+      .default(sql`CURRENT_TIMESTAMP`)
+      .notNull(),
+  },
+  (table) => [
+    index("chunk_embeddings_chunk_tsv_idx").using("gin", table.chunkTsv),
+  ]
+);
+
+// Membership of chunks in a repository snapshot (repo_hash)
+export const repoChunks = pgTable(
+  "repo_chunks",
+  {
+    id: uuid().defaultRandom().primaryKey().notNull(),
+    repoHash: text("repo_hash"),
+    source: text(),
+    // Top-level definition(s) the chunk covers and its first line in the file
+    symbol: text(),
+    startLine: integer("start_line"),
+    chunkHash: text("chunk_hash"),
+  },
+  (table) => [
+    index("repo_chunks_repo_hash_idx").on(table.repoHash),
+    index("repo_chunks_chunk_hash_idx").on(table.chunkHash),
+  ]
+);
+
+// Server-side repository snapshots for RAG chat; the id is the repo content hash
+// used as repo_chunks.repo_hash
+export const repoSnapshots = pgTable(
+  "repo_snapshots",
+  {
+    id: text().primaryKey().notNull(),
+    owner: varchar({ length: 256 }),
+    repo: varchar({ length: 256 }),
+    commitSha: varchar("commit_sha", { length: 64 }),
+    fileCount: integer("file_count").notNull(),
+    createdAt: timestamp("created_at", { withTimezone: true, mode: "string" })
+      .default(sql`CURRENT_TIMESTAMP`)
+      .notNull(),
+    lastAccessedAt: timestamp("last_accessed_at", {
+      withTimezone: true,
+      mode: "string",
+    })
+      .default(sql`CURRENT_TIMESTAMP`)
+      .notNull(),
+  },
+  (table) => [
+    index("repo_snapshots_owner_repo_commit_idx").on(
+      table.owner,
+      table.repo,
+      table.commitSha
+    ),
+  ]
+);
+
+export const repoSnapshotFiles = pgTable(
+  "repo_snapshot_files",
+  {
+    snapshotId: text("snapshot_id").notNull(),
+    path: text().notNull(),
+    content: text().notNull(),
+  },
+  (table) => [
+    primaryKey({
+      columns: [table.snapshotId, table.path],
+      name: "repo_snapshot_files_snapshot_id_path_pk",
+    }),
+    foreignKey({
+      columns: [table.snapshotId],
+      foreignColumns: [repoSnapshots.id],
+      name: "repo_snapshot_files_snapshot_id_fk",
+    }).onDelete("cascade"),
+  ]
+);
+
+// Background embedding jobs, one per snapshot; claimed by backend workers with
+// FOR UPDATE SKIP LOCKED. status: queued, running, done, failed
+export const embedJobs = pgTable(
+  "embed_jobs",
+  {
+    snapshotId: text("snapshot_id").primaryKey().notNull(),
+    status: varchar({ length: 16 }).default("queued").notNull(),
+    chunksTotal: integer("chunks_total"),
+    chunksDone: integer("chunks_done").default(0).notNull(),
+    attempts: integer().default(0).notNull(),
+    error: text(),
+    // When a queued job that failed may be retried; null for no delay
+    nextAttemptAt: timestamp("next_attempt_at", {
+      withTimezone: true,
+      mode: "string",
+    }),
+    createdAt: timestamp("created_at", { withTimezone: true, mode: "string" })
+      .default(sql`CURRENT_TIMESTAMP`)
+      .notNull(),
+    updatedAt: timestamp("updated_at", { withTimezone: true, mode: "string" })
+      .default(sql`CURRENT_TIMESTAMP`)
+      .notNull(),
+  },
+  (table) => [
+    index("embed_jobs_status_created_at_idx").on(table.status, table.createdAt),
+    foreignKey({
+      columns: [table.snapshotId],
+      foreignColumns: [repoSnapshots.id],
+      name: "embed_jobs_snapshot_id_fk",
+    }).onDelete("cascade"),
+  ]
+);
+
+// Server-side RAG chat conversations; snapshot_id follows the client to newer
+// snapshots, so it is not a foreign key
+export const chatSessions = pgTable("chat_sessions", {
+  id: text().primaryKey().notNull(),
+  snapshotId: text("snapshot_id").notNull(),
+  // One line per compacted turn, capped by the backend's token budget
+  summary: text().default("").notNull(),
+  summaryTokens: integer("summary_tokens").default(0).notNull(),
+  createdAt: timestamp("created_at", { withTimezone: true, mode: "string" })
+    .default(sql`CURRENT_TIMESTAMP`)
+    .notNull(),
+  updatedAt: timestamp("updated_at", { withTimezone: true, mode: "string" })
+    .default(sql`CURRENT_TIMESTAMP`)
+    .notNull(),
+});
+
+export const chatTurns = pgTable(
+  "chat_turns",
+  {
+    id: serial().primaryKey().notNull(),
+    sessionId: text("session_id").notNull(),
+    turnIndex: integer("turn_index").notNull(),
+    question: text().notNull(),
+    answer: text().notNull(),
+    chunkHashes: text("chunk_hashes").array(),
+    tokens: integer().notNull(),
+    compacted: boolean().default(false).notNull(),
+    createdAt: timestamp("created_at", { withTimezone: true, mode: "string" })
+      .default(sql`CURRENT_TIMESTAMP`)
+      .notNull(),
+  },
+  (table) => [
+    unique("chat_turns_session_id_turn_index_unique").on(
+      table.sessionId,
+      table.turnIndex
+    ),
+    foreignKey({
+      columns: [table.sessionId],
+      foreignColumns: [chatSessions.id],
+      name: "chat_turns_session_id_fk",
+    }).onDelete("cascade"),
+  ]
+);
+
+// Token usage of every upstream LLM call, recorded by the backend and used to
+// calibrate the /generate/cost and /readme/cost estimates
+export const llmUsage = pgTable(
+  "llm_usage",
+  {
+    id: serial().primaryKey().notNull(),
+    // Groups the calls made for one user request
+    requestId: text("request_id"),
+    route: varchar({ length: 32 }).notNull(),
+    phase: varchar({ length: 32 }).default("").notNull(),
+    userId: text("user_id"),
+    model: varchar({ length: 64 }).notNull(),
+    streamed: boolean().notNull(),
+    // Size of the request's input as seen by the cost estimate
+    inputTokens: integer("input_tokens"),
+    promptTokens: integer("prompt_tokens").notNull(),
+    completionTokens: integer("completion_tokens").notNull(),
+    reasoningTokens: integer("reasoning_tokens").default(0).notNull(),
+    cachedTokens: integer("cached_tokens").default(0).notNull(),
+    estimatedPromptTokens: integer("estimated_prompt_tokens").notNull(),
+    durationMs: integer("duration_ms").notNull(),
+    createdAt: timestamp("created_at", { withTimezone: true, mode: "string" })
+      .default(sql`CURRENT_TIMESTAMP`)
+      .notNull(),
+  },
+  (table) => [
+    index("llm_usage_route_created_at_idx").on(table.route, table.createdAt),
+    index("llm_usage_created_at_idx").on(table.createdAt),
+  ]
+);
+
+// Repository data generation starts from, cached by the backend per head commit.
+// `tree` is a serialized RepoTree; the default branch and README are filled in
+// by generation, after a cost preview may have stored the tree alone
+export const githubDataCache = pgTable(
+  "github_data_cache",
+  {
+    owner: varchar({ length: 256 }).notNull(),
+    repo: varchar({ length: 256 }).notNull(),
+    commitSha: varchar("commit_sha", { length: 64 }).notNull(),
+    defaultBranch: text("default_branch"),
+    tree: bytea().notNull(),
+    readme: text(),
+    createdAt: timestamp("created_at", { withTimezone: true, mode: "string" })
+      .default(sql`CURRENT_TIMESTAMP`)
+      .notNull(),
+    updatedAt: timestamp("updated_at", { withTimezone: true, mode: "string" })
+      .default(sql`CURRENT_TIMESTAMP`)
+      .notNull(),
+  },
+  (table) => [
+    primaryKey({
+      columns: [table.owner, table.repo, table.commitSha],
+      name: "github_data_cache_owner_repo_commit_sha_pk",
+    }),
+    index("github_data_cache_updated_at_idx").on(table.updatedAt),
+  ]
+);
+
+// Optional persistence of resumable SSE runs (backend SSE_RUN_PERSIST=1), so a
+// client reconnecting to another backend process can replay missed events
+export const streamRuns = pgTable("stream_runs", {
+  id: text().primaryKey().notNull(),
+  kind: varchar({ length: 32 }).notNull(),
+  status: varchar({ length: 16 }).default("running").notNull(),
+  createdAt: timestamp("created_at", { withTimezone: true, mode: "string" })
+    .default(sql`CURRENT_TIMESTAMP`)
+    .notNull(),
+  updatedAt: timestamp("updated_at", { withTimezone: true, mode: "string" })
+    .default(sql`CURRENT_TIMESTAMP`)
+    .notNull(),
+  // Heartbeat of clients following the run from another worker process
+  followedAt: timestamp("followed_at", { withTimezone: true, mode: "string" }),
+});
+
+export const streamRunEvents = pgTable(
+  "stream_run_events",
+  {
+    runId: text("run_id").notNull(),
+    eventId: integer("event_id").notNull(),
+    // The complete SSE frame, including its id: line
+    frame: text().notNull(),
+  },
+  (table) => [
+    primaryKey({
+      columns: [table.runId, table.eventId],
+      name: "stream_run_events_run_id_event_id_pk",
+    }),
+    foreignKey({
+      columns: [table.runId],
+      foreignColumns: [streamRuns.id],
+      name: "stream_run_events_run_id_fk",
+    }).onDelete("cascade"),
+  ]
+);
+
 export const users = pgTable(
   "users",
   {